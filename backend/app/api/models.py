@@ -24,7 +24,7 @@ class GeminiImageResponse(BaseModel):
     """Response model for image generation tasks."""
     status: str = Field(..., description="Status of the response (success or error)")
     model: Optional[str] = Field(None, description="Model used for the response")
-    images: Optional[List[Dict[str, str]]] = Field(None, description="List of generated images as base64")
+    images: Optional[List[Dict[str, Any]]] = Field(None, description="List of generated images as base64")
     text: Optional[str] = Field(None, description="Generated text accompanying the images")
     error: Optional[str] = Field(None, description="Error message if status is error")
     task_id: Optional[str] = Field(None, description="Task ID for tracking")
@@ -39,11 +39,19 @@ class StreamRequest(BaseModel):
     additional_params: Optional[Dict[str, Any]] = Field(None, description="Additional parameters for the Claude API")
     task_id: Optional[str] = Field(None, description="Custom task ID for tracking. If not provided, a UUID will be generated.")
     # Image generation parameters
-    number_of_images: Optional[int] = Field(1, description="Number of images to generate (1-4)")
+    number_of_images: Optional[int] = Field(1, ge=1, le=4, description="Number of images or 3D variants to generate (1-4)")
     aspect_ratio: Optional[str] = Field("1:1", description="Aspect ratio for generated images (1:1, 16:9, 4:3, etc)")
     negative_prompt: Optional[str] = Field(None, description="Negative prompt for image generation")
     # Base64 encoded image for multi-modal inputs
     image_base64: Optional[str] = Field(None, description="Base64 encoded image for multi-modal inputs")
+    # Pipeline parameters
+    pipeline: Optional[List[str]] = Field(None, description="Stages for the 3d_magic pipeline, e.g. [\"image\", \"3d\"] or [\"image\", \"trellis\"]")
+    # Preview shape the sketch belongs to, for routing small changes to an edit
+    shape_id: Optional[str] = Field(None, description="ID of the preview shape; small changes to its last sketch are applied as edits")
+    # Scene session parameters for edits
+    base_version_id: Optional[str] = Field(None, description="Server-held scene version to edit instead of threejs_code")
+    session_id: Optional[str] = Field(None, description="Scene session whose latest version is updated by the edit")
+    edit_mode: Optional[str] = Field(None, description="\"diff\" for search/replace patches or \"full\" for a full rewrite (default: diff with a base version, full otherwise)")
 
 class TaskResponse(BaseModel):
     """Response model for task submission."""
@@ -57,6 +65,19 @@ class TaskStatusResponse(BaseModel):
     status: str = Field(..., description="Status of the task (pending, completed, failed)")
     result: Optional[Union[ClaudeResponse, GeminiImageResponse]] = Field(None, description="Result of the task if completed")
 
+class SceneVersionRequest(BaseModel):
+    code: str = Field(..., description="Three.js scene code")
+    parent_id: Optional[str] = Field(None, description="Version this code was derived from")
+    session_id: Optional[str] = Field(None, description="Scene session to point at this version")
+
+class CerebrasBatchRequest(BaseModel):
+    snippets: List[str] = Field(..., min_length=1, max_length=64, description="Scene code snippets to extract objects from")
+
+class ProfileCaptureRequest(BaseModel):
+    target: str = Field("worker", description="Processes to profile: \"api\", \"worker\" or \"all\"")
+    mode: str = Field("sample", description="\"sample\" for a stack-sampling profile or \"memory\" for a tracemalloc diff")
+    seconds: float = Field(10, gt=0, le=300, description="How long to capture for (capped at PROFILE_MAX_SECONDS)")
+
 class TrellisWebhookConfig(BaseModel):
     endpoint: Optional[str] = None
     secret: Optional[str] = None
@@ -1,20 +1,33 @@
-from fastapi import APIRouter, HTTPException, Request, Body, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Request, Response, Body, Header, Query, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 from app.api.models import (
     ClaudeResponse, StreamRequest, TaskResponse, TaskStatusResponse, 
-    GeminiImageResponse, TrellisRequest, TrellisResponse
+    GeminiImageResponse, TrellisRequest, TrellisResponse, CerebrasBatchRequest, SceneVersionRequest,
+    ProfileCaptureRequest
 )
-from app.tasks.claude_tasks import ClaudePromptTask, ClaudeEditTask
-from app.tasks.gemini_tasks import GeminiPromptTask, GeminiImageGenerationTask
-from app.tasks.cerebras_tasks import get_cerebras_client
+from app.core.celery_app import celery_app
+from app.core.pipelines import validate_pipeline, DEFAULT_PIPELINE
 from app.core.redis import redis_service
 from app.core.config import settings
+from app.core.trellis import trellis_poller, is_final_status, submit_trellis_job
+from app.core.glb_cache import glb_cache, parse_byte_range
+from app.core.artifacts import artifact_store
+from app.core.scenes import scene_store
+from app.core.code import code_fingerprint
+from app.core.serialization import dumps, dumps_text, decode_event
+from app.core.metrics import OPEN_STREAMS, PAYLOAD_SIZE
+from app.core.tracing import traced, set_span_attributes
+from app.core.profiling import is_admin, request_capture, list_profiles, get_profile, PROFILE_FORMATS
+import base64
 import json
 import uuid
+import hmac
+import time
 import asyncio
-from typing import Dict, Any
+import anyio
+from typing import Dict, Any, Optional
 from celery.result import AsyncResult
-import re
 import httpx
 import os
 from fastapi import BackgroundTasks
@@ -22,17 +35,20 @@ from fastapi import BackgroundTasks
 # Create the router
 router = APIRouter()
 
-# Trellis API URL
-TRELLIS_API_URL = "https://api.piapi.ai/api/v1/task"
+# Tasks are queued by name, so the API never imports the task modules and the
+# provider SDKs behind them; only the workers do
+CLAUDE_PROMPT_TASK_NAME = "app.tasks.claude_tasks.ClaudePromptTask"
+CLAUDE_EDIT_TASK_NAME = "app.tasks.claude_tasks.ClaudeEditTask"
+GEMINI_IMAGE_TASK_NAME = "app.tasks.gemini_tasks.GeminiImageGenerationTask"
+PIPELINE_TASK_NAME = "app.tasks.pipeline_tasks.PipelineTask"
 
 async def get_task_result(task_id: str) -> Dict[str, Any]:
     """Get the result of a task from Redis or Celery."""
     # Try to get the result from Redis
-    result_json = redis_service.get_value(f"task_response:{task_id}")
+    result = redis_service.get_response(task_id)
     
-    if result_json:
-        # Parse the result from Redis
-        return json.loads(result_json)
+    if result is not None:
+        return result
     
     # Check if the task exists in Celery
     task_result = AsyncResult(task_id)
@@ -75,24 +91,33 @@ async def get_task_status(task_id: str):
     )
 
 @router.post("/queue/{type}", response_model=TaskResponse)
+@traced("queue_task")
 async def queue_task(type: str, request: StreamRequest):
     """Start a task based on the specified type.
     
     Types:
-    - 3d: Uses Claude 3.7 for 3D generation
-    - 3d_magic: For 3D magic generation (unimplemented)
-    - image: For image generation using Gemini Imagen
+    - 3d: Uses Claude 3.7 for 3D generation (number_of_images variants in parallel; small
+      changes to a shape_id's previous sketch are routed to an edit)
+    - 3d_magic: Runs a server-side pipeline (default: Gemini cleanup then Claude 3D) in one task
+    - image: For image generation using Gemini Imagen (number_of_images variants in parallel)
     - extract_object: For object extraction (unimplemented)
     - llama: Uses Cerebras LLaMA model
-    - edit: Uses Claude 3.7 to edit existing Three.js code
+    - edit: Uses Claude 3.7 to edit existing Three.js code (or a stored scene version, returning a diff)
     """
+    accepted_at = time.time()
+    
     # Generate a task ID if not provided
     task_id = request.task_id or str(uuid.uuid4())
+    set_span_attributes(task_id=task_id, task_type=type)
+    PAYLOAD_SIZE.labels("request").observe(
+        len(request.image_base64 or "") + len(request.threejs_code or "") + len(request.prompt)
+    )
     
     # Handle different task types
     if type == "3d":
         # Use the existing Claude implementation
-        ClaudePromptTask.apply_async(
+        celery_app.send_task(
+            CLAUDE_PROMPT_TASK_NAME,
             args=[
                 task_id,
                 request.image_base64,
@@ -102,19 +127,32 @@ async def queue_task(type: str, request: StreamRequest):
                 request.temperature,
                 request.additional_params
             ],
+            kwargs={
+                "number_of_images": request.number_of_images,
+                "aspect_ratio": request.aspect_ratio,
+                "negative_prompt": request.negative_prompt,
+                "shape_id": request.shape_id
+            },
             task_id=task_id
         )
     elif type == "edit":
-        # Validate Three.js code is provided in additional_params
-        if not request.threejs_code:
-            raise HTTPException(status_code=400, detail="Three.js code is required for editing")
+        # Validate Three.js code is provided directly or as a stored version
+        if not request.threejs_code and not request.base_version_id:
+            raise HTTPException(status_code=400, detail="Three.js code or a base version is required for editing")
+        
+        if request.base_version_id and scene_store.get(request.base_version_id) is None:
+            raise HTTPException(status_code=404, detail="Base version not found or expired")
+        
+        if request.edit_mode not in (None, "diff", "full"):
+            raise HTTPException(status_code=400, detail="Edit mode must be \"diff\" or \"full\"")
         
         # At least one of image or prompt must be provided
         if not request.image_base64 and not request.prompt:
             raise HTTPException(status_code=400, detail="At least one of image or text prompt must be provided")
         
         # Use the ClaudeEditTask for code editing
-        ClaudeEditTask.apply_async(
+        celery_app.send_task(
+            CLAUDE_EDIT_TASK_NAME,
             args=[
                 task_id,
                 request.threejs_code,
@@ -125,16 +163,43 @@ async def queue_task(type: str, request: StreamRequest):
                 request.temperature,
                 request.additional_params
             ],
+            kwargs={
+                "base_version_id": request.base_version_id,
+                "session_id": request.session_id,
+                "edit_mode": request.edit_mode
+            },
             task_id=task_id
         )
     elif type == "3d_magic":
-        # TODO: Implement 3D magic generation
-        pass
+        if not request.image_base64:
+            raise HTTPException(status_code=400, detail="Image base64 is required for 3D magic generation")
+        
+        # Validate the pipeline before queueing it
+        stages = request.pipeline or DEFAULT_PIPELINE
+        try:
+            validate_pipeline(stages)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # Run every stage in one task, streamed to this task ID
+        celery_app.send_task(
+            PIPELINE_TASK_NAME,
+            args=[
+                task_id,
+                request.image_base64,
+                request.prompt,
+                stages,
+                request.max_tokens,
+                request.temperature
+            ],
+            task_id=task_id
+        )
     elif type == "image":
         # Check if we're generating images or processing an image with text
         if request.image_base64:
             # Image is required for GeminiImageGenerationTask
-            GeminiImageGenerationTask.apply_async(
+            celery_app.send_task(
+                GEMINI_IMAGE_TASK_NAME,
                 args=[
                     task_id,
                     request.image_base64,
@@ -144,6 +209,11 @@ async def queue_task(type: str, request: StreamRequest):
                     request.temperature,
                     request.additional_params
                 ],
+                kwargs={
+                    "number_of_images": request.number_of_images,
+                    "aspect_ratio": request.aspect_ratio,
+                    "negative_prompt": request.negative_prompt
+                },
                 task_id=task_id
             )
         else:
@@ -152,43 +222,135 @@ async def queue_task(type: str, request: StreamRequest):
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported task type: {type}")
     
+    # Start the task's timeline; the worker adds the remaining stages
+    redis_service.store_timeline(task_id, {"accepted": round(accepted_at, 4), "enqueued": round(time.time(), 4)})
+    
     # Return the task ID for SSE subscription
     return TaskResponse(task_id=task_id)
 
-async def event_generator(task_id: str, request: Request):
-    """Generate SSE events from Redis pub/sub."""
+@router.get("/task/{task_id}/timeline")
+async def get_task_timeline(task_id: str):
+    """Get how long a task spent between each stage, from acceptance to its stored response."""
+    timeline = redis_service.get_timeline(task_id)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="Timeline not found or expired")
+    return timeline
+
+@router.get("/tasks/slowest")
+async def get_slowest_tasks(limit: int = Query(10, ge=1, le=100)):
+    """Get the timelines of the slowest tasks that finished in the last TIMELINE_SLOW_WINDOW seconds."""
+    return {
+        "window_seconds": settings.TIMELINE_SLOW_WINDOW,
+        "tasks": redis_service.get_slowest_timelines(limit)
+    }
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject requests without the admin token."""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@router.post("/admin/profile/capture", dependencies=[Depends(require_admin)])
+async def capture_profile(request_data: ProfileCaptureRequest):
+    """Ask running API or worker processes to profile themselves for a number of seconds.
+    
+    Each process that receives the request stores its own result; list them
+    with /admin/profiles and filter by the returned capture_id.
+    """
+    if request_data.target not in ("api", "worker", "all"):
+        raise HTTPException(status_code=400, detail="Target must be \"api\", \"worker\" or \"all\"")
+    if request_data.mode not in ("sample", "memory"):
+        raise HTTPException(status_code=400, detail="Mode must be \"sample\" or \"memory\"")
+    
+    capture = request_capture(request_data.target, request_data.mode, min(request_data.seconds, settings.PROFILE_MAX_SECONDS))
+    if not capture["receivers"]:
+        raise HTTPException(status_code=503, detail="No process is listening for profile requests")
+    return capture
+
+@router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles(capture_id: Optional[str] = None):
+    """List stored profiles, newest first."""
+    profiles = list_profiles()
+    if capture_id:
+        profiles = [profile for profile in profiles if profile.get("capture_id") == capture_id]
+    return {"profiles": profiles}
+
+@router.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    """Download a profile as a pstats, speedscope or tracemalloc JSON file."""
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    
+    extension, media_type = PROFILE_FORMATS[profile["format"]]
+    return Response(
+        content=profile["data"],
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=\"{profile['kind']}-{profile_id}{extension}\""}
+    )
+
+async def event_generator(task_id: str, request: Request, shutdown_event: Optional[anyio.Event] = None):
+    """Generate SSE events from Redis pub/sub.
+    
+    Once shutdown_event is set, the stream keeps going for up to SSE_DRAIN_SECONDS
+    so the task can finish. After that the client gets a "reconnect" event with a
+    retry hint, so it resubscribes to another API process.
+    
+    A task that finished before the subscription, e.g. while the client was
+    reconnecting, won't publish again, so its stored response is sent as the
+    final event instead.
+    """
     # Subscribe to the Redis channel
-    pubsub = redis_service.subscribe(f"task_stream:{task_id}")
+    pubsub = await redis_service.subscribe_async(f"task_stream:{task_id}")
+    OPEN_STREAMS.labels("sse").inc()
+    drain_deadline = None
     
     try:
         # Check if the client is still connected
         while not await request.is_disconnected():
-            # Get message from Redis pub/sub
-            message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            # Hand the stream off if the server is shutting down and the task is still running
+            if shutdown_event is not None and shutdown_event.is_set():
+                drain_deadline = drain_deadline or time.monotonic() + settings.SSE_DRAIN_SECONDS
+                if time.monotonic() >= drain_deadline:
+                    yield {
+                        "event": "reconnect",
+                        "data": dumps_text({"task_id": task_id, "reason": "server shutting down"}),
+                        "retry": settings.SSE_RETRY_MS
+                    }
+                    break
+            
+            # Wait for a message from Redis pub/sub; the first call returns None
+            # once the subscription is confirmed, without waiting
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=settings.SSE_RESPONSE_CHECK_SECONDS)
             
             if message:
-                data = json.loads(message["data"])
-                event_type = data.get("event")
-                event_data = data.get("data")
+                # The data is forwarded as the worker encoded it
+                event_type, event_data = decode_event(message["data"])
                 
                 # Yield the event
                 yield {
                     "event": event_type,
-                    "data": json.dumps(event_data)
+                    "data": event_data
                 }
                 
                 # If this is the completion event, exit the loop
                 if event_type in ["complete", "error"]:
                     break
-                    
-            # Small sleep to prevent CPU spinning
-            await asyncio.sleep(0.01)
+                continue
+            
+            # Workers publish before storing, so a stored response means the final event was missed
+            stored_response = await redis_service.get_response_async(task_id)
+            if stored_response is not None:
+                yield {
+                    "event": "error" if stored_response.get("status") == "error" else "complete",
+                    "data": dumps_text(stored_response)
+                }
+                break
             
     except Exception as e:
         # Yield an error event
         yield {
             "event": "error",
-            "data": json.dumps({
+            "data": dumps_text({
                 "status": "error",
                 "error": str(e),
                 "error_type": type(e).__name__,
@@ -197,70 +359,178 @@ async def event_generator(task_id: str, request: Request):
         }
     finally:
         # Always unsubscribe from the channel
-        pubsub.unsubscribe(f"task_stream:{task_id}")
-        pubsub.close()
+        OPEN_STREAMS.labels("sse").dec()
+        await pubsub.unsubscribe(f"task_stream:{task_id}")
+        await pubsub.aclose()
 
 @router.get("/subscribe/{task_id}")
 async def subscribe_claude_events(task_id: str, request: Request):
     """Stream events from a Claude 3.7 task."""
+    # Set on server shutdown; the stream is only cancelled once the grace period,
+    # a little longer than the drain, has passed
+    shutdown_event = anyio.Event()
+    
     # Return an event source response
-    return EventSourceResponse(event_generator(task_id, request))
+    return EventSourceResponse(
+        event_generator(task_id, request, shutdown_event),
+        shutdown_event=shutdown_event,
+        shutdown_grace_period=settings.SSE_DRAIN_SECONDS + 2
+    )
+
+@router.get("/artifact/{ref}")
+async def get_artifact(ref: str):
+    """Download an intermediate artifact produced by a pipeline stage."""
+    artifact = artifact_store.get(ref)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Artifact not found or expired")
+    
+    # Images are stored as base64 and served as raw bytes
+    if artifact["kind"] == "image":
+        return Response(content=base64.b64decode(artifact["data"]), media_type=artifact["mime_type"] or "image/png")
+    
+    return Response(content=artifact["data"], media_type=artifact["mime_type"] or "text/plain")
+
+@router.post("/scene/version")
+async def create_scene_version(request_data: SceneVersionRequest):
+    """Store a version of scene code so edits can refer to it by ID."""
+    version_id = scene_store.put(request_data.code, request_data.parent_id, request_data.session_id)
+    return {"version_id": version_id, "session_id": request_data.session_id}
+
+@router.get("/scene/version/{version_id}")
+async def get_scene_version(version_id: str):
+    """Get a stored version of scene code."""
+    version = scene_store.get(version_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Scene version not found or expired")
+    return version
+
+@router.get("/scene/session/{session_id}")
+async def get_scene_session(session_id: str):
+    """Get the latest version of a scene session."""
+    version_id = scene_store.get_head(session_id)
+    if version_id is None:
+        raise HTTPException(status_code=404, detail="Scene session not found or expired")
+    return {"session_id": session_id, "version_id": version_id}
+
+@router.get("/sketch/routes")
+async def get_sketch_route_stats():
+    """Get how often sketches were regenerated, edited or reused, and the latency this saved."""
+    # Imported here since the sketch diffing behind the store loads numpy and PIL
+    from app.core.sketches import sketch_store
+    return sketch_store.stats()
+
+@router.get("/repair/stats")
+async def get_syntax_repair_stats():
+    """Get how often generated code failed to parse, how often it was repaired and the latency repairs added."""
+    # Imported here since the syntax checks behind the stats load esprima
+    from app.core.repair import get_repair_stats
+    return {provider: get_repair_stats(provider) for provider in ["claude", "cerebras"]}
+
+def import_cerebras_tasks():
+    """Load the Cerebras extraction helpers on first use.
+    
+    The parse endpoints are the only API code that calls a provider directly,
+    so the Cerebras SDK is only loaded once one of them is used.
+    """
+    from app.tasks import cerebras_tasks
+    return cerebras_tasks
 
 @router.post("/cerebras/parse")
 async def parse_code_with_cerebras(code: str = Body(..., media_type="text/plain")):
     """Direct endpoint to parse code using Cerebras LLaMA model without SSE.
     
     Takes a plain text body containing the code to be parsed and returns the result directly.
+    Code produced by a 3D generation or edit has usually been extracted speculatively
+    already, in which case the cached result is returned instantly.
     """
-    # Initialize Cerebras client
-    client = await get_cerebras_client()
-    
-    # Prepare the message parameters
-    messages = [
-        {
-            "role": "system",
-            "content": ""
-        },
-        {
-            "role": "user",
-            "content": """You are provided with a JavaScript snippet containing a Three.js scene. Extract only the main 3D object creation code, including relevant geometries, materials, meshes, and groups. Completely remove all unrelated elements such as the scene, renderer, camera, lighting, ground planes, animation loops, event listeners, orbit controls, and window resize handling.
+    cerebras_tasks = import_cerebras_tasks()
+    
+    # Return the parsed code directly
+    return await cerebras_tasks.get_or_extract_object(code)
 
-Present the resulting code directly, ending with a single statement explicitly returning only the main object (THREE.Mesh or THREE.Group) that was created.
+@router.post("/cerebras/parse/stream")
+async def stream_parse_code_with_cerebras(code: str = Body(..., media_type="text/plain")):
+    """Parse code using Cerebras LLaMA model, streaming the extracted code over SSE.
+    
+    Emits "delta" events with pieces of the extracted code as the model produces
+    them, then a "complete" event with the same result as /cerebras/parse.
+    Cached extractions are sent as a single delta followed by the complete event.
+    """
+    fingerprint = code_fingerprint(code)
+    cerebras_tasks = import_cerebras_tasks()
+    
+    async def generate():
+        try:
+            cached = await cerebras_tasks.wait_for_extraction(fingerprint)
+            if cached is not None:
+                yield {"event": "delta", "data": dumps_text({"content": cached["content"]})}
+                yield {"event": "complete", "data": dumps_text({**cached, "cached": True})}
+                return
+            
+            client = await cerebras_tasks.get_cerebras_client()
+            async for event_type, event_data in cerebras_tasks.stream_extract_object(client, code):
+                if event_type == "delta":
+                    yield {"event": "delta", "data": dumps_text({"content": event_data})}
+                else:
+                    cerebras_tasks.cache_extraction(fingerprint, event_data)
+                    yield {"event": "complete", "data": dumps_text(event_data)}
+                    
+        except Exception as e:
+            # Yield an error event
+            yield {
+                "event": "error",
+                "data": dumps_text({
+                    "status": "error",
+                    "error": str(e),
+                    "error_type": type(e).__name__
+                })
+            }
+    
+    return EventSourceResponse(generate())
 
-Do not wrap the code in a function or module. Do not import anything.
-""" + code
-        }
-    ]
-    
-    # Send the request to Cerebras
-    response = await client.chat.completions.create(
-        model="llama3.3-70b",
-        messages=messages,
-        max_tokens=4096,
-        temperature=0.2,
-        top_p=1
-    )
+@router.post("/cerebras/parse/batch")
+async def batch_parse_code_with_cerebras(request_data: CerebrasBatchRequest):
+    """Parse many code snippets using Cerebras LLaMA model.
     
-    # Extract and clean the content
-    raw_content = response.choices[0].message.content
+    Identical snippets (by code fingerprint) are only extracted once, and at most
+    EXTRACTION_BATCH_CONCURRENCY extractions run at a time. Results are streamed
+    back as NDJSON in completion order, one line per input snippet with its index.
+    """
+    # Group the input indices by fingerprint so duplicates share one extraction
+    groups: Dict[str, list] = {}
+    for index, code in enumerate(request_data.snippets):
+        groups.setdefault(code_fingerprint(code), []).append(index)
     
-    # Find code blocks marked with ```javascript ... ```
-    code_blocks = re.findall(r'```(?:javascript)?(.*?)```', raw_content, re.DOTALL)
+    semaphore = asyncio.Semaphore(max(1, settings.EXTRACTION_BATCH_CONCURRENCY))
+    cerebras_tasks = import_cerebras_tasks()
     
-    # Use the first found code block, or fallback to the full content if no blocks found
-    content = code_blocks[0].strip() if code_blocks else raw_content
+    async def extract(fingerprint: str, code: str):
+        async with semaphore:
+            try:
+                return fingerprint, await cerebras_tasks.get_or_extract_object(code)
+            except Exception as e:
+                return fingerprint, {
+                    "status": "error",
+                    "error": str(e),
+                    "error_type": type(e).__name__
+                }
     
-    # Return the parsed code directly
-    return {
-        "status": "success",
-        "content": content,
-        "model": response.model,
-        "usage": {
-            "input_tokens": getattr(response.usage, "prompt_tokens", 0),
-            "output_tokens": getattr(response.usage, "completion_tokens", 0),
-            "total_tokens": getattr(response.usage, "total_tokens", 0)
-        }
-    }
+    async def generate():
+        tasks = [
+            asyncio.create_task(extract(fingerprint, request_data.snippets[indices[0]]))
+            for fingerprint, indices in groups.items()
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                fingerprint, result = await next_done
+                for index in groups[fingerprint]:
+                    yield dumps({"index": index, "fingerprint": fingerprint, **result}) + b"\n"
+        finally:
+            # Stop outstanding extractions if the client goes away
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 @router.post("/trellis/task", response_model=Dict[str, Any])
 async def create_trellis_task(request_data: TrellisRequest):
@@ -279,54 +549,138 @@ async def create_trellis_task(request_data: TrellisRequest):
     if not settings.TRELLIS_API_KEY:
         raise HTTPException(status_code=500, detail="Trellis API key not configured")
         
-    # Set up the headers with our API key
-    headers = {
-        "x-api-key": settings.TRELLIS_API_KEY,
-        "Content-Type": "application/json"
-    }
-    
     # Convert Pydantic model to dict for the request
     request_dict = request_data.dict(exclude_none=True)
     
-    # Make the request to the Trellis API
-    async with httpx.AsyncClient() as client:
+    # Make the request to the Trellis API using the poller's pooled client
+    try:
+        return await submit_trellis_job(trellis_poller.client, request_dict)
+        
+    except httpx.HTTPStatusError as e:
+        # Handle HTTP errors
+        error_detail = f"Trellis API error: {e.response.status_code}"
         try:
-            response = await client.post(
-                TRELLIS_API_URL,
-                headers=headers,
-                json=request_dict,
-                timeout=30.0  # 30 second timeout
-            )
-            
-            # Check if the request was successful
-            response.raise_for_status()
-            
-            # Return the response from the Trellis API
-            return response.json()
-            
-        except httpx.HTTPStatusError as e:
-            # Handle HTTP errors
-            error_detail = f"Trellis API error: {e.response.status_code}"
-            try:
-                error_json = e.response.json()
-                if "detail" in error_json:
-                    error_detail = error_json["detail"]
-            except Exception:
-                pass
-            
-            raise HTTPException(status_code=e.response.status_code, detail=error_detail)
-            
-        except httpx.RequestError as e:
-            # Handle request errors (connection, timeout, etc.)
-            raise HTTPException(status_code=500, detail=f"Error connecting to Trellis API: {str(e)}")
+            error_json = e.response.json()
+            if "detail" in error_json:
+                error_detail = error_json["detail"]
+        except Exception:
+            pass
+        
+        raise HTTPException(status_code=e.response.status_code, detail=error_detail)
+        
+    except httpx.RequestError as e:
+        # Handle request errors (connection, timeout, etc.)
+        raise HTTPException(status_code=500, detail=f"Error connecting to Trellis API: {str(e)}")
+
+@router.post("/trellis/webhook")
+async def trellis_webhook(request: Request, x_webhook_secret: Optional[str] = Header(None)):
+    """Receive task status updates pushed by the Trellis API.
+    
+    The status is written to the task event log and wakes any WebSocket or
+    SSE subscribers watching the task.
+    """
+    # Verify the shared secret configured on the task
+    if not settings.TRELLIS_WEBHOOK_SECRET:
+        raise HTTPException(status_code=404, detail="Trellis webhooks are not configured")
+    if not x_webhook_secret or not hmac.compare_digest(x_webhook_secret, settings.TRELLIS_WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail="Invalid webhook secret")
+    
+    payload = await request.json()
+    task_id = (payload.get("data") or {}).get("task_id")
+    if not task_id:
+        raise HTTPException(status_code=400, detail="Webhook payload is missing data.task_id")
+    
+    message = await trellis_poller.ingest_webhook(task_id, payload)
+    
+    return {"status": "received", "task_id": task_id, "task_status": message["status"]}
+
+@router.get("/trellis/model/{digest}/lods")
+async def get_trellis_model_lods(digest: str):
+    """Get the LOD levels, bounds and normalization transform of a cached Trellis GLB."""
+    if not await glb_cache.ensure(trellis_poller.client, digest):
+        raise HTTPException(status_code=404, detail="Model not found")
+    
+    manifest_path = glb_cache.manifest_path_for(digest)
+    if not os.path.exists(manifest_path):
+        return {"status": "pending", "digest": digest}
+    
+    with open(manifest_path) as f:
+        return json.load(f)
+
+@router.get("/trellis/model/{digest}.glb")
+async def get_trellis_model(digest: str, request: Request, lod: int = 0):
+    """Serve a cached Trellis GLB or one of its LOD levels.
+    
+    Supports conditional requests through the content digest ETag, single byte
+    ranges, and precompressed gzip/brotli variants.
+    """
+    if not await glb_cache.ensure(trellis_poller.client, digest) or not glb_cache.contains(digest, lod):
+        raise HTTPException(status_code=404, detail="Model not found")
+    
+    glb_cache.touch(digest)
+    path = glb_cache.path_for(digest, lod=lod)
+    size = os.path.getsize(path)
+    
+    # Byte ranges are served from the uncompressed file; otherwise prefer brotli,
+    # then gzip, when the client accepts them and a variant exists
+    range_header = request.headers.get("range")
+    encoding = None
+    if not range_header:
+        accept_encoding = request.headers.get("accept-encoding", "")
+        encoding = next((candidate for candidate in ["br", "gzip"]
+                         if candidate in accept_encoding and os.path.exists(glb_cache.path_for(digest, candidate, lod))), None)
+    
+    # Each encoding is a different representation, so it gets its own strong ETag
+    etag = f"{digest}.lod{lod}" if lod else digest
+    if encoding:
+        etag = f"{etag}-{encoding}"
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding"
+    }
+    
+    # The content never changes for a digest, so a matching ETag is always fresh
+    if f'"{etag}"' in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    if range_header:
+        byte_range = parse_byte_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        
+        start, end = byte_range
+        with open(path, "rb") as f:
+            f.seek(start)
+            content = f.read(end - start + 1)
+        
+        return Response(
+            content=content,
+            status_code=206,
+            media_type="model/gltf-binary",
+            headers={**headers, "Content-Range": f"bytes {start}-{end}/{size}"}
+        )
+    
+    if encoding:
+        return FileResponse(
+            glb_cache.path_for(digest, encoding, lod),
+            media_type="model/gltf-binary",
+            headers={**headers, "Content-Encoding": encoding}
+        )
+    
+    return FileResponse(path, media_type="model/gltf-binary", headers=headers)
 
 @router.websocket("/trellis/task/ws/{task_id}")
 async def trellis_task_status_websocket(websocket: WebSocket, task_id: str):
-    """WebSocket endpoint that polls the Trellis API for task status.
+    """WebSocket endpoint that streams the status of a Trellis task.
+    
+    All sockets watching the same task share one poller, so the Trellis API
+    is polled once per task regardless of how many clients are connected.
     
     Args:
         websocket: The WebSocket connection
-        task_id: The ID of the task to poll
+        task_id: The ID of the task to watch
         
     Returns:
         Streams the task status and result via WebSocket
@@ -337,146 +691,41 @@ async def trellis_task_status_websocket(websocket: WebSocket, task_id: str):
         return
         
     await websocket.accept()
+    OPEN_STREAMS.labels("websocket").inc()
     
-    # Set up headers for Trellis API
-    headers = {
-        "x-api-key": settings.TRELLIS_API_KEY,
-        "Content-Type": "application/json"
-    }
-    
-    # Flag to control polling loop
-    continue_polling = True
+    # Subscribe to the shared poller for this task
+    queue = trellis_poller.subscribe(task_id)
+    receive_task = asyncio.ensure_future(websocket.receive_text())
     
     try:
-        # Start polling loop
-        while continue_polling:
-            try:
-                # Poll the Trellis API for task status
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(
-                        f"{TRELLIS_API_URL}/{task_id}",
-                        headers=headers,
-                        timeout=10.0
-                    )
-                    
-                    # If the request was successful, process the response
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        
-                        # Extract the status from the response data
-                        # Based on PiAPI's common format, status will be in data.status
-                        status = "processing"  # Default status
-                        
-                        if "code" in response_data and response_data["code"] == 200:
-                            # Format matches the unified API response
-                            if "data" in response_data and "status" in response_data["data"]:
-                                status = response_data["data"]["status"]
-                        elif "status" in response_data:
-                            # Direct status field in response
-                            status = response_data["status"]
-                        
-                        # Map the status to our expected values
-                        # Trellis API likely uses "completed", "processing", "failed" etc.
-                        is_completed = status.lower() in ["completed", "succeeded", "done"]
-                        is_failed = status.lower() in ["failed", "error"]
-                        
-                        # If task is complete, send the full result
-                        if is_completed:
-                            model_data = None
-                            
-                            # Look for the 3D model data
-                            if "data" in response_data and "output" in response_data["data"]:
-                                output = response_data["data"]["output"]
-                                if "model_file" in output:
-                                    model_data = output["model_file"]
-                            elif "output" in response_data and "model_file" in response_data["output"]:
-                                model_data = response_data["output"]["model_file"]
-                            
-                            await websocket.send_json({
-                                "status": "completed",
-                                "message": "Task completed successfully",
-                                "data": model_data,
-                                "full_response": response_data
-                            })
-                            continue_polling = False
-                        elif is_failed:
-                            # Task failed, get error message
-                            error_message = "Task processing failed"
-                            
-                            # Look for error message in different possible locations
-                            if "data" in response_data and "error" in response_data["data"]:
-                                error_data = response_data["data"]["error"]
-                                if isinstance(error_data, dict) and "message" in error_data:
-                                    error_message = error_data["message"]
-                                elif isinstance(error_data, str):
-                                    error_message = error_data
-                            elif "error" in response_data:
-                                error_data = response_data["error"]
-                                if isinstance(error_data, dict) and "message" in error_data:
-                                    error_message = error_data["message"]
-                                elif isinstance(error_data, str):
-                                    error_message = error_data
-                            
-                            await websocket.send_json({
-                                "status": "failed",
-                                "message": error_message,
-                                "data": None,
-                                "full_response": response_data
-                            })
-                            continue_polling = False
-                        else:
-                            # Task is still processing
-                            await websocket.send_json({
-                                "status": "processing",
-                                "message": f"Task is {status.lower()}, waiting for completion",
-                                "data": None
-                            })
-                    else:
-                        # If there was an error retrieving the task
-                        error_message = f"Error retrieving task status: {response.status_code}"
-                        try:
-                            error_data = response.json()
-                            if "message" in error_data:
-                                error_message = error_data["message"]
-                        except Exception:
-                            pass
-                        
-                        await websocket.send_json({
-                            "status": "error",
-                            "message": error_message,
-                            "data": None
-                        })
-                
-                # Check for messages from the client
-                # Use wait_for with a timeout to make this non-blocking
-                try:
-                    # Wait for a message from the client with a timeout
-                    client_message = await asyncio.wait_for(websocket.receive_text(), timeout=0.1)
-                    
-                    # If the client sent "close", stop polling
-                    if client_message == "close":
-                        continue_polling = False
-                except asyncio.TimeoutError:
-                    # No message from client, continue polling
-                    pass
-                
-                # If we're still polling, wait 2 seconds before the next poll
-                if continue_polling:
-                    await asyncio.sleep(2)
+        while True:
+            message_task = asyncio.ensure_future(queue.get())
+            
+            # Wait for either a status update or a message from the client
+            done, _ = await asyncio.wait(
+                {receive_task, message_task},
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            
+            if receive_task in done:
+                message_task.cancel()
                 
-            except httpx.RequestError as e:
-                # Handle request errors
-                await websocket.send_json({
-                    "status": "error",
-                    "message": f"Error connecting to Trellis API: {str(e)}",
-                    "data": None
-                })
-                # Wait before retrying
-                await asyncio.sleep(2)
+                # If the client sent "close", stop streaming
+                if receive_task.result() == "close":
+                    break
+                receive_task = asyncio.ensure_future(websocket.receive_text())
+                continue
+            
+            message = message_task.result()
+            await websocket.send_json(message)
+            
+            # Stop once the task has finished
+            if is_final_status(message):
+                break
     
     except WebSocketDisconnect:
         # Client disconnected, exit the loop
-        continue_polling = False
+        pass
     except Exception as e:
         # Handle unexpected errors
         try:
@@ -489,6 +738,10 @@ async def trellis_task_status_websocket(websocket: WebSocket, task_id: str):
             # If we can't send the error, just exit
             pass
     finally:
+        OPEN_STREAMS.labels("websocket").dec()
+        receive_task.cancel()
+        trellis_poller.unsubscribe(task_id, queue)
+        
         # Ensure the WebSocket is closed when we're done
         try:
             await websocket.close()
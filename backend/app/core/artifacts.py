@@ -0,0 +1,41 @@
+import hashlib
+from typing import Dict, Any, Optional
+from app.core.config import settings
+from app.core.redis import redis_service
+
+class ArtifactStore:
+    """Content-addressed store for intermediate pipeline artifacts in Redis.
+
+    Stages hand each other artifact references instead of re-sending
+    megabytes of base64 through the client.
+    """
+
+    def put(self, data: str, kind: str, mime_type: Optional[str] = None) -> str:
+        """Store an artifact and return its reference."""
+        ref = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        key = f"artifact:{ref}"
+
+        # Identical content is only stored once; just extend its lifetime
+        if redis_service.client.expire(key, settings.ARTIFACT_TTL):
+            return ref
+
+        redis_service.store_object(key, {
+            "kind": kind,
+            "mime_type": mime_type,
+            "data": data
+        }, settings.ARTIFACT_TTL)
+        return ref
+
+    def get(self, ref: str) -> Optional[Dict[str, Any]]:
+        """Get an artifact by reference."""
+        return redis_service.get_object(f"artifact:{ref}")
+
+    def get_data(self, ref: str) -> str:
+        """Get the data of an artifact, failing if it has expired."""
+        artifact = self.get(ref)
+        if artifact is None:
+            raise ValueError(f"Artifact {ref} not found or expired")
+        return artifact["data"]
+
+# Create a singleton instance
+artifact_store = ArtifactStore()
@@ -1,20 +1,31 @@
 from celery import Celery
 from app.core.config import settings
+from app.core import metrics  # Registers the queue wait, task duration and worker exporter signal handlers
+from app.core import tracing  # Registers the trace propagation and worker tracer signal handlers
+from app.core import profiling  # Registers the worker profile control listener
+from app.core.serialization import register_celery_serializers
+
+# Workers decode every installed format, so API and workers can switch independently
+accepted_serializers = register_celery_serializers()
+serializer = settings.CELERY_SERIALIZER if settings.CELERY_SERIALIZER in accepted_serializers else "json"
 
 celery_app = Celery(
     "worker",
     broker=settings.CELERY_BROKER_URL,
     backend=settings.CELERY_RESULT_BACKEND,
-    include=["app.tasks.claude_tasks", "app.tasks.gemini_tasks"]
+    include=["app.tasks.claude_tasks", "app.tasks.gemini_tasks", "app.tasks.cerebras_tasks", "app.tasks.trellis_tasks", "app.tasks.pipeline_tasks"]
 )
 
 # Optional: Configure Celery
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    task_serializer=serializer,
+    accept_content=accepted_serializers,
+    result_serializer=serializer,
+    result_accept_content=accepted_serializers,
     enable_utc=True,
     task_track_started=True,
     task_time_limit=600,  # 10 minutes
-    worker_concurrency=4,
+    worker_concurrency=settings.WORKER_CONCURRENCY,
+    worker_pool=settings.WORKER_POOL,
+    worker_prefetch_multiplier=settings.WORKER_PREFETCH_MULTIPLIER,
 )
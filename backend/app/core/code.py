@@ -0,0 +1,187 @@
+import difflib
+import hashlib
+import re
+from typing import List, Tuple
+
+# Fenced code blocks, optionally tagged as javascript
+CODE_BLOCK_PATTERN = re.compile(r"```(?:javascript)?(.*?)```", re.DOTALL)
+
+# Import and require statements the frontend strips before running scene code
+IMPORT_PATTERNS = [
+    re.compile(r"^import\s+.*?from\s+['\"].*?['\"];?\s*$", re.MULTILINE),
+    re.compile(r"^import\s+['\"].*?['\"];?\s*$", re.MULTILINE),
+    re.compile(r"^const\s+.*?\s*=\s*require\(['\"].*?['\"]\);?\s*$", re.MULTILINE),
+]
+
+def extract_code_block(text: str) -> str:
+    """Get the first fenced code block of a model response, or the whole text if there is none."""
+    code_blocks = CODE_BLOCK_PATTERN.findall(text)
+    return code_blocks[0].strip() if code_blocks else text
+
+def normalize_scene_code(code: str) -> str:
+    """Reduce scene code to what the frontend actually runs.
+
+    Mirrors processThreeJsCode in the frontend: take the fenced block and drop
+    import/require lines, so code from a model response and code posted back
+    by the frontend normalize to the same text.
+    """
+    code = extract_code_block(code)
+    for pattern in IMPORT_PATTERNS:
+        code = pattern.sub("", code)
+    return code.replace("THREE.OrbitControls", "OrbitControls").strip()
+
+def code_fingerprint(code: str) -> str:
+    """Hash scene code independently of fences, imports and whitespace."""
+    normalized = re.sub(r"\s+", "", normalize_scene_code(code))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class CodeBlockStreamer:
+    """Incrementally pull the first fenced code block out of a streamed response.
+
+    Feed it text chunks as they arrive; it returns the part of each chunk that
+    belongs to the code block, holding back just enough text to recognize
+    fences split across chunks. If the response turns out to have no fence,
+    flush() returns the whole text.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._text = ""
+        self._state = "before"  # before, inside or after the code block
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk and return newly available code."""
+        self._text += chunk
+        self._buffer += chunk
+
+        if self._state == "before":
+            start = self._buffer.find("```")
+            if start == -1:
+                # Keep only what could still be the start of a fence
+                self._buffer = self._buffer[-2:]
+                return ""
+            newline = self._buffer.find("\n", start)
+            if newline == -1:
+                return ""  # Wait for the end of the fence line (e.g. ```javascript)
+            self._buffer = self._buffer[newline + 1:]
+            self._state = "inside"
+
+        if self._state == "inside":
+            end = self._buffer.find("```")
+            if end != -1:
+                code = self._buffer[:end]
+                self._buffer = ""
+                self._state = "after"
+                return code
+            # Hold back trailing backticks that may be the start of the closing fence
+            keep = len(self._buffer) - len(self._buffer.rstrip("`"))
+            code = self._buffer[:len(self._buffer) - keep]
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            return code
+
+        return ""
+
+    def flush(self) -> str:
+        """Return any remaining code once the stream has ended."""
+        if self._state == "before":
+            # No code block at all: the whole response is the code
+            self._state = "after"
+            return self._text
+        if self._state == "inside":
+            self._state = "after"
+            code, self._buffer = self._buffer, ""
+            return code
+        return ""
+
+# Search/replace hunks the model returns in diff edit mode
+PATCH_HUNK_PATTERN = re.compile(
+    r"<{5,9} SEARCH\n(.*?)\n?={5,9}\n(.*?)\n?>{5,9} REPLACE", re.DOTALL
+)
+
+class PatchError(ValueError):
+    """Raised when a search/replace patch can't be applied cleanly."""
+
+def parse_search_replace(text: str) -> List[Tuple[str, str]]:
+    """Parse the search/replace hunks of a model response."""
+    hunks = PATCH_HUNK_PATTERN.findall(text)
+    if not hunks:
+        raise PatchError("Response contains no search/replace hunks")
+    return hunks
+
+def apply_search_replace(code: str, hunks: List[Tuple[str, str]]) -> str:
+    """Apply search/replace hunks in order and validate the result.
+    
+    Every search block must match exactly once, and the patched code must
+    still have balanced brackets if the original did.
+    """
+    patched = code
+    for index, (search, replace) in enumerate(hunks):
+        if not search.strip():
+            raise PatchError(f"Hunk {index + 1} has an empty search block")
+        
+        count = patched.count(search)
+        if count == 0:
+            # Models often get indentation slightly wrong; retry on stripped lines
+            search, count = find_loose_match(patched, search)
+        if count == 0:
+            raise PatchError(f"Hunk {index + 1} search block not found")
+        if count > 1:
+            raise PatchError(f"Hunk {index + 1} search block matches {count} times")
+        
+        patched = patched.replace(search, replace, 1)
+    
+    if brackets_balanced(code) and not brackets_balanced(patched):
+        raise PatchError("Patched code has unbalanced brackets")
+    
+    return patched
+
+def find_loose_match(code: str, search: str) -> Tuple[str, int]:
+    """Find the text in code matching search line by line, ignoring surrounding whitespace.
+    
+    Returns the matching text and how many places it matches.
+    """
+    search_lines = [line.strip() for line in search.strip("\n").split("\n")]
+    code_lines = code.split("\n")
+    matches = []
+    for start in range(len(code_lines) - len(search_lines) + 1):
+        window = code_lines[start:start + len(search_lines)]
+        if [line.strip() for line in window] == search_lines:
+            matches.append("\n".join(window))
+    return (matches[0] if matches else search), len(matches)
+
+def brackets_balanced(code: str) -> bool:
+    """Check that (), [] and {} are balanced outside of strings and comments."""
+    pairs = {")": "(", "]": "[", "}": "{"}
+    stack = []
+    index = 0
+    length = len(code)
+    
+    while index < length:
+        char = code[index]
+        if code.startswith("//", index):
+            newline = code.find("\n", index)
+            index = length if newline == -1 else newline
+        elif code.startswith("/*", index):
+            end = code.find("*/", index + 2)
+            index = length if end == -1 else end + 2
+            continue
+        elif char in "'\"`":
+            # Skip to the closing quote, honoring escapes
+            index += 1
+            while index < length and code[index] != char:
+                index += 2 if code[index] == "\\" else 1
+        elif char in "([{":
+            stack.append(char)
+        elif char in pairs:
+            if not stack or stack.pop() != pairs[char]:
+                return False
+        index += 1
+    
+    return not stack
+
+def make_unified_diff(old: str, new: str, old_name: str = "base", new_name: str = "edited") -> str:
+    """Build a unified diff between two versions of scene code."""
+    return "".join(difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True),
+        fromfile=old_name, tofile=new_name
+    ))
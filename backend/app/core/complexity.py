@@ -0,0 +1,267 @@
+import math
+import time
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from app.core.config import settings
+from app.core.code import extract_code_block
+from app.core.js import tokenize, position_of, Token, JSSyntaxError
+
+def box_vertices(args: List[float]) -> int:
+    ws, hs, ds = args[3], args[4], args[5]
+    return int(2 * ((ws + 1) * (hs + 1) + (ws + 1) * (ds + 1) + (hs + 1) * (ds + 1)))
+
+def polyhedron_vertices(faces: int) -> Callable[[List[float]], int]:
+    return lambda args: int(faces * 3 * (args[1] + 1) ** 2)
+
+# Geometry constructors: default arguments, indices of the segment arguments
+# with the budget setting that caps them, and a vertex count estimate
+GEOMETRIES: Dict[str, Tuple[List[float], Dict[int, str], Callable[[List[float]], int]]] = {
+    "BoxGeometry": ([1, 1, 1, 1, 1, 1], {3: "segments", 4: "segments", 5: "segments"}, box_vertices),
+    "SphereGeometry": ([1, 32, 16], {1: "segments", 2: "segments"}, lambda a: int((a[1] + 1) * (a[2] + 1))),
+    "CylinderGeometry": ([1, 1, 1, 32, 1], {3: "segments", 4: "segments"}, lambda a: int((a[3] + 1) * (a[4] + 1) + 2 * (2 * a[3] + 1))),
+    "ConeGeometry": ([1, 1, 32, 1], {2: "segments", 3: "segments"}, lambda a: int((a[2] + 1) * (a[3] + 1) + 2 * a[2] + 1)),
+    "PlaneGeometry": ([1, 1, 1, 1], {2: "segments", 3: "segments"}, lambda a: int((a[2] + 1) * (a[3] + 1))),
+    "CircleGeometry": ([1, 32], {1: "segments"}, lambda a: int(a[1] + 2)),
+    "RingGeometry": ([0.5, 1, 32, 1], {2: "segments", 3: "segments"}, lambda a: int((a[2] + 1) * (a[3] + 1))),
+    "TorusGeometry": ([1, 0.4, 12, 48], {2: "segments", 3: "segments"}, lambda a: int((a[2] + 1) * (a[3] + 1))),
+    "TorusKnotGeometry": ([1, 0.4, 64, 8], {2: "segments", 3: "segments"}, lambda a: int((a[2] + 1) * (a[3] + 1))),
+    "CapsuleGeometry": ([1, 1, 4, 8], {2: "segments", 3: "segments"}, lambda a: int((a[3] + 1) * (2 * a[2] + 2))),
+    "TubeGeometry": ([None, 64, 1, 8], {1: "segments", 3: "segments"}, lambda a: int((a[1] + 1) * (a[3] + 1))),
+    "LatheGeometry": ([None, 12], {1: "segments"}, lambda a: int((a[1] + 1) * 10)),
+    "IcosahedronGeometry": ([1, 0], {1: "detail"}, polyhedron_vertices(20)),
+    "OctahedronGeometry": ([1, 0], {1: "detail"}, polyhedron_vertices(8)),
+    "TetrahedronGeometry": ([1, 0], {1: "detail"}, polyhedron_vertices(4)),
+    "DodecahedronGeometry": ([1, 0], {1: "detail"}, polyhedron_vertices(36)),
+}
+
+# Geometries whose size depends on data we can't see statically
+OPAQUE_GEOMETRY_VERTICES = {"ExtrudeGeometry": 1000, "ShapeGeometry": 200, "TextGeometry": 5000, "BufferGeometry": 500}
+
+# Objects that each cost a draw call
+DRAWABLES = {"Mesh", "Points", "Line", "LineSegments", "LineLoop", "Sprite", "InstancedMesh", "SkinnedMesh"}
+
+def split_arguments(tokens: List[Token], start: int) -> Tuple[List[List[Token]], int]:
+    """Split the call arguments starting at the "(" at tokens[start]; return them and the index of ")"."""
+    arguments: List[List[Token]] = [[]]
+    depth = 0
+    index = start
+    while index < len(tokens):
+        token = tokens[index]
+        if token.type == "punct" and token.value in ("(", "[", "{"):
+            depth += 1
+            if depth == 1:
+                index += 1
+                continue
+        elif token.type == "punct" and token.value in (")", "]", "}"):
+            depth -= 1
+            if depth == 0:
+                break
+        elif token.type == "template" and token.value.endswith("${"):
+            depth += 1
+        elif token.type == "template" and token.value.startswith("}") and not token.value.endswith("${"):
+            depth -= 1
+        
+        if depth == 1 and token.type == "punct" and token.value == ",":
+            arguments.append([])
+        else:
+            arguments[-1].append(token)
+        index += 1
+    
+    return [argument for argument in arguments if argument], index
+
+def literal_value(argument: List[Token]) -> Optional[float]:
+    """Get the value of a numeric literal argument, or None if it isn't one."""
+    sign = 1.0
+    if len(argument) == 2 and argument[0].value in ("-", "+"):
+        sign = -1.0 if argument[0].value == "-" else 1.0
+        argument = argument[1:]
+    if len(argument) != 1 or argument[0].type != "number":
+        return None
+    try:
+        text = argument[0].value.replace("_", "").rstrip("n")
+        return sign * (float(int(text, 0)) if text[:2].lower() in ("0x", "0o", "0b") else float(text))
+    except ValueError:
+        return None
+
+def loop_iterations(header: List[Token]) -> Optional[int]:
+    """Estimate the iterations of a "for (let i = a; i < b; i++)" style loop header."""
+    parts: List[List[Token]] = [[]]
+    for token in header:
+        if token.type == "punct" and token.value == ";":
+            parts.append([])
+        else:
+            parts[-1].append(token)
+    if len(parts) != 3:
+        return None  # for...of / for...in
+    
+    init, condition, update = parts
+    if len(init) < 3 or init[-2].value != "=" or len(condition) != 3:
+        return None
+    start = literal_value(init[-1:])
+    end = literal_value(condition[2:])
+    if start is None or end is None:
+        return None
+    
+    step = 1.0
+    if len(update) == 3 and update[1].value in ("+=", "-="):
+        step = literal_value(update[2:]) or 1.0
+    
+    operator = condition[1].value
+    if operator in ("<", "<="):
+        count = math.ceil((end - start) / step) + (1 if operator == "<=" else 0)
+    elif operator in (">", ">="):
+        count = math.ceil((start - end) / step) + (1 if operator == ">=" else 0)
+    else:
+        return None
+    return max(0, int(count))
+
+def analyze_scene(code: str, clamp: bool = True) -> Tuple[str, Dict[str, Any]]:
+    """Estimate the vertex and draw call counts of Three.js scene code.
+    
+    Geometry constructors are costed from their arguments and multiplied by
+    the iterations of enclosing for loops with literal bounds. With clamp,
+    literal segment and detail arguments above their budgets are rewritten.
+    Returns the (possibly clamped) code and the report.
+    """
+    start_time = time.perf_counter()
+    tokens = tokenize(code, skip_trivia=True)
+    budgets = {"segments": settings.COMPLEXITY_MAX_SEGMENTS, "detail": settings.COMPLEXITY_MAX_DETAIL}
+    
+    loops: List[Tuple[int, int, bool]] = []  # (iterations, depth the loop ends at, ends at ";")
+    depth = 0
+    vertices = 0
+    draw_calls = 0
+    geometries = []
+    warnings = []
+    replacements: List[Tuple[int, int, str]] = []
+    named: Dict[str, int] = {}  # Vertices of geometries assigned to variables
+    instances = 1  # Instance count applying to the next inline geometry
+    index = 0
+    
+    def multiplier() -> int:
+        return math.prod(iterations for iterations, _, _ in loops) if loops else 1
+    
+    while index < len(tokens):
+        token = tokens[index]
+        
+        if token.type == "punct" and token.value in ("{", "(", "["):
+            depth += 1
+        elif token.type == "punct" and token.value in ("}", ")", "]"):
+            depth -= 1
+            while loops and not loops[-1][2] and depth <= loops[-1][1]:
+                loops.pop()
+        elif token.type == "punct" and token.value == ";":
+            while loops and loops[-1][2] and depth <= loops[-1][1]:
+                loops.pop()
+        
+        elif token.type == "name" and token.value in ("for", "while") and index + 1 < len(tokens) and tokens[index + 1].value == "(":
+            header, close = split_arguments(tokens, index + 1)
+            iterations = loop_iterations([t for argument in header for t in argument] if token.value == "for" else [])
+            if iterations is None:
+                line, _ = position_of(code, token.start)
+                warnings.append(f"Loop with unknown bound at line {line} counted once")
+                iterations = 1
+            
+            # The loop covers a block or a single statement
+            block = close + 1 < len(tokens) and tokens[close + 1].value == "{"
+            loops.append((iterations, depth, not block))
+            index = close + 1
+            continue
+        
+        elif token.type == "name" and token.value == "new" and index + 1 < len(tokens):
+            # new THREE.Name( or new Name(
+            name_index = index + 1
+            if tokens[name_index].value == "THREE" and name_index + 2 < len(tokens) and tokens[name_index + 1].value == ".":
+                name_index += 2
+            name = tokens[name_index].value
+            call = name_index + 1
+            has_arguments = call < len(tokens) and tokens[call].value == "("
+            arguments = split_arguments(tokens, call)[0] if has_arguments else []
+            count = multiplier()
+            
+            if name in GEOMETRIES:
+                defaults, segment_arguments, estimate = GEOMETRIES[name]
+                values = list(defaults)
+                clamped = []
+                for position, argument in enumerate(arguments[:len(values)]):
+                    value = literal_value(argument)
+                    if value is None:
+                        continue
+                    budget_name = segment_arguments.get(position)
+                    if budget_name and value > budgets[budget_name]:
+                        clamped.append({"arg": position, "from": value, "to": budgets[budget_name]})
+                        if clamp:
+                            replacements.append((argument[0].start, argument[-1].end, str(budgets[budget_name])))
+                            value = budgets[budget_name]
+                    values[position] = value
+                
+                values = [value if value is not None else 0 for value in values]
+                geometry_vertices = estimate(values)
+                vertices += geometry_vertices * count * instances
+                instances = 1
+                if index >= 2 and tokens[index - 1].value == "=" and tokens[index - 2].type == "name":
+                    named[tokens[index - 2].value] = geometry_vertices
+                geometries.append({
+                    "type": name,
+                    "line": position_of(code, token.start)[0],
+                    "vertices": geometry_vertices,
+                    "multiplier": count,
+                    **({"clamped": clamped} if clamped else {})
+                })
+            elif name in OPAQUE_GEOMETRY_VERTICES:
+                vertices += OPAQUE_GEOMETRY_VERTICES[name] * count
+                geometries.append({
+                    "type": name,
+                    "line": position_of(code, token.start)[0],
+                    "vertices": OPAQUE_GEOMETRY_VERTICES[name],
+                    "multiplier": count,
+                    "estimated": True
+                })
+            elif name in DRAWABLES:
+                draw_calls += count
+                if name == "InstancedMesh" and len(arguments) >= 3:
+                    # The geometry is drawn once per instance
+                    instance_count = int(literal_value(arguments[2]) or 1)
+                    geometry = arguments[0]
+                    if len(geometry) == 1 and geometry[0].value in named:
+                        vertices += named[geometry[0].value] * instance_count * count
+                    elif geometry[0].value == "new":
+                        instances = instance_count
+        
+        index += 1
+    
+    clamped_count = sum(len(geometry.get("clamped", [])) for geometry in geometries)
+    if clamp and replacements:
+        for start, end, value in sorted(replacements, reverse=True):
+            code = code[:start] + value + code[end:]
+    
+    if vertices > settings.COMPLEXITY_MAX_VERTICES:
+        warnings.append(f"Estimated {vertices} vertices exceeds the budget of {settings.COMPLEXITY_MAX_VERTICES}")
+    if draw_calls > settings.COMPLEXITY_MAX_DRAW_CALLS:
+        warnings.append(f"Estimated {draw_calls} draw calls exceeds the budget of {settings.COMPLEXITY_MAX_DRAW_CALLS}")
+    
+    return code, {
+        "status": "analyzed",
+        "vertices": vertices,
+        "draw_calls": draw_calls,
+        "geometries": geometries,
+        "clamped": clamped_count if clamp else 0,
+        "over_budget": vertices > settings.COMPLEXITY_MAX_VERTICES or draw_calls > settings.COMPLEXITY_MAX_DRAW_CALLS,
+        "warnings": warnings,
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2)
+    }
+
+def guard_scene(content: str) -> Tuple[str, Dict[str, Any]]:
+    """Analyze the code block of a model response and clamp it in place.
+    
+    Returns the response with the clamped code and the complexity report.
+    Code that can't be tokenized is returned unchanged with an "unparsed" report.
+    """
+    code = extract_code_block(content)
+    try:
+        clamped, report = analyze_scene(code, clamp=settings.COMPLEXITY_CLAMP)
+    except JSSyntaxError as e:
+        return content, {"status": "unparsed", "error": str(e)}
+    
+    if clamped != code:
+        content = content.replace(code, clamped, 1)
+    return content, report
@@ -12,6 +12,21 @@ class Settings(BaseSettings):
     API_HOST: str = Field(default=os.getenv("API_HOST", "0.0.0.0"))
     API_PORT: int = Field(default=int(os.getenv("API_PORT", "8000")))
     
+    # Production serving (python run.py --production). At shutdown, open SSE streams
+    # get SSE_DRAIN_SECONDS to finish before clients are told to reconnect after
+    # SSE_RETRY_MS, so API_GRACEFUL_SHUTDOWN_TIMEOUT must be longer than the drain.
+    # API_LIMIT_CONCURRENCY of 0 means no limit.
+    API_WORKERS: int = Field(default=int(os.getenv("API_WORKERS", "4")))
+    API_BACKLOG: int = Field(default=int(os.getenv("API_BACKLOG", "2048")))
+    API_KEEPALIVE_TIMEOUT: int = Field(default=int(os.getenv("API_KEEPALIVE_TIMEOUT", "75")))
+    API_GRACEFUL_SHUTDOWN_TIMEOUT: int = Field(default=int(os.getenv("API_GRACEFUL_SHUTDOWN_TIMEOUT", "30")))
+    API_LIMIT_CONCURRENCY: int = Field(default=int(os.getenv("API_LIMIT_CONCURRENCY", "0")))
+    SSE_DRAIN_SECONDS: float = Field(default=float(os.getenv("SSE_DRAIN_SECONDS", "20")))
+    SSE_RETRY_MS: int = Field(default=int(os.getenv("SSE_RETRY_MS", "2000")))
+    # Idle streams look for a stored response every SSE_RESPONSE_CHECK_SECONDS so clients
+    # that subscribe after the task finished still get its result.
+    SSE_RESPONSE_CHECK_SECONDS: float = Field(default=float(os.getenv("SSE_RESPONSE_CHECK_SECONDS", "1.0")))
+    
     # Redis settings
     REDIS_HOST: str = Field(default=os.getenv("REDIS_HOST", "localhost"))
     REDIS_PORT: int = Field(default=int(os.getenv("REDIS_PORT", "6379")))
@@ -20,13 +35,164 @@ class Settings(BaseSettings):
     CELERY_BROKER_URL: str = Field(default=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
     CELERY_RESULT_BACKEND: str = Field(default=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0"))
     
+    # Celery worker defaults, overridden by the flags of python worker.py run. Tasks
+    # run for seconds to minutes, so each process only reserves one task at a time.
+    WORKER_CONCURRENCY: int = Field(default=int(os.getenv("WORKER_CONCURRENCY", "4")))
+    WORKER_POOL: str = Field(default=os.getenv("WORKER_POOL", "prefork"))
+    WORKER_QUEUES: str = Field(default=os.getenv("WORKER_QUEUES", "celery"))
+    WORKER_PREFETCH_MULTIPLIER: int = Field(default=int(os.getenv("WORKER_PREFETCH_MULTIPLIER", "1")))
+    
     # API keys
     ANTHROPIC_API_KEY: Optional[str] = Field(default=os.getenv("ANTHROPIC_API_KEY", None))
     GOOGLE_API_KEY: Optional[str] = Field(default=os.getenv("GOOGLE_API_KEY", None))
     CEREBRAS_API_KEY: Optional[str] = Field(default=os.getenv("CEREBRAS_API_KEY", None))
     TRELLIS_API_KEY: Optional[str] = Field(default=os.getenv("TRELLIS_API_KEY", None))
+    TRELLIS_API_URL: str = Field(default=os.getenv("TRELLIS_API_URL", "https://api.piapi.ai/api/v1/task"))
+    
+    # Provider base URL overrides, e.g. to point at the local stubs in stubs/providers.py
+    ANTHROPIC_BASE_URL: Optional[str] = Field(default=os.getenv("ANTHROPIC_BASE_URL", None))
+    GOOGLE_BASE_URL: Optional[str] = Field(default=os.getenv("GOOGLE_BASE_URL", None))
+    CEREBRAS_BASE_URL: Optional[str] = Field(default=os.getenv("CEREBRAS_BASE_URL", None))
+
+    # Outbound HTTP connection pools, one per provider and event loop. Idle
+    # connections are kept for HTTP_KEEPALIVE_EXPIRY seconds. HTTP/2 needs the h2
+    # package. HTTP_READ_TIMEOUT only applies where a provider SDK doesn't set its
+    # own per-request timeout.
+    HTTP_MAX_CONNECTIONS: int = Field(default=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = Field(default=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")))
+    HTTP_KEEPALIVE_EXPIRY: float = Field(default=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60.0")))
+    HTTP_CONNECT_TIMEOUT: float = Field(default=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5.0")))
+    HTTP_READ_TIMEOUT: float = Field(default=float(os.getenv("HTTP_READ_TIMEOUT", "600.0")))
+    HTTP2_ENABLED: bool = Field(default=os.getenv("HTTP2_ENABLED", "true").lower() == "true")
+
+    # Trellis status polling settings
+    TRELLIS_POLL_INTERVAL: float = Field(default=float(os.getenv("TRELLIS_POLL_INTERVAL", "2.0")))
+    TRELLIS_POLL_MAX_INTERVAL: float = Field(default=float(os.getenv("TRELLIS_POLL_MAX_INTERVAL", "15.0")))
+    TRELLIS_POLL_BACKOFF: float = Field(default=float(os.getenv("TRELLIS_POLL_BACKOFF", "1.5")))
+    TRELLIS_POLL_LEASE_TTL: int = Field(default=int(os.getenv("TRELLIS_POLL_LEASE_TTL", "30")))
+
+    # Trellis webhook settings. When TRELLIS_WEBHOOK_URL is set, polling the Trellis
+    # API only happens every TRELLIS_WEBHOOK_POLL_INTERVAL seconds as a safety net.
+    TRELLIS_WEBHOOK_URL: Optional[str] = Field(default=os.getenv("TRELLIS_WEBHOOK_URL", None))
+    TRELLIS_WEBHOOK_SECRET: Optional[str] = Field(default=os.getenv("TRELLIS_WEBHOOK_SECRET", None))
+    TRELLIS_WEBHOOK_POLL_INTERVAL: float = Field(default=float(os.getenv("TRELLIS_WEBHOOK_POLL_INTERVAL", "30.0")))
+
+    # Trellis result caching. GLB files are downloaded once into GLB_CACHE_DIR and
+    # served from PUBLIC_API_URL; identical inputs reuse the previous job.
+    # GLB_CACHE_DIR must be a volume shared by every API instance and worker: LOD
+    # levels are written by the workers, and only one instance downloads each
+    # model. An instance missing a model re-downloads it from its source URL
+    # while that URL is still valid.
+    PUBLIC_API_URL: str = Field(default=os.getenv("PUBLIC_API_URL", "http://localhost:8000"))
+    GLB_CACHE_DIR: str = Field(default=os.getenv("GLB_CACHE_DIR", "glb_cache"))
+    GLB_CACHE_MAX_BYTES: int = Field(default=int(os.getenv("GLB_CACHE_MAX_BYTES", str(2 * 1024 ** 3))))
+    TRELLIS_RESULT_CACHE_TTL: int = Field(default=int(os.getenv("TRELLIS_RESULT_CACHE_TTL", "86400")))
+
+    # GLB optimization settings. Each LOD keeps GLB_LOD_RATIOS[i] of the original faces
+    # and downscales textures to at most GLB_LOD_TEXTURE_SIZES[i] pixels.
+    GLB_LOD_RATIOS: str = Field(default=os.getenv("GLB_LOD_RATIOS", "0.5,0.2,0.05"))
+    GLB_LOD_TEXTURE_SIZES: str = Field(default=os.getenv("GLB_LOD_TEXTURE_SIZES", "1024,512,256"))
+    GLB_POSITION_BITS: int = Field(default=int(os.getenv("GLB_POSITION_BITS", "14")))
+    GLB_NORMAL_BITS: int = Field(default=int(os.getenv("GLB_NORMAL_BITS", "10")))
+    GLB_UV_BITS: int = Field(default=int(os.getenv("GLB_UV_BITS", "12")))
+
+    # Gemini image generation settings. Generated images are only written to
+    # DEBUG_IMAGE_DIR when GEMINI_DEBUG_IMAGES is enabled, keeping at most
+    # DEBUG_IMAGE_MAX_FILES files.
+    GEMINI_DEBUG_IMAGES: bool = Field(default=os.getenv("GEMINI_DEBUG_IMAGES", "false").lower() == "true")
+    DEBUG_IMAGE_DIR: str = Field(default=os.getenv("DEBUG_IMAGE_DIR", "debug_images"))
+    DEBUG_IMAGE_MAX_FILES: int = Field(default=int(os.getenv("DEBUG_IMAGE_MAX_FILES", "200")))
+    GEMINI_THUMBNAIL_SIZE: int = Field(default=int(os.getenv("GEMINI_THUMBNAIL_SIZE", "256")))
+
+    # Maximum number of variants of one task sent to a provider at the same time
+    MAX_VARIANT_CONCURRENCY: int = Field(default=int(os.getenv("MAX_VARIANT_CONCURRENCY", "4")))
+
+    # Pipeline settings. Intermediate artifacts and completed stage outputs are
+    # kept in Redis so re-runs can skip stages that already ran.
+    ARTIFACT_TTL: int = Field(default=int(os.getenv("ARTIFACT_TTL", "3600")))
+    PIPELINE_STAGE_CACHE_TTL: int = Field(default=int(os.getenv("PIPELINE_STAGE_CACHE_TTL", "86400")))
+    PIPELINE_TRELLIS_TIMEOUT: float = Field(default=float(os.getenv("PIPELINE_TRELLIS_TIMEOUT", "600")))
+
+    # Object extraction settings. After each 3D generation or edit the main object is
+    # extracted speculatively and cached by code hash for /api/cerebras/parse.
+    SPECULATIVE_EXTRACTION: bool = Field(default=os.getenv("SPECULATIVE_EXTRACTION", "true").lower() == "true")
+    EXTRACTION_CACHE_TTL: int = Field(default=int(os.getenv("EXTRACTION_CACHE_TTL", "86400")))
+    EXTRACTION_WAIT_TIMEOUT: float = Field(default=float(os.getenv("EXTRACTION_WAIT_TIMEOUT", "10.0")))
+    EXTRACTION_BATCH_CONCURRENCY: int = Field(default=int(os.getenv("EXTRACTION_BATCH_CONCURRENCY", "8")))
 
+    # Scene sessions. Edits can refer to server-held code versions and get
+    # search/replace patches back instead of a full rewrite.
+    SCENE_VERSION_TTL: int = Field(default=int(os.getenv("SCENE_VERSION_TTL", "86400")))
+
+    # Region-aware regeneration. A new sketch of a shape whose changed area is at most
+    # SKETCH_EDIT_MAX_CHANGE of the sketch is sent to the edit path as a cropped region.
+    SKETCH_TTL: int = Field(default=int(os.getenv("SKETCH_TTL", "86400")))
+    SKETCH_DIFF_THRESHOLD: int = Field(default=int(os.getenv("SKETCH_DIFF_THRESHOLD", "48")))
+    SKETCH_EDIT_MAX_CHANGE: float = Field(default=float(os.getenv("SKETCH_EDIT_MAX_CHANGE", "0.25")))
+    SKETCH_CROP_PADDING: int = Field(default=int(os.getenv("SKETCH_CROP_PADDING", "24")))
+
+    # Sketch vectorization. SKETCH_MODE is "image", "vector" or "both" and can be
+    # overridden per request with additional_params["sketch_mode"].
+    SKETCH_MODE: str = Field(default=os.getenv("SKETCH_MODE", "image"))
+    SKETCH_VECTOR_MAX_SIZE: int = Field(default=int(os.getenv("SKETCH_VECTOR_MAX_SIZE", "256")))
+    SKETCH_VECTOR_TOLERANCE: float = Field(default=float(os.getenv("SKETCH_VECTOR_TOLERANCE", "1.5")))
+    SKETCH_VECTOR_MAX_PRIMITIVES: int = Field(default=int(os.getenv("SKETCH_VECTOR_MAX_PRIMITIVES", "200")))
+
+    # Edit input compaction. Comments and redundant whitespace are stripped from the
+    # code sent for editing; renderer, camera and resize setup can also be elided.
+    EDIT_COMPACTION: bool = Field(default=os.getenv("EDIT_COMPACTION", "false").lower() == "true")
+    EDIT_ELIDE_BOILERPLATE: bool = Field(default=os.getenv("EDIT_ELIDE_BOILERPLATE", "false").lower() == "true")
+
+    # Complexity guard. Generated scenes get a vertex and draw call estimate, and
+    # geometry segment/detail arguments above these budgets are clamped.
+    COMPLEXITY_GUARD: bool = Field(default=os.getenv("COMPLEXITY_GUARD", "true").lower() == "true")
+    COMPLEXITY_CLAMP: bool = Field(default=os.getenv("COMPLEXITY_CLAMP", "true").lower() == "true")
+    COMPLEXITY_MAX_SEGMENTS: int = Field(default=int(os.getenv("COMPLEXITY_MAX_SEGMENTS", "64")))
+    COMPLEXITY_MAX_DETAIL: int = Field(default=int(os.getenv("COMPLEXITY_MAX_DETAIL", "4")))
+    COMPLEXITY_MAX_VERTICES: int = Field(default=int(os.getenv("COMPLEXITY_MAX_VERTICES", "500000")))
+    COMPLEXITY_MAX_DRAW_CALLS: int = Field(default=int(os.getenv("COMPLEXITY_MAX_DRAW_CALLS", "1000")))
+
+    # Syntax validation. Generated code that doesn't parse gets a targeted repair
+    # call with only the lines around the error and a small output budget.
+    SYNTAX_VALIDATION: bool = Field(default=os.getenv("SYNTAX_VALIDATION", "true").lower() == "true")
+    REPAIR_MAX_ATTEMPTS: int = Field(default=int(os.getenv("REPAIR_MAX_ATTEMPTS", "1")))
+    REPAIR_MAX_TOKENS: int = Field(default=int(os.getenv("REPAIR_MAX_TOKENS", "1024")))
+    REPAIR_CONTEXT_LINES: int = Field(default=int(os.getenv("REPAIR_CONTEXT_LINES", "12")))
+
+    # Prometheus metrics. The API serves /metrics and each worker starts its own
+    # exporter. Set PROMETHEUS_MULTIPROC_DIR when running several processes
+    # (uvicorn workers, Celery prefork children) so their samples are merged.
+    METRICS_ENABLED: bool = Field(default=os.getenv("METRICS_ENABLED", "true").lower() == "true")
+    METRICS_WORKER_PORT: int = Field(default=int(os.getenv("METRICS_WORKER_PORT", "9100")))
     
+    # Per-task timelines: stage timestamps kept for TIMELINE_TTL seconds, and the
+    # window the slowest-tasks view looks back over
+    TIMELINE_TTL: int = Field(default=int(os.getenv("TIMELINE_TTL", "86400")))
+    TIMELINE_SLOW_WINDOW: int = Field(default=int(os.getenv("TIMELINE_SLOW_WINDOW", "3600")))
+    
+    # OpenTelemetry tracing (needs opentelemetry-sdk). TRACING_EXPORTER is "otlp"
+    # (OTLP over HTTP to TRACING_OTLP_ENDPOINT) or "console"; new traces are
+    # sampled at TRACING_SAMPLE_RATIO and the rest follow the caller's decision.
+    TRACING_ENABLED: bool = Field(default=os.getenv("TRACING_ENABLED", "false").lower() == "true")
+    TRACING_SERVICE_NAME: str = Field(default=os.getenv("TRACING_SERVICE_NAME", "vibe-draw"))
+    TRACING_EXPORTER: str = Field(default=os.getenv("TRACING_EXPORTER", "otlp"))
+    TRACING_OTLP_ENDPOINT: str = Field(default=os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"))
+    TRACING_SAMPLE_RATIO: float = Field(default=float(os.getenv("TRACING_SAMPLE_RATIO", "1.0")))
+    
+    # Admin-only profiling. Everything is disabled while ADMIN_TOKEN is unset;
+    # results are kept in Redis for PROFILE_TTL seconds.
+    ADMIN_TOKEN: Optional[str] = Field(default=os.getenv("ADMIN_TOKEN", None))
+    PROFILE_TTL: int = Field(default=int(os.getenv("PROFILE_TTL", "3600")))
+    PROFILE_MAX_SECONDS: float = Field(default=float(os.getenv("PROFILE_MAX_SECONDS", "60")))
+    PROFILE_SAMPLE_INTERVAL: float = Field(default=float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005")))
+    
+    # Serialization. CELERY_SERIALIZER is "orjson", "msgpack" or "json" for task
+    # messages and results; REDIS_VALUE_FORMAT is "json" or "msgpack" for stored
+    # task responses. Workers accept every format, so either can be changed live.
+    CELERY_SERIALIZER: str = Field(default=os.getenv("CELERY_SERIALIZER", "orjson"))
+    REDIS_VALUE_FORMAT: str = Field(default=os.getenv("REDIS_VALUE_FORMAT", "json"))
+
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,253 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import re
+import uuid
+import httpx
+from typing import Dict, Optional, List, Tuple
+from app.core.config import settings
+from app.core.redis import redis_service
+from app.core.metrics import record_cache
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+# Compressed variants stored next to each GLB, keyed by content encoding
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Cache keys are SHA-256 digests of the GLB contents
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+class GlbCache:
+    """Content-addressed on-disk cache of GLB files with size-bounded LRU eviction.
+
+    Files are named by the SHA-256 of their contents, so the same model is only
+    stored once no matter how many Trellis jobs or signed URLs point at it.
+    Recency is tracked through file modification times, which are bumped on
+    every read.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def path_for(self, digest: str, encoding: Optional[str] = None, lod: int = 0) -> str:
+        """Get the path of a cached GLB, one of its LOD levels, or a compressed variant."""
+        suffix = ENCODING_SUFFIXES.get(encoding, "") if encoding else ""
+        level = f".lod{lod}" if lod else ""
+        return os.path.join(self.cache_dir, f"{digest}{level}.glb{suffix}")
+
+    def manifest_path_for(self, digest: str) -> str:
+        """Get the path of the LOD manifest written by the optimization task."""
+        return os.path.join(self.cache_dir, f"{digest}.lods.json")
+
+    def url_for(self, digest: str, lod: int = 0) -> str:
+        """Get the public URL the API serves a cached GLB from."""
+        url = f"{settings.PUBLIC_API_URL}/api/trellis/model/{digest}.glb"
+        return f"{url}?lod={lod}" if lod else url
+
+    def manifest_url_for(self, digest: str) -> str:
+        """Get the public URL of a GLB's LOD manifest."""
+        return f"{settings.PUBLIC_API_URL}/api/trellis/model/{digest}/lods"
+
+    def contains(self, digest: str, lod: int = 0) -> bool:
+        """Check whether a GLB (or one of its LOD levels) is in the cache."""
+        return bool(DIGEST_PATTERN.match(digest)) and os.path.exists(self.path_for(digest, lod=lod))
+
+    def touch(self, digest: str):
+        """Mark a GLB as recently used."""
+        try:
+            os.utime(self.path_for(digest))
+        except FileNotFoundError:
+            pass
+
+    def variants(self, digest: str) -> List[str]:
+        """Get the paths of every file stored for a GLB, including LODs and the manifest."""
+        paths = [self.manifest_path_for(digest)]
+        for lod in range(len(get_lod_ratios()) + 1):
+            paths.append(self.path_for(digest, lod=lod))
+            paths.extend(self.path_for(digest, encoding, lod) for encoding in ENCODING_SUFFIXES)
+        return paths
+
+    async def fetch(self, client: httpx.AsyncClient, url: str, key: str) -> str:
+        """Download a GLB once and return its digest.
+
+        key identifies the source (e.g. the Trellis task ID) so repeated
+        requests for the same source are served without downloading again,
+        even after the signed URL has expired.
+        """
+        digest = redis_service.get_value(f"glb_source:{key}")
+        hit = bool(digest and self.contains(digest))
+        record_cache("glb", hit)
+        if hit:
+            self.touch(digest)
+            return digest
+
+        # Share a single download between concurrent callers
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            digest = await self._download(client, url)
+            redis_service.set_value(f"glb_source:{key}", digest, settings.TRELLIS_RESULT_CACHE_TTL)
+            # Remember where the file came from so instances without it can fetch it too
+            redis_service.set_value(f"glb_origin:{digest}", url, settings.TRELLIS_RESULT_CACHE_TTL)
+            future.set_result(digest)
+            return digest
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def ensure(self, client: httpx.AsyncClient, digest: str) -> bool:
+        """Make sure a GLB is in this instance's cache, downloading it again on a miss.
+
+        Only one instance downloads each Trellis result, so an instance whose
+        GLB_CACHE_DIR isn't shared with it fetches the file from the source URL
+        recorded by that instance. Returns False when the GLB can't be found.
+        """
+        if not DIGEST_PATTERN.match(digest):
+            return False
+        if self.contains(digest):
+            return True
+
+        source_url = redis_service.get_value(f"glb_origin:{digest}")
+        if not source_url:
+            return False
+        try:
+            fetched = await self.fetch(client, source_url, key=f"origin:{digest}")
+        except Exception as e:
+            # Signed source URLs expire, after which the file is gone for this instance
+            print(f"[ERROR] Failed to fetch {digest}.glb from its source: {str(e)}")
+            return False
+        return fetched == digest
+
+    async def _download(self, client: httpx.AsyncClient, url: str) -> str:
+        """Stream a GLB to disk while hashing it."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = os.path.join(self.cache_dir, f".{uuid.uuid4()}.tmp")
+        hasher = hashlib.sha256()
+
+        try:
+            async with client.stream("GET", url, timeout=60.0) as response:
+                response.raise_for_status()
+                with open(tmp_path, "wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        hasher.update(chunk)
+                        f.write(chunk)
+
+            digest = hasher.hexdigest()
+            if self.contains(digest):
+                os.remove(tmp_path)
+                self.touch(digest)
+                return digest
+
+            os.replace(tmp_path, self.path_for(digest))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Precompress off the event loop, then make room for the new files
+        await asyncio.to_thread(self._compress, digest)
+        await asyncio.to_thread(self.evict)
+        return digest
+
+    def _compress(self, digest: str, lod: int = 0) -> Dict[str, int]:
+        """Write gzip and brotli variants of a cached GLB and return their sizes."""
+        with open(self.path_for(digest, lod=lod), "rb") as f:
+            data = f.read()
+
+        compressed = {"gzip": gzip.compress(data, compresslevel=6)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(data, quality=5)
+
+        sizes = {}
+        for encoding, payload in compressed.items():
+            # Only keep variants that are actually smaller
+            if len(payload) < len(data):
+                with open(self.path_for(digest, encoding, lod), "wb") as f:
+                    f.write(payload)
+                sizes[encoding] = len(payload)
+        return sizes
+
+    def compress(self, digest: str, lod: int = 0) -> Dict[str, int]:
+        """Precompress a GLB written by another process, e.g. an LOD level."""
+        return self._compress(digest, lod)
+
+    def evict(self):
+        """Remove least recently used GLBs until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            # Only originals are counted as entries; LODs are evicted with them
+            if not name.endswith(".glb") or ".lod" in name:
+                continue
+            digest = name[:-len(".glb")]
+            try:
+                size = 0
+                for path in self.variants(digest):
+                    if os.path.exists(path):
+                        size += os.path.getsize(path)
+                mtime = os.path.getmtime(self.path_for(digest))
+            except FileNotFoundError:
+                continue  # Evicted by another process while we were scanning
+            entries.append((mtime, digest, size))
+            total += size
+
+        # Oldest first
+        for _, digest, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in self.variants(digest):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            print(f"[DEBUG] Evicted {digest}.glb from GLB cache")
+
+def get_lod_ratios() -> List[float]:
+    """Get the face ratios of the configured LOD levels, starting at LOD 1."""
+    return [float(ratio) for ratio in settings.GLB_LOD_RATIOS.split(",") if ratio.strip()]
+
+def get_lod_texture_sizes() -> List[int]:
+    """Get the maximum texture size of each configured LOD level."""
+    return [int(size) for size in settings.GLB_LOD_TEXTURE_SIZES.split(",") if size.strip()]
+
+def parse_byte_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single "bytes=start-end" range into inclusive offsets.
+
+    Returns None when the header is not a single satisfiable byte range.
+    """
+    match = re.match(r"^bytes=(\d*)-(\d*)$", range_header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+
+    if match.group(1) == "":
+        # Suffix range: the last N bytes
+        length = int(match.group(2))
+        if length == 0:
+            return None
+        return max(size - length, 0), size - 1
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+# Create a singleton instance
+glb_cache = GlbCache(settings.GLB_CACHE_DIR, settings.GLB_CACHE_MAX_BYTES)
@@ -0,0 +1,101 @@
+import asyncio
+import importlib
+import weakref
+from typing import Any, Callable, Dict, Type, TypeVar
+import httpx
+from app.core.config import settings
+from app.core.metrics import record_http_request, record_http_connection
+
+try:
+    import h2
+except ImportError:  # HTTP/2 is optional, clients speak HTTP/1.1 without it
+    h2 = None
+
+T = TypeVar("T")
+
+# Read timeouts of providers whose calls don't set their own; SDK calls pass theirs per request
+PROVIDER_READ_TIMEOUTS = {"trellis": 10.0}
+
+def get_httpx_package(client_class: Type) -> Any:
+    """Get the httpx package a client class is built on.
+
+    Newer anthropic SDKs run on the httpx2 fork and reject httpx clients, so the
+    pool limits and timeouts have to come from the same package as the client.
+    """
+    for base in client_class.__mro__:
+        if base.__name__ == "AsyncClient":
+            return importlib.import_module(base.__module__.split(".")[0])
+    raise TypeError(f"{client_class.__name__} is not an httpx AsyncClient")
+
+def build_http_client(provider: str, client_class: Type = httpx.AsyncClient) -> Any:
+    """Create a pooled keep-alive client that counts its requests and new connections."""
+    package = get_httpx_package(client_class)
+
+    async def trace(event: str, info: Dict[str, Any]):
+        if event == "connection.connect_tcp.complete":
+            record_http_connection(provider)
+
+    async def on_request(request):
+        request.extensions["trace"] = trace
+
+    async def on_response(response):
+        record_http_request(provider, response.http_version)
+
+    return client_class(
+        http2=settings.HTTP2_ENABLED and h2 is not None,
+        limits=package.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=package.Timeout(
+            PROVIDER_READ_TIMEOUTS.get(provider, settings.HTTP_READ_TIMEOUT),
+            connect=settings.HTTP_CONNECT_TIMEOUT
+        ),
+        event_hooks={"request": [on_request], "response": [on_response]}
+    )
+
+class ClientRegistry:
+    """Process-wide registry of one pooled HTTP client per provider.
+
+    Connections belong to the event loop that opened them, so clients are kept
+    per loop: the API process has one loop, and each worker thread runs its
+    tasks on its own long-lived loop (see app.tasks.tasks.run_in_worker_loop).
+    Provider SDK clients are built once per loop on top of the pooled client.
+    """
+
+    def __init__(self):
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+        self._sdk_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+
+    def http_client(self, provider: str, client_class: Type = httpx.AsyncClient) -> Any:
+        """Get the pooled HTTP client of a provider for the running event loop."""
+        clients = self._clients.setdefault(asyncio.get_running_loop(), {})
+        if provider not in clients:
+            clients[provider] = build_http_client(provider, client_class)
+        return clients[provider]
+
+    def sdk_client(self, provider: str, build: Callable[[Any], T], client_class: Type = httpx.AsyncClient) -> T:
+        """Get a provider's SDK client, building it with build(http_client) on first use in this loop."""
+        clients = self._sdk_clients.setdefault(asyncio.get_running_loop(), {})
+        if provider not in clients:
+            clients[provider] = build(self.http_client(provider, client_class))
+        return clients[provider]
+
+    async def close(self):
+        """Close the clients of the running event loop."""
+        loop = asyncio.get_running_loop()
+        self._sdk_clients.pop(loop, None)
+        for provider, client in self._clients.pop(loop, {}).items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                print(f"[ERROR] Failed to close {provider} HTTP client: {str(e)}")
+
+    def reset(self):
+        """Forget clients inherited from a parent process without closing its connections."""
+        self._clients = weakref.WeakKeyDictionary()
+        self._sdk_clients = weakref.WeakKeyDictionary()
+
+# Create a singleton instance
+client_registry = ClientRegistry()
@@ -0,0 +1,105 @@
+import base64
+import struct
+from io import BytesIO
+from typing import Optional, Tuple
+from app.core.tracing import traced
+
+def strip_data_url(image_base64: str) -> str:
+    """Remove a data URL prefix such as "data:image/png;base64," if present."""
+    return image_base64.split(",")[-1] if "," in image_base64 else image_base64
+
+@traced("image.decode_base64")
+def decode_base64_image(image_base64: str) -> bytes:
+    """Decode a base64 image, with or without a data URL prefix."""
+    return base64.b64decode(strip_data_url(image_base64))
+
+def get_base64_image_mime_type(image_base64: str, default: str = "image/png") -> str:
+    """Detect the MIME type of a base64 image by decoding only its first bytes."""
+    try:
+        mime_type = get_image_mime_type(base64.b64decode(strip_data_url(image_base64)[:16]))
+    except ValueError:
+        return default
+    return mime_type if mime_type != "application/octet-stream" else default
+
+def get_image_mime_type(data: bytes) -> str:
+    """Detect the MIME type of an image from its magic bytes."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+def get_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read the width and height of a PNG, JPEG, WebP or GIF from its header.
+
+    This avoids decoding the whole image just to learn its dimensions.
+    Returns None if the format is not recognized.
+    """
+    try:
+        if data.startswith(b"\x89PNG\r\n\x1a\n"):
+            # IHDR is always the first chunk
+            width, height = struct.unpack(">II", data[16:24])
+            return width, height
+
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            width, height = struct.unpack("<HH", data[6:10])
+            return width, height
+
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            chunk = data[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", data[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = struct.unpack("<I", data[21:25])[0]
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                width = int.from_bytes(data[24:27], "little") + 1
+                height = int.from_bytes(data[27:30], "little") + 1
+                return width, height
+            return None
+
+        if data.startswith(b"\xff\xd8"):
+            # Walk the JPEG markers until a start-of-frame segment
+            offset = 2
+            while offset + 9 < len(data):
+                if data[offset] != 0xFF:
+                    offset += 1
+                    continue
+                marker = data[offset + 1]
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    offset += 2
+                    continue
+                length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+                    return width, height
+                offset += 2 + length
+            return None
+    except struct.error:
+        return None
+
+    return None
+
+@traced("image.thumbnail")
+def make_thumbnail(data: bytes, max_size: int = 256, quality: int = 70) -> bytes:
+    """Create a small WebP thumbnail of an image.
+
+    JPEGs are decoded at a reduced scale through PIL's draft mode, so large
+    images don't need to be fully decoded first.
+    """
+    from PIL import Image
+
+    image = Image.open(BytesIO(data))
+    image.draft("RGB", (max_size, max_size))
+    image.thumbnail((max_size, max_size))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+
+    output = BytesIO()
+    image.save(output, format="WEBP", quality=quality)
+    return output.getvalue()
@@ -0,0 +1,435 @@
+import difflib
+import re
+from typing import List, NamedTuple, Optional, Tuple, Dict
+
+try:
+    import esprima
+except ImportError:  # esprima is optional, structural checks always run
+    esprima = None
+
+class JSSyntaxError(ValueError):
+    """Raised when JavaScript can't be tokenized or parsed."""
+    
+    def __init__(self, message: str, line: int, column: int):
+        super().__init__(f"{message} (line {line}, column {column})")
+        self.description = message
+        self.line = line
+        self.column = column
+
+class Token(NamedTuple):
+    type: str  # whitespace, comment, string, template, regex, number, name or punct
+    value: str
+    start: int
+    end: int
+
+# Keywords after which a slash starts a regular expression rather than a division
+REGEX_KEYWORDS = {
+    "return", "typeof", "instanceof", "in", "of", "new", "delete", "void",
+    "throw", "case", "do", "else", "yield", "await"
+}
+
+# Everything but template and regular expression literals, which need the scanner's state.
+# Longer punctuators come first so the longest match wins.
+TOKEN_PATTERN = re.compile(r"""
+    (?P<whitespace>[\s\ufeff]+)
+  | (?P<comment>//[^\n]*|/\*[\s\S]*?\*/)
+  | (?P<string>"(?:[^"\\\n]|\\[\s\S])*"|'(?:[^'\\\n]|\\[\s\S])*')
+  | (?P<number>0[xX][0-9a-fA-F_]+n?|0[oO][0-7_]+n?|0[bB][01_]+n?|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?n?)
+  | (?P<name>[A-Za-z_$\u0080-\uffff][\w$\u0080-\uffff]*)
+  | (?P<punct>>>>=|\.\.\.|[=!]==|\*\*=|<<=|>>>?=?|&&=|\|\|=|\?\?=|=>|[=!<>]=|&&|\|\||\?\?|\?\.(?!\d)|\+\+|--|\*\*|<<|[-+*/%&|^]=|[{}()\[\];,<>+\-*/%&|^!~?:=.@\#])
+""", re.VERBOSE)
+
+REGEX_PATTERN = re.compile(r"/(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[\w$]*")
+
+def position_of(code: str, offset: int) -> Tuple[int, int]:
+    """Get the 1-based line and column of an offset."""
+    line = code.count("\n", 0, offset) + 1
+    return line, offset - (code.rfind("\n", 0, offset) + 1) + 1
+
+def regex_allowed(previous: Optional[Token]) -> bool:
+    """Whether a slash after this token starts a regular expression."""
+    if previous is None:
+        return True
+    if previous.type == "punct":
+        return previous.value not in (")", "]", "}", "++", "--")
+    if previous.type == "name":
+        return previous.value in REGEX_KEYWORDS
+    return False
+
+def tokenize(code: str, skip_trivia: bool = False) -> List[Token]:
+    """Split JavaScript into tokens, including whitespace and comments unless skip_trivia.
+    
+    Handles strings, template literals with nested ${} expressions, and
+    regular expression literals. Raises JSSyntaxError on unterminated
+    strings, comments, templates or regular expressions.
+    """
+    tokens: List[Token] = []
+    length = len(code)
+    index = 0
+    previous: Optional[Token] = None  # Last significant token
+    templates: List[int] = []  # Open braces inside each ${} expression being scanned
+    
+    def fail(message: str, offset: int):
+        line, column = position_of(code, offset)
+        raise JSSyntaxError(message, line, column)
+    
+    def scan_template(start: int) -> Tuple[int, bool]:
+        """Scan template text from start; return the end and whether it stopped at ${."""
+        position = start
+        while position < length:
+            char = code[position]
+            if char == "\\":
+                position += 2
+            elif char == "`":
+                return position + 1, False
+            elif char == "$" and code.startswith("${", position):
+                return position + 2, True
+            else:
+                position += 1
+        fail("Unterminated template literal", start)
+    
+    while index < length:
+        char = code[index]
+        start = index
+        
+        if char == "`" or (char == "}" and templates and templates[-1] == 0):
+            # Template text, either from its start or resuming after a ${} expression
+            if char == "}":
+                templates.pop()
+            index, opened = scan_template(index + 1)
+            if opened:
+                templates.append(0)
+            token_type = "template"
+        
+        elif char == "/" and regex_allowed(previous) and code[index + 1:index + 2] not in ("/", "*"):
+            match = REGEX_PATTERN.match(code, index)
+            if not match:
+                fail("Unterminated regular expression", start)
+            index = match.end()
+            token_type = "regex"
+        
+        else:
+            match = TOKEN_PATTERN.match(code, index)
+            if not match:
+                if char in "'\"":
+                    fail("Unterminated string literal", start)
+                if code.startswith("/*", index):
+                    fail("Unterminated comment", start)
+                fail(f"Unexpected character {char!r}", start)
+            
+            index = match.end()
+            token_type = match.lastgroup
+            if token_type == "punct" and code.startswith("/*", start):
+                fail("Unterminated comment", start)
+            
+            if token_type in ("whitespace", "comment"):
+                if not skip_trivia:
+                    tokens.append(Token(token_type, match.group(), start, index))
+                continue
+            
+            # Track braces so the end of a ${} expression can be recognized
+            if templates and token_type == "punct":
+                if char == "{":
+                    templates[-1] += 1
+                elif char == "}":
+                    templates[-1] -= 1
+        
+        previous = Token(token_type, code[start:index], start, index)
+        tokens.append(previous)
+    
+    if templates:
+        fail("Unterminated template literal", length)
+    
+    return tokens
+
+def significant(tokens: List[Token]) -> List[Token]:
+    """Drop whitespace and comments."""
+    return [token for token in tokens if token.type not in ("whitespace", "comment")]
+
+def needs_space(previous: str, following: str) -> bool:
+    """Whether two tokens would merge into something else without a space between them."""
+    last, first = previous[-1], following[0]
+    if (last.isalnum() or last in "_$\\" or ord(last) > 127) and (first.isalnum() or first in "_$\\" or ord(first) > 127):
+        return True
+    if (last, first) in (("+", "+"), ("-", "-"), ("/", "/"), ("/", "*"), ("<", "!")):
+        return True
+    # "1 .toString()" and "a - -1" style cases
+    return (last.isdigit() and first == ".") or (last in "+-" and first in "+-")
+
+def compact_js(code: str) -> str:
+    """Strip comments and redundant whitespace from JavaScript.
+    
+    String, template and regular expression literals are left untouched.
+    Line breaks between statements are kept (collapsed to one) so automatic
+    semicolon insertion behaves the same; indentation is dropped.
+    """
+    output = []
+    previous: Optional[Token] = None
+    pending = None  # None, "space" or "newline"
+    
+    for token in tokenize(code):
+        if token.type in ("whitespace", "comment"):
+            if "\n" in token.value or token.value.startswith("//"):
+                pending = "newline"
+            elif pending is None:
+                pending = "space"
+            continue
+        
+        if pending and previous is not None:
+            if pending == "newline":
+                output.append("\n")
+            elif needs_space(previous.value, token.value):
+                output.append(" ")
+        
+        output.append(token.value)
+        previous = token
+        pending = None
+    
+    return "".join(output)
+
+# Top-level statements that set up the renderer, camera and resize handling.
+# The edit prompt tells the model to preserve these, so they can be elided.
+BOILERPLATE_PATTERNS = [
+    re.compile(r"^(?:const|let|var)\s+renderer\s*=\s*new\s+THREE\.WebGLRenderer\b"),
+    re.compile(r"^renderer\.(?!render\b)[\w.]+\s*(?:=|\()"),
+    re.compile(r"^[\w.]+\.appendChild\(\s*renderer\.domElement\s*\)"),
+    re.compile(r"^(?:const|let|var)\s+camera\s*=\s*new\s+THREE\.(?:Perspective|Orthographic)Camera\b"),
+    re.compile(r"^window\.addEventListener\(\s*['\"]resize['\"]"),
+    re.compile(r"^function\s+\w*[Rr]esize\w*\s*\("),
+]
+
+# Placeholder standing for an elided statement
+PLACEHOLDER_PATTERN = re.compile(r"__KEEP_(\d+)__;?")
+
+def split_statements(code: str) -> List[Tuple[int, int]]:
+    """Find the spans of top-level statements.
+    
+    A statement ends at a top-level semicolon, or at a top-level line break
+    after a closing brace or wherever automatic semicolon insertion would
+    most likely end it.
+    """
+    spans = []
+    depth = 0
+    start = None
+    previous: Optional[Token] = None
+    newline = False
+    
+    for token in tokenize(code):
+        if token.type in ("whitespace", "comment"):
+            newline = newline or "\n" in token.value
+            continue
+        
+        # Close the running statement at a line break that ends it
+        if start is not None and depth == 0 and newline and previous is not None:
+            previous_ends = previous.type in ("name", "number", "string", "template", "regex") or previous.value in (")", "]", "}", "++", "--")
+            next_starts = token.type in ("name", "number", "string", "template")
+            if previous.value == "}" or (previous_ends and next_starts):
+                spans.append((start, previous.end))
+                start = None
+        newline = False
+        
+        if start is None:
+            start = token.start
+        if token.type == "punct":
+            if token.value in ("(", "[", "{"):
+                depth += 1
+            elif token.value in (")", "]", "}"):
+                depth -= 1
+            elif token.value == ";" and depth == 0:
+                spans.append((start, token.end))
+                start = None
+        elif token.type == "template" and token.value.endswith("${"):
+            depth += 1
+        elif token.type == "template" and token.value.startswith("}"):
+            depth -= 1
+        previous = token
+    
+    if start is not None and previous is not None:
+        spans.append((start, previous.end))
+    return spans
+
+def elide_boilerplate(code: str) -> Tuple[str, Dict[str, str]]:
+    """Replace renderer, camera and resize setup statements with placeholders.
+    
+    Returns the code with placeholders and the elided statements by placeholder number.
+    """
+    elided: Dict[str, str] = {}
+    parts = []
+    position = 0
+    
+    for start, end in split_statements(code):
+        statement = code[start:end]
+        if any(pattern.match(statement) for pattern in BOILERPLATE_PATTERNS):
+            number = str(len(elided) + 1)
+            elided[number] = statement
+            parts.append(code[position:start])
+            parts.append(f"__KEEP_{number}__;")
+            position = end
+    
+    parts.append(code[position:])
+    return "".join(parts), elided
+
+def restore_boilerplate(code: str, elided: Dict[str, str]) -> str:
+    """Put elided statements back in place of their placeholders.
+    
+    Raises ValueError if the model dropped or duplicated a placeholder.
+    """
+    found = PLACEHOLDER_PATTERN.findall(code)
+    if sorted(found) != sorted(elided):
+        missing = sorted(set(elided) - set(found), key=int)
+        raise ValueError(f"Edited code does not keep elided statements {missing or 'exactly once'}")
+    return PLACEHOLDER_PATTERN.sub(lambda match: elided[match.group(1)], code)
+
+def split_trivia(code: str) -> Tuple[List[Tuple[str, str]], str]:
+    """Pair each significant token with the whitespace and comments before it.
+    
+    Returns the pairs and the trailing text after the last token.
+    """
+    pairs = []
+    position = 0
+    for token in tokenize(code, skip_trivia=True):
+        pairs.append((code[position:token.start], token.value))
+        position = token.end
+    return pairs, code[position:]
+
+def carry_over_edit(original: str, edited: str) -> str:
+    """Apply the changes an edit made to a compacted copy of some code to the original.
+    
+    The two versions are compared token by token, ignoring comments and
+    whitespace. Tokens the edit kept are written with the original's comments
+    and formatting around them; only inserted or changed tokens come from the
+    edited code, indented like the original line before them. Raises
+    JSSyntaxError if either version can't be tokenized.
+    """
+    source, tail = split_trivia(original)
+    target, _ = split_trivia(edited)
+    matcher = difflib.SequenceMatcher(None, [value for _, value in source], [value for _, value in target], autojunk=False)
+    
+    output = []
+    previous = None
+    indent = ""
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "delete":
+            continue
+        
+        if tag == "equal":
+            pieces, from_source = source[i1:i2], True
+        elif i2 - i1 == j2 - j1:
+            # Tokens replaced one for one keep the original spacing
+            pieces = [(leading, value) for (leading, _), (_, value) in zip(source[i1:i2], target[j1:j2])]
+            from_source = True
+        else:
+            pieces, from_source = target[j1:j2], False
+        
+        for leading, value in pieces:
+            if from_source and "\n" in leading:
+                indent = leading[leading.rfind("\n") + 1:]
+            elif not from_source and "\n" in leading:
+                leading = "\n" * leading.count("\n") + indent
+            elif not leading and previous is not None and needs_space(previous, value):
+                leading = " "
+            output.append(leading + value)
+            previous = value
+    
+    output.append(tail)
+    return "".join(output)
+
+# Syntax newer than esprima understands; code using it only gets structural checks
+MODERN_PUNCTUATORS = {"?.", "??", "??=", "||=", "&&=", "#"}
+
+# Keyword pairs that only parse since ES2018: "catch {", "for await", import.meta
+# and dynamic import()
+MODERN_KEYWORD_PAIRS = {("catch", "{"), ("for", "await"), ("import", "."), ("import", "(")}
+
+# esprima prefixes its messages with a line number counted in the wrapper function
+ESPRIMA_LINE_PREFIX = re.compile(r"^Line \d+: ")
+
+def uses_modern_syntax(tokens: List[Token]) -> bool:
+    """Whether significant tokens use syntax newer than esprima's ES2017 parser.
+    
+    Besides the newer punctuators this finds numeric separators, BigInt
+    literals, optional catch bindings, async generators, for await,
+    import.meta, dynamic import(), and class fields and static blocks.
+    """
+    # Brace kinds, "class" for class bodies; a class body opens at the first
+    # brace after the class keyword at the same depth
+    braces: List[str] = []
+    class_depths: List[int] = []
+    previous: Optional[Token] = None
+    
+    for index, token in enumerate(tokens):
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+        
+        if token.type == "punct" and token.value in MODERN_PUNCTUATORS:
+            return True
+        if token.type == "number" and ("_" in token.value or token.value.endswith("n")):
+            return True
+        if token.type == "name" and following is not None and (token.value, following.value) in MODERN_KEYWORD_PAIRS:
+            return True
+        if token.value == "*" and previous is not None and previous.value == "function" and index >= 2 and tokens[index - 2].value == "async":
+            return True
+        
+        if token.type == "name" and token.value == "class":
+            class_depths.append(len(braces))
+        elif token.value == "{":
+            opens_class = bool(class_depths) and class_depths[-1] == len(braces)
+            if opens_class:
+                class_depths.pop()
+            braces.append("class" if opens_class else "block")
+        elif token.value == "}" and braces:
+            braces.pop()
+        elif braces and braces[-1] == "class" and previous is not None and previous.value in ("{", ";", "}"):
+            # A class member starts here; fields are a name followed by "=", ";" or "}"
+            member = token
+            after = following
+            if token.value == "static" and following is not None:
+                if following.value == "{":
+                    return True  # Static initialization block
+                member = following
+                after = tokens[index + 2] if index + 2 < len(tokens) else None
+            if member.type in ("name", "string", "number") and (after is None or after.value in ("=", ";", "}")):
+                return True
+        
+        previous = token
+    
+    return False
+
+def check_syntax(code: str):
+    """Check that JavaScript parses, raising JSSyntaxError at the first problem.
+    
+    Tokenizing catches unterminated literals and comments, and bracket
+    matching catches unbalanced or truncated code. When esprima is installed
+    the code is also fully parsed, wrapped in an async function so top-level
+    return and await are accepted.
+    """
+    tokens = tokenize(code, skip_trivia=True)
+    pairs = {")": "(", "]": "[", "}": "{"}
+    stack: List[Token] = []
+    
+    for token in tokens:
+        if token.type == "punct" and token.value in ("(", "[", "{"):
+            stack.append(token)
+        elif token.type == "punct" and token.value in pairs:
+            if not stack or stack[-1].value != pairs[token.value]:
+                raise JSSyntaxError(f"Unexpected {token.value!r}", *position_of(code, token.start))
+            stack.pop()
+    
+    if stack:
+        # Usually a response cut off mid-scene, so point at the end of the code
+        opened_line, _ = position_of(code, stack[-1].start)
+        raise JSSyntaxError(
+            f"Unexpected end of input, {stack[-1].value!r} opened at line {opened_line} is never closed",
+            *position_of(code, len(code.rstrip()))
+        )
+    
+    if esprima is None or uses_modern_syntax(tokens):
+        return
+    
+    try:
+        esprima.parseScript("(async function () {\n" + code + "\n})")
+    except Exception as e:
+        line = getattr(e, "lineNumber", None)
+        if line is None:
+            raise
+        description = ESPRIMA_LINE_PREFIX.sub("", getattr(e, "description", None) or str(e))
+        raise JSSyntaxError(description, max(1, line - 1), getattr(e, "column", 1))
@@ -0,0 +1,198 @@
+import glob
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_init, worker_process_shutdown
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+    generate_latest, start_http_server, multiprocess
+)
+from app.core.config import settings
+from app.core.timeline import mark_stage
+from app.core.tracing import span
+
+# Set for multi-process deployments; every process then writes its samples to
+# files in this directory and exporters aggregate them on scrape
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Buckets in seconds, from Redis round trips up to long model calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+# Buckets in bytes, from small events up to multi-megabyte images
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+QUEUE_WAIT = Histogram(
+    "vibedraw_queue_wait_seconds", "Time a task waits in the broker before a worker starts it",
+    ["task"], buckets=LATENCY_BUCKETS
+)
+TASK_DURATION = Histogram(
+    "vibedraw_task_duration_seconds", "Time a worker spends running a task",
+    ["task", "status"], buckets=LATENCY_BUCKETS
+)
+PROVIDER_TTFT = Histogram(
+    "vibedraw_provider_ttft_seconds", "Time until a provider call returns its first output",
+    ["provider", "model", "task"], buckets=LATENCY_BUCKETS
+)
+PROVIDER_LATENCY = Histogram(
+    "vibedraw_provider_latency_seconds", "Total latency of provider calls",
+    ["provider", "model", "task", "status"], buckets=LATENCY_BUCKETS
+)
+REDIS_PUBLISH_LATENCY = Histogram(
+    "vibedraw_redis_publish_seconds", "Latency of publishing task events to Redis",
+    ["event"], buckets=REDIS_BUCKETS
+)
+PAYLOAD_SIZE = Histogram(
+    "vibedraw_payload_bytes", "Size of request bodies, published events and stored responses",
+    ["kind"], buckets=SIZE_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    "vibedraw_cache_requests_total", "Cache lookups by cache and result (hit or miss)",
+    ["cache", "result"]
+)
+HTTP_CLIENT_REQUESTS = Counter(
+    "vibedraw_http_client_requests_total", "Outbound HTTP requests by provider and protocol version",
+    ["provider", "http_version"]
+)
+HTTP_CLIENT_CONNECTIONS = Counter(
+    "vibedraw_http_client_connections_total", "New outbound connections; requests minus connections were served on reused ones",
+    ["provider"]
+)
+OPEN_STREAMS = Gauge(
+    "vibedraw_open_streams", "Currently open SSE and WebSocket streams",
+    ["kind"], multiprocess_mode="livesum"
+)
+
+# Start times of the tasks running in this process, by task ID
+_task_starts: Dict[str, float] = {}
+
+def get_registry() -> CollectorRegistry:
+    """Get the registry to export: merged across processes in multi-process mode."""
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Render all metrics in the Prometheus text format, with its content type."""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup."""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+def record_http_request(provider: str, http_version: str):
+    """Count an outbound HTTP request once its response arrives."""
+    HTTP_CLIENT_REQUESTS.labels(provider, http_version).inc()
+
+def record_http_connection(provider: str):
+    """Count a newly opened outbound connection."""
+    HTTP_CLIENT_CONNECTIONS.labels(provider).inc()
+
+class ProviderTimer:
+    """Times one provider call; streamed calls mark their first chunk with first_output()."""
+
+    def __init__(self, provider: str, model: str, task: str):
+        self.labels = (provider, model, task)
+        self.start = time.perf_counter()
+        self.first_output_at: Optional[float] = None
+
+    def first_output(self):
+        """Record time to first output, once per call."""
+        if self.first_output_at is None:
+            self.first_output_at = time.perf_counter()
+            PROVIDER_TTFT.labels(*self.labels).observe(self.first_output_at - self.start)
+            mark_stage("provider_first_byte")
+
+    def finish(self, status: str):
+        """Record the total latency of the call."""
+        # A call that isn't streamed delivers its first token with the whole response
+        if status == "success":
+            self.first_output()
+        PROVIDER_LATENCY.labels(*self.labels, status).observe(time.perf_counter() - self.start)
+        # Follow-up calls such as syntax repairs extend the provider stage
+        mark_stage("provider_done", first=False)
+
+@contextmanager
+def time_provider(provider: str, model: str, task: str):
+    """Time a provider call made inside the block, in its own trace span."""
+    with span(f"provider {provider}.{task}", provider=provider, model=model, call=task):
+        timer = ProviderTimer(provider, model or "unknown", task)
+        try:
+            yield timer
+        except BaseException:
+            timer.finish("error")
+            raise
+        timer.finish("success")
+
+def get_task_label(task: Any) -> str:
+    """Get a short label for a Celery task, e.g. ClaudePromptTask."""
+    return (getattr(task, "name", None) or type(task).__name__).rsplit(".", 1)[-1]
+
+def get_enqueued_at(task: Any) -> Optional[float]:
+    """Get the enqueue timestamp the publisher put in the task's message headers."""
+    request = task.request
+    enqueued_at = getattr(request, "enqueued_at", None)
+    if enqueued_at is None:
+        # Older Celery versions nest custom headers instead of merging them
+        enqueued_at = (getattr(request, "headers", None) or {}).get("enqueued_at")
+    return enqueued_at
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers: Optional[Dict[str, Any]] = None, **kwargs):
+    """Stamp outgoing task messages with the time they were enqueued."""
+    if headers is not None:
+        headers["enqueued_at"] = time.time()
+
+@task_prerun.connect
+def observe_queue_wait(task_id: str = None, task: Any = None, **kwargs):
+    """Record how long a task sat in the queue and when it started."""
+    _task_starts[task_id] = time.perf_counter()
+    enqueued_at = get_enqueued_at(task)
+    if enqueued_at is not None:
+        QUEUE_WAIT.labels(get_task_label(task)).observe(max(0.0, time.time() - float(enqueued_at)))
+
+@task_postrun.connect
+def observe_task_duration(task_id: str = None, task: Any = None, retval: Any = None, state: str = None, **kwargs):
+    """Record how long a task ran; tasks that return an error response count as errors."""
+    start = _task_starts.pop(task_id, None)
+    if start is None:
+        return
+    failed = state != "SUCCESS" or (isinstance(retval, dict) and retval.get("status") == "error")
+    TASK_DURATION.labels(get_task_label(task), "error" if failed else "success").observe(time.perf_counter() - start)
+
+def clear_multiprocess_dir():
+    """Remove samples left by a previous run, which would otherwise be merged into this one.
+
+    Call it from the parent process before any child starts writing samples.
+    """
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+def mark_process_dead(pid: Optional[int] = None):
+    """Drop the live gauges of a process that exited."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+@worker_init.connect
+def start_worker_exporter(**kwargs):
+    """Serve the worker's metrics over HTTP from the main worker process."""
+    if not settings.METRICS_ENABLED:
+        return
+
+    if MULTIPROC_DIR:
+        clear_multiprocess_dir()
+    else:
+        print("[DEBUG] PROMETHEUS_MULTIPROC_DIR is not set; metrics from prefork child processes won't be exported")
+
+    start_http_server(settings.METRICS_WORKER_PORT, registry=get_registry())
+    print(f"[DEBUG] Serving worker metrics on port {settings.METRICS_WORKER_PORT}")
+
+@worker_process_shutdown.connect
+def mark_worker_process_dead(pid: Optional[int] = None, **kwargs):
+    """Drop the live gauges of a worker child process that exited."""
+    mark_process_dead(pid)
@@ -0,0 +1,19 @@
+from typing import List
+
+# Pipeline run by the 3d_magic task type when no stages are given
+DEFAULT_PIPELINE = ["image", "3d"]
+
+# Stages a pipeline can be built from. Each stage takes the current image
+# artifact; only "image" produces a new image, so other stages must come last.
+PIPELINE_STAGE_NAMES = ["image", "3d", "trellis"]
+
+def validate_pipeline(stages: List[str]):
+    """Check that a list of stages forms a runnable pipeline."""
+    if not stages:
+        raise ValueError("Pipeline must have at least one stage")
+
+    for index, stage in enumerate(stages):
+        if stage not in PIPELINE_STAGE_NAMES:
+            raise ValueError(f"Unknown pipeline stage: {stage}")
+        if stage != "image" and index != len(stages) - 1:
+            raise ValueError(f"Stage {stage} does not produce an image and must be the last stage")
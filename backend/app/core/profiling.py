@@ -0,0 +1,294 @@
+import base64
+import cProfile
+import hmac
+import json
+import marshal
+import os
+import pstats
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import Dict, Any, Optional, List, Tuple
+from celery.signals import worker_process_init
+from app.core.config import settings
+from app.core.redis import redis_service
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # pyinstrument is optional, cProfile is always available
+    PyinstrumentProfiler = None
+
+# Channel every API and worker process listens on for capture requests
+CONTROL_CHANNEL = "profile_control"
+
+# File extension and content type of each result format
+PROFILE_FORMATS = {
+    "pstats": (".pstats", "application/octet-stream"),
+    "speedscope": (".speedscope.json", "application/json"),
+    "tracemalloc": (".tracemalloc.json", "application/json")
+}
+
+# Only one request profiler can hook a thread at a time
+_request_profile_lock = threading.Lock()
+
+def is_admin(token: Optional[str]) -> bool:
+    """Check an admin token; admin features are off while ADMIN_TOKEN is unset."""
+    return bool(settings.ADMIN_TOKEN and token and hmac.compare_digest(token, settings.ADMIN_TOKEN))
+
+def get_process_name(role: str) -> str:
+    """Identify this process in stored results, e.g. worker@host:1234."""
+    return f"{role}@{socket.gethostname()}:{os.getpid()}"
+
+def save_profile(data: bytes, profile_format: str, kind: str, process: str,
+                 capture_id: Optional[str] = None, details: Optional[Dict[str, Any]] = None) -> str:
+    """Store a profiling result for download and return its ID."""
+    profile_id = str(uuid.uuid4())
+    now = time.time()
+    record = {
+        "id": profile_id,
+        "capture_id": capture_id,
+        "kind": kind,
+        "format": profile_format,
+        "process": process,
+        "created_at": now,
+        "size": len(data),
+        **(details or {})
+    }
+
+    # JSON has no bytes type, so the payload is kept as base64 in either value format
+    redis_service.store_object(f"profile:{profile_id}", {**record, "data": base64.b64encode(data).decode("ascii")}, settings.PROFILE_TTL)
+    redis_service.client.zadd("profiles", {json.dumps(record): now})
+    redis_service.client.zremrangebyscore("profiles", 0, now - settings.PROFILE_TTL)
+    return profile_id
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """List stored results, newest first."""
+    return [json.loads(record) for record in redis_service.client.zrevrange("profiles", 0, -1)]
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    """Get a stored result with its decoded payload under "data"."""
+    record = redis_service.get_object(f"profile:{profile_id}")
+    if not record:
+        return None
+    record["data"] = base64.b64decode(record["data"])
+    return record
+
+class RequestProfiler:
+    """Profile one request with cProfile (pstats output) or pyinstrument (speedscope output).
+
+    Both hook the event loop thread, so cProfile also sees other requests
+    served while this one runs; pyinstrument's async mode attributes time
+    to the profiled request only.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = "pyinstrument" if mode == "pyinstrument" and PyinstrumentProfiler is not None else "cprofile"
+        self._profiler = None
+
+    def start(self):
+        if self.mode == "pyinstrument":
+            self._profiler = PyinstrumentProfiler(async_mode="enabled")
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self) -> Tuple[bytes, str]:
+        """Stop profiling and return the result bytes and their format."""
+        if self.mode == "pyinstrument":
+            self._profiler.stop()
+            return self._profiler.output(SpeedscopeRenderer()).encode("utf-8"), "speedscope"
+
+        self._profiler.disable()
+        # Same layout as pstats.Stats.dump_stats, so pstats and snakeviz can load it
+        return marshal.dumps(pstats.Stats(self._profiler).stats), "pstats"
+
+async def profile_requests(request: Any, call_next: Any):
+    """HTTP middleware profiling requests sent with X-Profile and a valid X-Admin-Token.
+
+    Only queue and subscribe requests are profiled. For streamed responses
+    the profile covers the whole stream and is stored once it ends; the
+    result ID is returned in the X-Profile-Id header right away.
+    """
+    mode = request.headers.get("x-profile")
+    path = request.url.path
+    if not mode or not (path.startswith("/api/queue/") or path.startswith("/api/subscribe/")):
+        return await call_next(request)
+    if not is_admin(request.headers.get("x-admin-token")):
+        return await call_next(request)
+    if not _request_profile_lock.acquire(blocking=False):
+        response = await call_next(request)
+        response.headers["X-Profile-Skipped"] = "another request is being profiled"
+        return response
+
+    profile_id = str(uuid.uuid4())
+    profiler = RequestProfiler(mode)
+    start = time.perf_counter()
+
+    def finish():
+        try:
+            data, profile_format = profiler.stop()
+            save_profile(data, profile_format, "request", get_process_name("api"), capture_id=profile_id, details={
+                "path": path,
+                "seconds": round(time.perf_counter() - start, 4)
+            })
+        except Exception as e:
+            print(f"[ERROR] Failed to store request profile: {str(e)}")
+        finally:
+            _request_profile_lock.release()
+
+    profiler.start()
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finish()
+        raise
+
+    body_iterator = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            finish()
+
+    response.body_iterator = profiled_body()
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+def sample_thread(thread_id: int, seconds: float, interval: float, name: str) -> bytes:
+    """Sample a thread's stack for a while and return a speedscope profile.
+
+    This reads the stack from outside the thread, so it works on a worker
+    that is busy running a task and costs the sampled thread almost nothing.
+    """
+    frames: List[Dict[str, Any]] = []
+    frame_index: Dict[tuple, int] = {}
+    samples: List[List[int]] = []
+    weights: List[float] = []
+
+    end = time.perf_counter() + seconds
+    last = time.perf_counter()
+    while time.perf_counter() < end:
+        time.sleep(interval)
+        frame = sys._current_frames().get(thread_id)
+        now = time.perf_counter()
+        if frame is None:
+            break
+
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+            stack.append(frame_index[key])
+            frame = frame.f_back
+
+        # speedscope expects stacks from the root down
+        samples.append(stack[::-1])
+        weights.append(round(now - last, 6))
+        last = now
+
+    return json.dumps({
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "vibe-draw",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 6),
+            "samples": samples,
+            "weights": weights
+        }]
+    }).encode("utf-8")
+
+def diff_allocations(seconds: float, limit: int = 50) -> bytes:
+    """Compare two tracemalloc snapshots taken seconds apart and return the top changes."""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(10)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    stats = after.compare_to(before, "lineno")
+    return json.dumps({
+        "seconds": seconds,
+        "total_size_diff": sum(stat.size_diff for stat in stats),
+        "top": [
+            {
+                "file": stat.traceback[0].filename,
+                "line": stat.traceback[0].lineno,
+                "size": stat.size,
+                "size_diff": stat.size_diff,
+                "count": stat.count,
+                "count_diff": stat.count_diff
+            }
+            for stat in stats[:limit]
+        ]
+    }).encode("utf-8")
+
+def run_capture(role: str, command: Dict[str, Any], thread_id: int):
+    """Run a capture requested over the control channel and store its result."""
+    seconds = min(float(command.get("seconds", 10)), settings.PROFILE_MAX_SECONDS)
+    process = get_process_name(role)
+    if command.get("mode") == "memory":
+        data, profile_format = diff_allocations(seconds), "tracemalloc"
+    else:
+        data, profile_format = sample_thread(thread_id, seconds, settings.PROFILE_SAMPLE_INTERVAL, process), "speedscope"
+    save_profile(data, profile_format, command.get("mode", "sample"), process,
+                 capture_id=command.get("capture_id"), details={"seconds": seconds})
+
+def request_capture(target: str, mode: str, seconds: float) -> Dict[str, Any]:
+    """Ask every process of a role (api, worker or all) to capture a profile."""
+    capture_id = str(uuid.uuid4())
+    receivers = redis_service.publish(CONTROL_CHANNEL, json.dumps({
+        "capture_id": capture_id,
+        "target": target,
+        "mode": mode,
+        "seconds": seconds
+    }))
+    return {"capture_id": capture_id, "receivers": receivers}
+
+def start_control_listener(role: str):
+    """Listen for capture requests in a background thread of this process.
+
+    Captures sample the thread that started the listener, i.e. the thread
+    running the event loop or the worker's tasks.
+    """
+    if not settings.ADMIN_TOKEN:
+        return
+    thread_id = threading.get_ident()
+
+    def listen():
+        pubsub = redis_service.subscribe(CONTROL_CHANNEL)
+        for message in pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            try:
+                command = json.loads(message["data"])
+                if command.get("target") in (role, "all"):
+                    run_capture(role, command, thread_id)
+            except Exception as e:
+                print(f"[ERROR] Profile capture failed: {str(e)}")
+
+    threading.Thread(target=listen, name="profile-control", daemon=True).start()
+
+@worker_process_init.connect
+def start_worker_control_listener(**kwargs):
+    """Let each worker child process answer capture requests."""
+    start_control_listener("worker")
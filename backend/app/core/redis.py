@@ -1,7 +1,11 @@
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from app.core.config import settings
-import json
-from typing import Dict, Any
+from app.core.metrics import REDIS_PUBLISH_LATENCY, PAYLOAD_SIZE
+from app.core.timeline import mark_stage, summarize_timeline
+from app.core.tracing import traced, set_span_attributes
+from app.core.serialization import encode_event, encode_value, decode_value
+from typing import Dict, Any, Optional, List
 import time
 
 class RedisService:
@@ -11,6 +15,8 @@ class RedisService:
         self.host = settings.REDIS_HOST
         self.port = settings.REDIS_PORT
         self._client = None
+        self._raw_client = None
+        self._async_client = None
     
     @property
     def client(self) -> Redis:
@@ -23,10 +29,32 @@ class RedisService:
             )
         return self._client
     
+    @property
+    def raw_client(self) -> Redis:
+        """Get a Redis client instance that returns bytes, for binary values."""
+        if self._raw_client is None:
+            self._raw_client = Redis(
+                host=self.host,
+                port=self.port
+            )
+        return self._raw_client
+    
+    @property
+    def async_client(self) -> AsyncRedis:
+        """Get an asyncio Redis client that returns bytes, for use on the API's event loop."""
+        if self._async_client is None:
+            self._async_client = AsyncRedis(
+                host=self.host,
+                port=self.port
+            )
+        return self._async_client
+    
+    @traced("redis.get")
     def get_value(self, key: str) -> str:
         """Get a value from Redis."""
         return self.client.get(key)
     
+    @traced("redis.set")
     def set_value(self, key: str, value: str, expiry: int = None) -> bool:
         """Set a value in Redis with optional expiry in seconds."""
         result = self.client.set(key, value)
@@ -38,6 +66,31 @@ class RedisService:
         """Delete a value from Redis."""
         return self.client.delete(key)
     
+    def acquire_lease(self, name: str, owner: str, ttl: int) -> bool:
+        """Acquire or renew a lease key held by owner for ttl seconds."""
+        key = f"lease:{name}"
+        if self.client.set(key, owner, nx=True, ex=ttl):
+            return True
+        # Renew the lease if we already hold it, in one step so it can't expire
+        # and pass to another owner between the check and the renewal
+        script = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("pexpire", KEYS[1], ARGV[2])
+        end
+        return 0
+        """
+        return bool(self.client.eval(script, 1, key, owner, int(ttl * 1000)))
+
+    def release_lease(self, name: str, owner: str) -> bool:
+        """Release a lease key if it is still held by owner."""
+        script = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("del", KEYS[1])
+        end
+        return 0
+        """
+        return bool(self.client.eval(script, 1, f"lease:{name}", owner))
+
     def publish(self, channel: str, message: str) -> int:
         """Publish a message to a Redis channel."""
         return self.client.publish(channel, message)
@@ -47,19 +100,53 @@ class RedisService:
         pubsub = self.client.pubsub()
         pubsub.subscribe(channel)
         return pubsub
+    
+    async def subscribe_async(self, channel: str):
+        """Subscribe to a Redis channel without blocking the event loop."""
+        pubsub = self.async_client.pubsub()
+        await pubsub.subscribe(channel)
+        return pubsub
         
+    @traced("redis.publish_event")
     def publish_event(self, task_id: str, event_type: str, data: Dict[str, Any]) -> int:
-        """Publish an event to a task's stream channel."""
-        event = {
-            "event": event_type,
-            "data": data
-        }
-        return self.publish(f"task_stream:{task_id}", json.dumps(event))
+        """Publish an event to a task's stream channel, framed by encode_event."""
+        set_span_attributes(task_id=task_id, event=event_type)
+        message = encode_event(event_type, data)
+        PAYLOAD_SIZE.labels("event").observe(len(message))
+        
+        start = time.perf_counter()
+        try:
+            return self.publish(f"task_stream:{task_id}", message)
+        finally:
+            REDIS_PUBLISH_LATENCY.labels(event_type).observe(time.perf_counter() - start)
         
+    @traced("redis.store_response")
+    def store_object(self, key: str, obj: Any, expiry: int = None) -> bool:
+        """Store an object or array encoded in REDIS_VALUE_FORMAT, with optional expiry in seconds."""
+        return self.set_value(key, encode_value(obj), expiry)
+    
+    def get_object(self, key: str) -> Any:
+        """Get a value stored with store_object, or None if there is none."""
+        value = self.raw_client.get(key)
+        return decode_value(value) if value else None
+    
     def store_response(self, task_id: str, response_data: Dict[str, Any], expiry: int = 3600) -> bool:
         """Store a response in Redis with expiry."""
         key = f"task_response:{task_id}"
-        return self.set_value(key, json.dumps(response_data), expiry)
+        response_value = encode_value(response_data)
+        PAYLOAD_SIZE.labels("response").observe(len(response_value))
+        result = self.set_value(key, response_value, expiry)
+        mark_stage("stored")
+        return result
+    
+    def get_response(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get a stored response, or None if there is none."""
+        return self.get_object(f"task_response:{task_id}")
+    
+    async def get_response_async(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get a stored response without blocking the event loop, or None if there is none."""
+        response_value = await self.async_client.get(f"task_response:{task_id}")
+        return decode_value(response_value) if response_value else None
         
     def publish_start_event(self, task_id: str) -> int:
         """Publish a start event for a task."""
@@ -70,7 +157,9 @@ class RedisService:
         
     def publish_complete_event(self, task_id: str, response_data: Dict[str, Any]) -> int:
         """Publish a completion event for a task."""
-        return self.publish_event(task_id, "complete", response_data)
+        result = self.publish_event(task_id, "complete", response_data)
+        mark_stage("published")
+        return result
         
     def publish_error_event(self, task_id: str, error: Exception) -> int:
         """Publish an error event for a task."""
@@ -80,7 +169,70 @@ class RedisService:
             "error_type": type(error).__name__,
             "task_id": task_id
         }
-        return self.publish_event(task_id, "error", error_data)
+        result = self.publish_event(task_id, "error", error_data)
+        mark_stage("published")
+        return result
+    
+    @traced("redis.store_timeline")
+    def store_timeline(self, task_id: str, stages: Dict[str, float]):
+        """Merge stage timestamps into a task's timeline.
+        
+        Once a task has stored its response, its total duration is indexed
+        so the slowest recent tasks can be listed. The API records its stages
+        after queueing the task, so a fast worker can store first; the index is
+        then updated again when the API's stages arrive.
+        """
+        key = f"task_timeline:{task_id}"
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=stages)
+        pipe.expire(key, settings.TIMELINE_TTL)
+        pipe.hgetall(key)
+        timeline = {stage: float(timestamp) for stage, timestamp in pipe.execute()[-1].items()}
+        
+        if "stored" not in timeline:
+            return
+        
+        summary = summarize_timeline(task_id, timeline)
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd("task_timeline_durations", {task_id: summary["total_seconds"]})
+        pipe.zadd("task_timeline_finished", {task_id: timeline["stored"]})
+        pipe.execute()
+        
+        # Drop tasks that have left the window from both indexes
+        expired = self.client.zrangebyscore("task_timeline_finished", 0, now - settings.TIMELINE_SLOW_WINDOW)
+        if expired:
+            pipe = self.client.pipeline()
+            pipe.zrem("task_timeline_finished", *expired)
+            pipe.zrem("task_timeline_durations", *expired)
+            pipe.execute()
+    
+    def get_timeline_stages(self, task_id: str) -> Dict[str, float]:
+        """Get the raw stage timestamps of a task."""
+        return {stage: float(timestamp) for stage, timestamp in self.client.hgetall(f"task_timeline:{task_id}").items()}
+    
+    def get_timeline(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get the stage breakdown of a task, or None if it has no timeline."""
+        stages = self.get_timeline_stages(task_id)
+        return summarize_timeline(task_id, stages) if stages else None
+    
+    def get_slowest_timelines(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get the breakdowns of the slowest tasks that finished within the window."""
+        since = time.time() - settings.TIMELINE_SLOW_WINDOW
+        # Over-fetch a little since some indexed tasks may have left the window
+        task_ids = self.client.zrevrange("task_timeline_durations", 0, limit * 2 - 1)
+        finished = self.client.zmscore("task_timeline_finished", task_ids) if task_ids else []
+        
+        timelines = []
+        for task_id, finished_at in zip(task_ids, finished):
+            if finished_at is None or finished_at < since:
+                continue
+            timeline = self.get_timeline(task_id)
+            if timeline is not None:
+                timelines.append(timeline)
+            if len(timelines) == limit:
+                break
+        return timelines
 
 # Create a singleton instance
 redis_service = RedisService()
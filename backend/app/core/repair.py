@@ -0,0 +1,111 @@
+import time
+from typing import Dict, Any, Tuple, Callable, Awaitable
+from app.core.config import settings
+from app.core.redis import redis_service
+from app.core.code import parse_search_replace, apply_search_replace, PatchError
+from app.core.js import check_syntax, JSSyntaxError
+
+REPAIR_PROMPT = """The following JavaScript has a syntax error: {error}
+
+Lines {first}-{last} of {total}, numbered:
+
+{excerpt}
+
+Fix only the syntax error{truncated}. Respond only with search/replace blocks in this exact format:
+
+<<<<<<< SEARCH
+exact lines from the code above, without the line numbers
+=======
+the fixed lines
+>>>>>>> REPLACE"""
+
+def build_repair_prompt(code: str, error: JSSyntaxError) -> str:
+    """Ask for a fix showing only the lines around the error."""
+    lines = code.split("\n")
+    first = max(1, error.line - settings.REPAIR_CONTEXT_LINES)
+    last = min(len(lines), error.line + settings.REPAIR_CONTEXT_LINES)
+    width = len(str(last))
+    excerpt = "\n".join(f"{number:>{width}} | {lines[number - 1]}" for number in range(first, last + 1))
+    
+    return REPAIR_PROMPT.format(
+        error=str(error),
+        first=first,
+        last=last,
+        total=len(lines),
+        excerpt=excerpt,
+        truncated=" (the code may have been cut off; close it with as little new code as possible)"
+        if error.description.startswith("Unexpected end of input") else ""
+    )
+
+async def validate_and_repair(code: str, complete: Callable[[str, int], Awaitable[str]],
+                              provider: str) -> Tuple[str, Dict[str, Any]]:
+    """Check that generated code parses and repair it in place if it doesn't.
+    
+    complete sends a prompt to the provider's model with an output token
+    budget and returns the response text. Returns the (possibly repaired)
+    code and a report of what happened, which is also counted per provider.
+    If a repair call fails, the code is returned as it is and the report
+    records the provider error.
+    """
+    try:
+        check_syntax(code)
+        record_repair(provider, "valid")
+        return code, {"valid": True}
+    except JSSyntaxError as e:
+        error = e
+    
+    report: Dict[str, Any] = {"valid": False, "error": str(error), "attempts": 0, "repaired": False}
+    start_time = time.perf_counter()
+    
+    while report["attempts"] < settings.REPAIR_MAX_ATTEMPTS:
+        report["attempts"] += 1
+        try:
+            response = await complete(build_repair_prompt(code, error), settings.REPAIR_MAX_TOKENS)
+        except Exception as e:
+            # A rate limit or outage must not fail the generation the repair was for
+            print(f"[ERROR] Repair call to {provider} failed: {str(e)}")
+            report["provider_error"] = f"{type(e).__name__}: {str(e)}"
+            break
+        
+        try:
+            code = apply_search_replace(code, parse_search_replace(response))
+            check_syntax(code)
+            report["repaired"] = True
+            break
+        except JSSyntaxError as e:
+            error = e  # Try again with the new error, if attempts remain
+        except PatchError as e:
+            print(f"[DEBUG] Repair patch from {provider} did not apply: {str(e)}")
+    
+    report["repair_ms"] = round((time.perf_counter() - start_time) * 1000, 2)
+    if not report["repaired"]:
+        report["remaining_error"] = str(error)
+    
+    print(f"[DEBUG] {provider} code had a syntax error ({report['error']}), "
+          f"{'repaired' if report['repaired'] else 'not repaired'} in {report['repair_ms']} ms")
+    record_repair(provider, "repaired" if report["repaired"] else "failed", report["repair_ms"])
+    return code, report
+
+def record_repair(provider: str, outcome: str, latency_ms: float = 0.0):
+    """Count a validation outcome and the latency repairs added."""
+    try:
+        pipe = redis_service.client.pipeline()
+        pipe.hincrby(f"repair_stats:{provider}", outcome, 1)
+        if latency_ms:
+            pipe.hincrbyfloat(f"repair_stats:{provider}", "repair_ms", latency_ms)
+        pipe.execute()
+    except Exception:
+        pass  # Stats are best effort
+
+def get_repair_stats(provider: str) -> Dict[str, Any]:
+    """Get the validation counts of a provider with its repair rate and mean added latency."""
+    stats = {key: float(value) for key, value in redis_service.client.hgetall(f"repair_stats:{provider}").items()}
+    invalid = stats.get("repaired", 0) + stats.get("failed", 0)
+    checked = stats.get("valid", 0) + invalid
+    return {
+        **stats,
+        "checked": checked,
+        "invalid_rate": invalid / checked if checked else 0.0,
+        "repair_rate": stats.get("repaired", 0) / invalid if invalid else 0.0,
+        "mean_repair_ms": stats.get("repair_ms", 0) / invalid if invalid else 0.0
+    }
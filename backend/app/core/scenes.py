@@ -0,0 +1,50 @@
+import hashlib
+import time
+from typing import Dict, Any, Optional
+from app.core.config import settings
+from app.core.redis import redis_service
+
+class SceneStore:
+    """Server-held versions of scene code for diff-based editing.
+    
+    Versions are content-addressed, so clients can refer to the code they are
+    looking at by ID instead of uploading it with every edit. A session points
+    at its latest version.
+    """
+    
+    def put(self, code: str, parent_id: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        """Store a version of scene code and return its ID."""
+        version_id = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        key = f"scene_version:{version_id}"
+        
+        # Identical code is only stored once; just extend its lifetime
+        if not redis_service.client.expire(key, settings.SCENE_VERSION_TTL):
+            redis_service.store_object(key, {
+                "code": code,
+                "parent_id": parent_id,
+                "created_at": time.time()
+            }, settings.SCENE_VERSION_TTL)
+        
+        if session_id:
+            redis_service.set_value(f"scene_session:{session_id}", version_id, settings.SCENE_VERSION_TTL)
+        
+        return version_id
+    
+    def get(self, version_id: str) -> Optional[Dict[str, Any]]:
+        """Get a version by ID."""
+        version = redis_service.get_object(f"scene_version:{version_id}")
+        return {"version_id": version_id, **version} if version else None
+    
+    def get_code(self, version_id: str) -> str:
+        """Get the code of a version, failing if it has expired."""
+        version = self.get(version_id)
+        if version is None:
+            raise ValueError(f"Scene version {version_id} not found or expired")
+        return version["code"]
+    
+    def get_head(self, session_id: str) -> Optional[str]:
+        """Get the ID of the latest version in a session."""
+        return redis_service.get_value(f"scene_session:{session_id}")
+
+# Create a singleton instance
+scene_store = SceneStore()
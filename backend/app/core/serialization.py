@@ -0,0 +1,77 @@
+import json
+from typing import Any, List, Tuple, Union
+from kombu.serialization import register
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library json is used without it
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, values are stored as JSON without it
+    msgpack = None
+
+# Content type of Celery messages encoded with orjson; the body is plain JSON
+ORJSON_CONTENT_TYPE = "application/x-orjson"
+
+def dumps(obj: Any) -> bytes:
+    """Encode a value as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def dumps_text(obj: Any) -> str:
+    """Encode a value as compact JSON text, e.g. for SSE data."""
+    return dumps(obj).decode("utf-8")
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Decode JSON text or bytes."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def encode_event(event_type: str, data: Any) -> bytes:
+    """Frame a task stream event as its type, a newline and its JSON data.
+
+    Subscribers split the frame instead of decoding it, so the data reaches
+    SSE clients exactly as the worker encoded it.
+    """
+    return event_type.encode("utf-8") + b"\n" + dumps(data)
+
+def decode_event(message: Union[str, bytes]) -> Tuple[str, str]:
+    """Split a framed event into its type and its still-encoded JSON data."""
+    if isinstance(message, bytes):
+        message = message.decode("utf-8")
+    event_type, _, data = message.partition("\n")
+    return event_type, data
+
+def encode_value(obj: Any) -> bytes:
+    """Encode a value stored in Redis in REDIS_VALUE_FORMAT."""
+    if settings.REDIS_VALUE_FORMAT == "msgpack" and msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    return dumps(obj)
+
+def decode_value(data: bytes) -> Any:
+    """Decode a value stored by encode_value in either format.
+
+    Stored values are objects or arrays, so JSON always starts with { or [
+    while msgpack never does.
+    """
+    if data[:1] in (b"{", b"["):
+        return loads(data)
+    if msgpack is None:
+        raise ValueError("Stored value is msgpack-encoded but msgpack is not installed")
+    return msgpack.unpackb(data, raw=False)
+
+def register_celery_serializers() -> List[str]:
+    """Register orjson with kombu and return the serializers this process can decode.
+
+    kombu registers msgpack by itself when it is installed.
+    """
+    accepted = ["json"]
+    if orjson is not None:
+        register("orjson", dumps, loads, content_type=ORJSON_CONTENT_TYPE, content_encoding="binary")
+        accepted.append("orjson")
+    if msgpack is not None:
+        accepted.append("msgpack")
+    return accepted
@@ -0,0 +1,138 @@
+import base64
+import time
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from typing import Dict, Any, Optional, Tuple
+from app.core.config import settings
+from app.core.redis import redis_service
+from app.core.images import decode_base64_image
+from app.core.tracing import traced
+
+# Redis hash with counters for the routes taken and the latency they saved
+ROUTE_STATS_KEY = "sketch_route_stats"
+
+def load_sketch(data: bytes) -> np.ndarray:
+    """Decode a sketch to a grayscale array, with transparency composited onto white."""
+    image = Image.open(BytesIO(data)).convert("RGBA")
+    background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+    return np.asarray(Image.alpha_composite(background, image).convert("L"), dtype=np.int16)
+
+def dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Grow a boolean mask by radius pixels in every direction."""
+    if radius <= 0:
+        return mask
+    padded = np.pad(mask, radius)
+    height, width = mask.shape
+    grown = np.zeros_like(mask)
+    for dy in range(2 * radius + 1):
+        for dx in range(2 * radius + 1):
+            grown |= padded[dy:dy + height, dx:dx + width]
+    return grown
+
+@traced("image.diff_sketches")
+def diff_sketches(previous: bytes, current: bytes) -> Optional[Dict[str, Any]]:
+    """Compare two renders of the same sketch.
+    
+    Returns the changed pixel count, the bounding box of the change and its
+    share of the sketch area, or None if the sketches can't be compared
+    (e.g. the selection was resized).
+    """
+    old = load_sketch(previous)
+    new = load_sketch(current)
+    if old.shape != new.shape:
+        return None
+    
+    # Ignore anti-aliasing noise, then merge nearby strokes into one region
+    changed = np.abs(old - new) > settings.SKETCH_DIFF_THRESHOLD
+    changed_pixels = int(changed.sum())
+    height, width = new.shape
+    
+    if changed_pixels == 0:
+        return {"changed_pixels": 0, "bbox": None, "changed_fraction": 0.0, "size": [width, height]}
+    
+    region = dilate(changed, 2)
+    rows = np.flatnonzero(region.any(axis=1))
+    cols = np.flatnonzero(region.any(axis=0))
+    bbox = [int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1]
+    
+    return {
+        "changed_pixels": changed_pixels,
+        "bbox": bbox,
+        "changed_fraction": round((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) / float(width * height), 4),
+        "size": [width, height]
+    }
+
+@traced("image.crop_sketch")
+def crop_sketch(data: bytes, bbox: Tuple[int, int, int, int], padding: int) -> Tuple[str, list]:
+    """Crop a padded region out of a sketch and return it as base64 PNG with the padded box."""
+    image = Image.open(BytesIO(data))
+    left = max(0, bbox[0] - padding)
+    top = max(0, bbox[1] - padding)
+    right = min(image.width, bbox[2] + padding)
+    bottom = min(image.height, bbox[3] + padding)
+    
+    output = BytesIO()
+    image.crop((left, top, right, bottom)).save(output, format="PNG")
+    return base64.b64encode(output.getvalue()).decode("utf-8"), [left, top, right, bottom]
+
+class SketchStore:
+    """Keeps the last sketch and generated scene of each preview shape."""
+    
+    def get(self, shape_id: str) -> Optional[Dict[str, Any]]:
+        """Get the last sketch of a shape."""
+        return redis_service.get_object(f"sketch:{shape_id}")
+    
+    def put(self, shape_id: str, image_base64: str, version_id: str, generation_ms: float):
+        """Remember the sketch a shape's scene was generated from."""
+        redis_service.store_object(f"sketch:{shape_id}", {
+            "image": image_base64,
+            "version_id": version_id,
+            "generation_ms": generation_ms,
+            "updated_at": time.time()
+        }, settings.SKETCH_TTL)
+    
+    def route(self, shape_id: str, image_base64: str) -> Dict[str, Any]:
+        """Decide whether a new sketch of a shape needs a full generation or only an edit.
+        
+        The result has a "path" of "generate", "edit" or "unchanged". Edits
+        include the cropped changed region and the scene version to edit.
+        """
+        previous = self.get(shape_id)
+        if previous is None:
+            return {"path": "generate", "reason": "no previous sketch"}
+        
+        current = decode_base64_image(image_base64)
+        diff = diff_sketches(decode_base64_image(previous["image"]), current)
+        if diff is None:
+            return {"path": "generate", "reason": "sketch size changed"}
+        
+        route = {
+            "version_id": previous["version_id"],
+            "baseline_ms": previous["generation_ms"],
+            **diff
+        }
+        
+        if diff["changed_pixels"] == 0:
+            return {"path": "unchanged", **route}
+        
+        if diff["changed_fraction"] > settings.SKETCH_EDIT_MAX_CHANGE:
+            return {"path": "generate", "reason": "change too large", **route}
+        
+        region_base64, region_box = crop_sketch(current, diff["bbox"], settings.SKETCH_CROP_PADDING)
+        return {"path": "edit", "region_base64": region_base64, "region_box": region_box, **route}
+    
+    def record(self, path: str, latency_ms: float, saved_ms: float):
+        """Count a routing decision and the latency it saved against a full generation."""
+        pipe = redis_service.client.pipeline()
+        pipe.hincrby(ROUTE_STATS_KEY, f"{path}_count", 1)
+        pipe.hincrbyfloat(ROUTE_STATS_KEY, f"{path}_latency_ms", latency_ms)
+        pipe.hincrbyfloat(ROUTE_STATS_KEY, "saved_ms", saved_ms)
+        pipe.execute()
+    
+    def stats(self) -> Dict[str, float]:
+        """Get the routing counters."""
+        return {key: float(value) for key, value in redis_service.client.hgetall(ROUTE_STATS_KEY).items()}
+
+# Create a singleton instance
+sketch_store = SketchStore()
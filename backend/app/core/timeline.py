@@ -0,0 +1,87 @@
+import time
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, List, Tuple
+
+# Stages a task passes through, in order. accepted and enqueued are recorded by
+# the API; the rest by the worker that runs the task.
+STAGES = [
+    "accepted",
+    "enqueued",
+    "dequeued",
+    "preprocessing_done",
+    "provider_first_byte",
+    "provider_done",
+    "published",
+    "stored"
+]
+
+class TimelineRecorder:
+    """Collects stage timestamps for one task while it runs in this process.
+
+    Timestamps are wall-clock times derived from a monotonic clock anchored
+    when the recorder is created, so stages recorded in the same process are
+    always in order while still being comparable with the API's timestamps.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self._wall = time.time()
+        self._monotonic = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def now(self) -> float:
+        return self._wall + (time.perf_counter() - self._monotonic)
+
+    def mark(self, stage: str, first: bool = True):
+        """Record a stage; with first=False a later occurrence replaces an earlier one."""
+        if first and stage in self.stages:
+            return
+        self.stages[stage] = round(self.now(), 4)
+
+# Recorder of the task running in the current context. Coroutines spawned by the
+# task copy the context, so they share the same recorder.
+_current: ContextVar[Optional[TimelineRecorder]] = ContextVar("task_timeline", default=None)
+
+def start_timeline(task_id: str) -> TimelineRecorder:
+    """Start recording stages for a task in the current context."""
+    recorder = TimelineRecorder(task_id)
+    _current.set(recorder)
+    return recorder
+
+def finish_timeline() -> Optional[TimelineRecorder]:
+    """Stop recording and return the recorder of the current task, if any."""
+    recorder = _current.get()
+    _current.set(None)
+    return recorder
+
+def mark_stage(stage: str, first: bool = True):
+    """Record a stage of the task running in the current context, if there is one."""
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.mark(stage, first)
+
+def summarize_timeline(task_id: str, stages: Dict[str, float]) -> Dict[str, Any]:
+    """Break a task's stage timestamps down into the time spent between stages."""
+    ordered: List[Tuple[str, float]] = sorted(
+        ((stage, stages[stage]) for stage in STAGES if stage in stages),
+        key=lambda item: item[1]
+    )
+    if not ordered:
+        return {"task_id": task_id, "stages": [], "intervals": [], "total_seconds": None}
+
+    start = ordered[0][1]
+    intervals = [
+        {"from": previous, "to": stage, "seconds": round(timestamp - previous_timestamp, 4)}
+        for (previous, previous_timestamp), (stage, timestamp) in zip(ordered, ordered[1:])
+    ]
+    return {
+        "task_id": task_id,
+        "started_at": start,
+        "stages": [
+            {"stage": stage, "timestamp": timestamp, "offset_seconds": round(timestamp - start, 4)}
+            for stage, timestamp in ordered
+        ],
+        "intervals": intervals,
+        "slowest_interval": max(intervals, key=lambda interval: interval["seconds"]) if intervals else None,
+        "total_seconds": round(ordered[-1][1] - start, 4)
+    }
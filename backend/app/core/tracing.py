@@ -0,0 +1,161 @@
+import functools
+import inspect
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_process_init, worker_process_shutdown
+from app.core.config import settings
+
+try:
+    from opentelemetry import trace, propagate, context as otel_context
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+except ImportError:  # OpenTelemetry is optional, tracing is off without it
+    trace = None
+
+# Tracer of this process, set by setup_tracing; spans are no-ops until then
+_tracer = None
+_provider = None
+
+# Spans of the Celery tasks running in this process with their context tokens, by task ID
+_task_spans: Dict[str, Any] = {}
+
+def setup_tracing(service_name: str) -> bool:
+    """Configure the tracer of this process from settings.
+
+    Call it once per process, after forking: the batch exporter runs a
+    background thread. Returns whether tracing is active.
+    """
+    global _tracer, _provider
+    if not settings.TRACING_ENABLED or _tracer is not None:
+        return _tracer is not None
+    if trace is None:
+        print("[ERROR] TRACING_ENABLED is set but opentelemetry-sdk is not installed")
+        return False
+
+    # Follow the caller's sampling decision, sample new traces at the configured ratio
+    sampler = ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO))
+    _provider = TracerProvider(resource=Resource.create({"service.name": service_name}), sampler=sampler)
+
+    if settings.TRACING_EXPORTER == "console":
+        exporter = ConsoleSpanExporter()
+    else:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+
+    trace.set_tracer_provider(_provider)
+    _tracer = trace.get_tracer("vibe-draw")
+    print(f"[DEBUG] Tracing {service_name} to the {settings.TRACING_EXPORTER} exporter")
+    return True
+
+def shutdown_tracing():
+    """Flush and stop the exporter of this process."""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = None
+    _provider = None
+
+def instrument_app(app: Any):
+    """Add server spans for every FastAPI request when the instrumentation package is installed."""
+    if _tracer is None:
+        return
+    try:
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    except ImportError:
+        return
+    FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics")
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """Run the block in a span that is a child of the current one."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name) as current:
+        set_span_attributes(**attributes)
+        yield current
+
+def set_span_attributes(**attributes: Any):
+    """Add attributes to the current span, skipping empty values."""
+    if _tracer is None:
+        return
+    current = trace.get_current_span()
+    for key, value in attributes.items():
+        if value is not None:
+            current.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else str(value))
+
+def traced(name: str) -> Callable:
+    """Decorate a function or coroutine function to run in its own span."""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await func(*args, **kwargs)
+                with _tracer.start_as_current_span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.start_as_current_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@worker_process_init.connect
+def setup_worker_tracing(**kwargs):
+    """Start tracing in each worker child process once it has forked."""
+    setup_tracing(f"{settings.TRACING_SERVICE_NAME}-worker")
+
+@worker_process_shutdown.connect
+def shutdown_worker_tracing(**kwargs):
+    """Flush the spans of a worker child process before it exits."""
+    shutdown_tracing()
+
+@before_task_publish.connect
+def inject_trace_context(headers: Optional[Dict[str, Any]] = None, **kwargs):
+    """Carry the current trace context to the worker in the task's message headers."""
+    if _tracer is not None and headers is not None:
+        propagate.inject(headers)
+
+@task_prerun.connect
+def start_task_span(task_id: str = None, task: Any = None, **kwargs):
+    """Start the task's span as a child of the span that queued it."""
+    if _tracer is None:
+        return
+
+    # Custom headers are merged into the request, or nested under headers in older Celery versions
+    request = task.request
+    carrier = dict(getattr(request, "headers", None) or {})
+    for key in ("traceparent", "tracestate"):
+        if getattr(request, key, None):
+            carrier[key] = getattr(request, key)
+
+    task_span = _tracer.start_span(
+        f"celery.run {task.name.rsplit('.', 1)[-1]}",
+        context=propagate.extract(carrier),
+        kind=trace.SpanKind.CONSUMER,
+        attributes={"celery.task_id": task_id or "", "celery.task_name": task.name}
+    )
+    token = otel_context.attach(trace.set_span_in_context(task_span))
+    _task_spans[task_id] = (task_span, token)
+
+@task_postrun.connect
+def end_task_span(task_id: str = None, retval: Any = None, state: str = None, **kwargs):
+    """End the task's span, marking tasks that returned an error response."""
+    entry = _task_spans.pop(task_id, None)
+    if entry is None:
+        return
+
+    task_span, token = entry
+    task_span.set_attribute("celery.state", state or "")
+    if isinstance(retval, dict) and retval.get("status") == "error":
+        task_span.set_status(trace.Status(trace.StatusCode.ERROR, str(retval.get("error", ""))))
+    otel_context.detach(token)
+    task_span.end()
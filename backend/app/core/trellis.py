@@ -0,0 +1,384 @@
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+import httpx
+from typing import Dict, Any, Optional, Set
+from app.core.config import settings
+from app.core.redis import redis_service
+from app.core.metrics import record_cache
+from app.core.glb_cache import glb_cache
+from app.core.http_clients import client_registry
+from app.core.celery_app import celery_app
+
+# Trellis API URL, overridable to point at a local stand-in
+TRELLIS_API_URL = settings.TRELLIS_API_URL
+
+# Statuses that end a Trellis job
+COMPLETED_STATUSES = ["completed", "succeeded", "done"]
+FAILED_STATUSES = ["failed", "error"]
+
+# How long the last known status of a job is kept in Redis
+STATUS_EXPIRY = 3600
+
+# Celery task that builds LOD levels for a cached GLB
+OPTIMIZE_TASK_NAME = "app.tasks.trellis_tasks.TrellisOptimizeTask"
+
+def get_trellis_headers() -> Dict[str, str]:
+    """Get the headers for requests to the Trellis API."""
+    return {
+        "x-api-key": settings.TRELLIS_API_KEY,
+        "Content-Type": "application/json"
+    }
+
+def parse_trellis_status(response_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a Trellis task payload into the message sent to subscribers."""
+    # Extract the status from the response data
+    # Based on PiAPI's common format, status will be in data.status
+    status = "processing"  # Default status
+
+    if "code" in response_data and response_data["code"] == 200:
+        # Format matches the unified API response
+        if "data" in response_data and "status" in response_data["data"]:
+            status = response_data["data"]["status"]
+    elif "status" in response_data:
+        # Direct status field in response
+        status = response_data["status"]
+
+    # Map the status to our expected values
+    is_completed = status.lower() in COMPLETED_STATUSES
+    is_failed = status.lower() in FAILED_STATUSES
+
+    # If task is complete, send the full result
+    if is_completed:
+        model_data = None
+
+        # Look for the 3D model data
+        if "data" in response_data and "output" in response_data["data"]:
+            output = response_data["data"]["output"]
+            if "model_file" in output:
+                model_data = output["model_file"]
+        elif "output" in response_data and "model_file" in response_data["output"]:
+            model_data = response_data["output"]["model_file"]
+
+        return {
+            "status": "completed",
+            "message": "Task completed successfully",
+            "data": model_data,
+            "full_response": response_data
+        }
+
+    if is_failed:
+        # Task failed, get error message
+        error_message = "Task processing failed"
+
+        # Look for error message in different possible locations
+        error_data = None
+        if "data" in response_data and "error" in response_data["data"]:
+            error_data = response_data["data"]["error"]
+        elif "error" in response_data:
+            error_data = response_data["error"]
+
+        if isinstance(error_data, dict) and "message" in error_data:
+            error_message = error_data["message"]
+        elif isinstance(error_data, str):
+            error_message = error_data
+
+        return {
+            "status": "failed",
+            "message": error_message,
+            "data": None,
+            "full_response": response_data
+        }
+
+    # Task is still processing
+    return {
+        "status": "processing",
+        "message": f"Task is {status.lower()}, waiting for completion",
+        "data": None
+    }
+
+def is_final_status(message: Dict[str, Any]) -> bool:
+    """Check whether a subscriber message ends the job."""
+    return message.get("status") in ["completed", "failed"]
+
+def get_input_hash(task_input: Dict[str, Any]) -> str:
+    """Hash the image and sampling parameters of a Trellis job."""
+    return hashlib.sha256(json.dumps(task_input, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_cached_job(input_hash: str) -> Optional[Dict[str, Any]]:
+    """Get the create-task response of an earlier job with identical inputs."""
+    return redis_service.get_object(f"trellis_input:{input_hash}")
+
+def cache_job(input_hash: str, task_id: str, response_data: Dict[str, Any]):
+    """Remember a created job so identical inputs can reuse it."""
+    redis_service.store_object(f"trellis_input:{input_hash}", response_data, settings.TRELLIS_RESULT_CACHE_TTL)
+    redis_service.set_value(f"trellis_task_input:{task_id}", input_hash, settings.TRELLIS_RESULT_CACHE_TTL)
+
+def forget_job(task_id: str):
+    """Stop reusing a job, e.g. because it failed."""
+    input_hash = redis_service.get_value(f"trellis_task_input:{task_id}")
+    if input_hash:
+        redis_service.delete_value(f"trellis_input:{input_hash}")
+        redis_service.delete_value(f"trellis_task_input:{task_id}")
+
+async def submit_trellis_job(client: httpx.AsyncClient, request_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Create a Trellis job, reusing an earlier job with identical inputs.
+    
+    The webhook config is added automatically when TRELLIS_WEBHOOK_URL is set.
+    Raises httpx errors if the Trellis API rejects the request.
+    """
+    # Have Trellis push status updates to our webhook instead of relying on polling
+    if settings.TRELLIS_WEBHOOK_URL and not (request_dict.get("config") or {}).get("webhook_config"):
+        request_dict["config"] = {
+            "webhook_config": {
+                "endpoint": settings.TRELLIS_WEBHOOK_URL,
+                "secret": settings.TRELLIS_WEBHOOK_SECRET
+            }
+        }
+
+    # Reuse an earlier job with the same image and sampling parameters instead of paying for a new one
+    input_hash = get_input_hash(request_dict["input"])
+    cached_job = get_cached_job(input_hash)
+    record_cache("trellis_job", cached_job is not None)
+    if cached_job:
+        return {**cached_job, "cached": True}
+
+    response = await client.post(
+        TRELLIS_API_URL,
+        headers=get_trellis_headers(),
+        json=request_dict,
+        timeout=30.0  # 30 second timeout
+    )
+
+    # Check if the request was successful
+    response.raise_for_status()
+    response_data = response.json()
+
+    # Remember the job so identical inputs can reuse it
+    task_id = (response_data.get("data") or {}).get("task_id")
+    if task_id:
+        cache_job(input_hash, task_id, response_data)
+
+    return response_data
+
+class TrellisPoller:
+    """Process-wide poller that shares one status loop per Trellis task.
+
+    Every WebSocket watching the same task subscribes to the same loop. Across
+    API instances a Redis lease decides which instance talks to PiAPI; the
+    others read the last status it stored in Redis.
+    """
+
+    def __init__(self):
+        self.instance_id = str(uuid.uuid4())
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self._last_messages: Dict[str, Dict[str, Any]] = {}
+        self._wake_events: Dict[str, asyncio.Event] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Get the pooled Trellis HTTP client of the running event loop."""
+        return client_registry.http_client("trellis")
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """Subscribe to status messages for a task, starting its poller if needed."""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(task_id, set()).add(queue)
+
+        # Replay the latest known status so late subscribers don't wait a full interval
+        if task_id in self._last_messages:
+            queue.put_nowait(self._last_messages[task_id])
+
+        if task_id not in self._pollers or self._pollers[task_id].done():
+            self._pollers[task_id] = asyncio.create_task(self._poll_loop(task_id))
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        """Remove a subscriber, stopping the poller once nobody is listening."""
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[task_id]
+            self._last_messages.pop(task_id, None)
+            self._wake_events.pop(task_id, None)
+            poller = self._pollers.pop(task_id, None)
+            if poller is not None and not poller.done():
+                poller.cancel()
+
+    def broadcast(self, task_id: str, message: Dict[str, Any]):
+        """Push a status message to every subscriber of a task."""
+        self._last_messages[task_id] = message
+        for queue in self._subscribers.get(task_id, set()):
+            queue.put_nowait(message)
+
+    async def fetch_status(self, task_id: str) -> Dict[str, Any]:
+        """Fetch the status of a task from the Trellis API."""
+        try:
+            response = await self.client.get(
+                f"{TRELLIS_API_URL}/{task_id}",
+                headers=get_trellis_headers()
+            )
+        except httpx.RequestError as e:
+            return {
+                "status": "error",
+                "message": f"Error connecting to Trellis API: {str(e)}",
+                "data": None
+            }
+
+        if response.status_code != 200:
+            # If there was an error retrieving the task
+            error_message = f"Error retrieving task status: {response.status_code}"
+            try:
+                error_data = response.json()
+                if "message" in error_data:
+                    error_message = error_data["message"]
+            except Exception:
+                pass
+
+            return {
+                "status": "error",
+                "message": error_message,
+                "data": None
+            }
+
+        return parse_trellis_status(response.json())
+
+    async def localize_model(self, task_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Swap the remote model URL of a completed job for our cached copy."""
+        if message["status"] != "completed" or not message.get("data"):
+            return message
+
+        source_url = message["data"]
+        try:
+            digest = await glb_cache.fetch(self.client, source_url, key=f"trellis:{task_id}")
+        except Exception as e:
+            # Fall back to the provider URL if the download fails
+            print(f"[ERROR] Failed to cache model for Trellis task {task_id}: {str(e)}")
+            return message
+
+        # Build LOD levels in a worker, once per model
+        if not os.path.exists(glb_cache.manifest_path_for(digest)) and \
+                redis_service.acquire_lease(f"glb_optimize:{digest}", self.instance_id, settings.TRELLIS_RESULT_CACHE_TTL):
+            celery_app.send_task(OPTIMIZE_TASK_NAME, args=[digest, task_id])
+
+        return {
+            **message,
+            "data": glb_cache.url_for(digest),
+            "source_url": source_url,
+            "model_digest": digest,
+            "lods_url": glb_cache.manifest_url_for(digest)
+        }
+
+    def get_stored_status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get the last status stored in Redis by whichever instance polls the task."""
+        return redis_service.get_object(f"trellis_status:{task_id}")
+
+    def store_status(self, task_id: str, message: Dict[str, Any]):
+        """Store the latest status in Redis and append it to the task event log.
+
+        The event log is the same task_stream channel used by the other tasks,
+        so SSE clients can follow a Trellis job through /api/subscribe.
+        """
+        if message == self.get_stored_status(task_id):
+            return
+
+        redis_service.store_object(f"trellis_status:{task_id}", message, STATUS_EXPIRY)
+
+        if message["status"] == "completed":
+            redis_service.publish_complete_event(task_id, message)
+            redis_service.store_response(task_id, message)
+        elif message["status"] == "failed":
+            forget_job(task_id)
+            redis_service.publish_event(task_id, "error", message)
+            redis_service.store_response(task_id, message)
+        else:
+            redis_service.publish_event(task_id, "status", message)
+
+    async def ingest_webhook(self, task_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Record a status pushed by a Trellis webhook and wake local subscribers."""
+        # Webhook bodies carry the task under "data" without the unified "code" field
+        message = parse_trellis_status({"code": 200, "data": payload.get("data", {})})
+        message = await self.localize_model(task_id, message)
+        self.store_status(task_id, message)
+
+        if task_id in self._wake_events:
+            self._wake_events[task_id].set()
+        return message
+
+    async def poll_once(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get the current status of a task, calling the Trellis API only if we hold the lease."""
+        lease_name = f"trellis_poll:{task_id}"
+        if redis_service.acquire_lease(lease_name, self.instance_id, settings.TRELLIS_POLL_LEASE_TTL):
+            message = await self.localize_model(task_id, await self.fetch_status(task_id))
+            if message["status"] != "error":
+                self.store_status(task_id, message)
+            return message
+        return self.get_stored_status(task_id)
+
+    def release(self, task_id: str):
+        """Give up the polling lease of a task."""
+        try:
+            redis_service.release_lease(f"trellis_poll:{task_id}", self.instance_id)
+        except Exception:
+            pass  # The lease expires on its own
+
+    async def _poll_loop(self, task_id: str):
+        """Poll a task until it finishes or loses all subscribers.
+
+        Every tick reads the status stored in Redis. The Trellis API itself is
+        only called by the lease holder, and when webhooks are configured only
+        every TRELLIS_WEBHOOK_POLL_INTERVAL seconds as a safety net.
+        """
+        interval = settings.TRELLIS_POLL_INTERVAL
+        fetch_interval = settings.TRELLIS_WEBHOOK_POLL_INTERVAL if settings.TRELLIS_WEBHOOK_URL else 0
+        wake = self._wake_events.setdefault(task_id, asyncio.Event())
+        loop = asyncio.get_running_loop()
+        last_fetch = None
+        last_status = None
+
+        try:
+            while task_id in self._subscribers:
+                # Clear before reading so a webhook arriving mid-tick is not lost
+                wake.clear()
+                # Only the lease holder talks to the Trellis API, and only when a fetch is due
+                if last_fetch is None or loop.time() - last_fetch >= fetch_interval:
+                    message = await self.poll_once(task_id)
+                    last_fetch = loop.time()
+                else:
+                    message = self.get_stored_status(task_id)
+
+                if message is not None and message != self._last_messages.get(task_id):
+                    self.broadcast(task_id, message)
+
+                if message is not None and is_final_status(message):
+                    break
+
+                # Back off while the job sits in the same queued/processing state
+                current_status = message.get("message") if message else None
+                if current_status == last_status:
+                    interval = min(interval * settings.TRELLIS_POLL_BACKOFF, settings.TRELLIS_POLL_MAX_INTERVAL)
+                else:
+                    interval = settings.TRELLIS_POLL_INTERVAL
+                last_status = current_status
+
+                # Sleep until the next tick or until a webhook arrives
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.release(task_id)
+
+    async def close(self):
+        """Stop all pollers; the HTTP client is closed with the client registry."""
+        for poller in self._pollers.values():
+            poller.cancel()
+        self._pollers.clear()
+
+# Create a singleton instance
+trellis_poller = TrellisPoller()
@@ -0,0 +1,246 @@
+import math
+import time
+import numpy as np
+from io import BytesIO
+from PIL import Image
+from typing import Dict, Any, List, Tuple
+from app.core.config import settings
+from app.core.tracing import traced
+
+# 8-neighborhood offsets (dy, dx), clockwise starting from west
+NEIGHBORS = [(0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1)]
+
+# Pixels darker than this (0-255) count as ink
+INK_THRESHOLD = 200
+
+# Components smaller than this many pixels are treated as noise
+MIN_COMPONENT_PIXELS = 4
+
+Point = Tuple[int, int]
+
+def load_sketch_rgb(data: bytes, max_size: int) -> np.ndarray:
+    """Decode a sketch to RGB on a white background, downscaled to at most max_size pixels."""
+    image = Image.open(BytesIO(data)).convert("RGBA")
+    background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+    image = Image.alpha_composite(background, image).convert("RGB")
+    image.thumbnail((max_size, max_size))
+    return np.asarray(image)
+
+def label_components(mask: List[List[bool]]) -> List[List[Point]]:
+    """Split an ink mask into 8-connected components, each a list of (y, x) pixels."""
+    height = len(mask)
+    width = len(mask[0]) if height else 0
+    labels = [[0] * width for _ in range(height)]
+    components = []
+    
+    for y0 in range(height):
+        row = mask[y0]
+        for x0 in range(width):
+            if not row[x0] or labels[y0][x0]:
+                continue
+            
+            # Flood fill the component from its first pixel
+            label = len(components) + 1
+            labels[y0][x0] = label
+            stack = [(y0, x0)]
+            pixels = []
+            while stack:
+                y, x = stack.pop()
+                pixels.append((y, x))
+                for dy, dx in NEIGHBORS:
+                    ny, nx = y + dy, x + dx
+                    if 0 <= ny < height and 0 <= nx < width and mask[ny][nx] and not labels[ny][nx]:
+                        labels[ny][nx] = label
+                        stack.append((ny, nx))
+            components.append(pixels)
+    
+    return components
+
+def trace_boundary(pixels: List[Point]) -> List[Point]:
+    """Trace the outer boundary of a component clockwise with Moore-neighbor tracing."""
+    inside = set(pixels)
+    start = min(pixels)
+    boundary = [start]
+    current = start
+    direction = 0  # The pixel west of the top-left pixel is always background
+    first_move = None
+    
+    for _ in range(4 * len(pixels) + 8):
+        for turn in range(8):
+            move = (direction + turn) % 8
+            ny, nx = current[0] + NEIGHBORS[move][0], current[1] + NEIGHBORS[move][1]
+            if (ny, nx) in inside:
+                break
+        else:
+            return boundary  # Single pixel
+        
+        # Stop once we leave the start pixel the same way as the first time
+        if current == start and first_move is not None and move == first_move:
+            break
+        if first_move is None:
+            first_move = move
+        
+        current = (ny, nx)
+        boundary.append(current)
+        # Resume the search from the background pixel just before the one we moved to
+        direction = (move + 6) % 8 if move % 2 == 0 else (move + 5) % 8
+    
+    if len(boundary) > 1 and boundary[-1] == start:
+        boundary.pop()
+    return boundary
+
+def simplify_polyline(points: List[Point], tolerance: float) -> List[Point]:
+    """Simplify a polyline with the Ramer-Douglas-Peucker algorithm."""
+    if len(points) < 3:
+        return list(points)
+    
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    
+    while stack:
+        first, last = stack.pop()
+        (y0, x0), (y1, x1) = points[first], points[last]
+        length = math.hypot(x1 - x0, y1 - y0)
+        max_distance, index = 0.0, None
+        
+        for i in range(first + 1, last):
+            y, x = points[i]
+            if length:
+                distance = abs((x1 - x0) * (y0 - y) - (x0 - x) * (y1 - y0)) / length
+            else:
+                distance = math.hypot(x - x0, y - y0)
+            if distance > max_distance:
+                max_distance, index = distance, i
+        
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    
+    return [point for point, kept in zip(points, keep) if kept]
+
+def polygon_area(points: List[Point]) -> float:
+    """Area enclosed by a closed polygon (shoelace formula)."""
+    area = 0.0
+    for (y0, x0), (y1, x1) in zip(points, points[1:] + points[:1]):
+        area += x0 * y1 - x1 * y0
+    return abs(area) / 2.0
+
+def stroke_path(boundary: List[Point]) -> List[Point]:
+    """Turn the outline of a thin open stroke into the stroke's path.
+    
+    The outline runs from one end of the stroke to the other and back, so
+    one side between the two farthest-apart points follows the stroke.
+    """
+    def farthest(origin: Point) -> int:
+        return max(range(len(boundary)), key=lambda i: (boundary[i][0] - origin[0]) ** 2 + (boundary[i][1] - origin[1]) ** 2)
+    
+    start = farthest(boundary[0])
+    end = farthest(boundary[start])
+    if start <= end:
+        return boundary[start:end + 1]
+    return boundary[start:] + boundary[:end + 1]
+
+def classify_component(pixels: List[Point], tolerance: float) -> Dict[str, Any]:
+    """Describe a component as a circle, rectangle, polygon or polyline."""
+    ys = [y for y, _ in pixels]
+    xs = [x for _, x in pixels]
+    left, top, right, bottom = min(xs), min(ys), max(xs), max(ys)
+    width, height = right - left + 1, bottom - top + 1
+    count = len(pixels)
+    
+    if min(width, height) >= 6:
+        # Circles: every pixel lies near one radius (outline) or within it (filled)
+        if abs(width - height) <= 0.15 * max(width, height):
+            cx, cy = (left + right) / 2.0, (top + bottom) / 2.0
+            radius = (width + height) / 4.0
+            distances = [math.hypot(x - cx, y - cy) for y, x in pixels]
+            band = max(2.0, 0.12 * radius)
+            on_ring = sum(1 for d in distances if abs(d - radius) <= band) / count
+            if on_ring > 0.9 and count < math.pi * radius * radius * 0.6:
+                return {"type": "circle", "cx": round(cx), "cy": round(cy), "r": round(radius), "filled": False}
+            if count >= math.pi * radius * radius * 0.85 and max(distances) <= radius + 2:
+                return {"type": "circle", "cx": round(cx), "cy": round(cy), "r": round(radius), "filled": True}
+        
+        # Rectangles: ink along all four sides of the bounding box (outline) or all of it (filled)
+        band = max(2, round(0.08 * min(width, height)))
+        near_edge = sum(
+            1 for y, x in pixels
+            if x - left < band or right - x < band or y - top < band or bottom - y < band
+        ) / count
+        if count >= 0.9 * width * height:
+            return {"type": "rect", "x": left, "y": top, "w": width, "h": height, "filled": True}
+        if near_edge > 0.9:
+            columns = {x for y, x in pixels if y - top < band} & {x for y, x in pixels if bottom - y < band}
+            rows = {y for y, x in pixels if x - left < band} & {y for y, x in pixels if right - x < band}
+            if len(columns) >= 0.8 * width and len(rows) >= 0.8 * height:
+                return {"type": "rect", "x": left, "y": top, "w": width, "h": height, "filled": False}
+    
+    boundary = trace_boundary(pixels)
+    if len(boundary) < 3:
+        return {"type": "polyline", "points": [[x, y] for y, x in boundary] or [[left, top]], "closed": False}
+    
+    # An outline enclosing much more than its own ink is a hollow shape
+    if polygon_area(boundary) > 2 * count:
+        points = simplify_polyline(boundary + boundary[:1], tolerance)[:-1]
+        return {"type": "polygon", "points": [[x, y] for y, x in points], "filled": False}
+    
+    # Thin open strokes become polylines along the stroke
+    if count / max(1.0, len(boundary) / 2.0) < 4:
+        points = simplify_polyline(stroke_path(boundary), tolerance)
+        return {"type": "polyline", "points": [[x, y] for y, x in points], "closed": False}
+    
+    points = simplify_polyline(boundary + boundary[:1], tolerance)[:-1]
+    return {"type": "polygon", "points": [[x, y] for y, x in points], "filled": True}
+
+@traced("image.vectorize")
+def vectorize_sketch(data: bytes) -> Dict[str, Any]:
+    """Vectorize a line-art sketch into a compact list of primitives.
+    
+    Ink is split into connected components, each of which is described as a
+    circle, rectangle, polygon or simplified polyline with its mean color.
+    Coordinates are in the downscaled sketch, whose size is returned too.
+    """
+    start_time = time.perf_counter()
+    
+    rgb = load_sketch_rgb(data, settings.SKETCH_VECTOR_MAX_SIZE)
+    height, width = rgb.shape[:2]
+    mask = rgb.mean(axis=2) < INK_THRESHOLD
+    
+    components = [pixels for pixels in label_components(mask.tolist()) if len(pixels) >= MIN_COMPONENT_PIXELS]
+    # Keep the largest components if the sketch has too many
+    components.sort(key=len, reverse=True)
+    components = components[:settings.SKETCH_VECTOR_MAX_PRIMITIVES]
+    
+    primitives = []
+    for pixels in components:
+        primitive = classify_component(pixels, settings.SKETCH_VECTOR_TOLERANCE)
+        ys, xs = zip(*pixels)
+        red, green, blue = rgb[list(ys), list(xs)].mean(axis=0)
+        primitive["color"] = "#{:02x}{:02x}{:02x}".format(int(red), int(green), int(blue))
+        primitives.append(primitive)
+    
+    return {
+        "width": width,
+        "height": height,
+        "primitives": primitives,
+        "elapsed_ms": round((time.perf_counter() - start_time) * 1000, 2)
+    }
+
+def describe_primitives(vector: Dict[str, Any]) -> str:
+    """Render vectorized primitives as compact text for a prompt."""
+    lines = [f"Sketch of {vector['width']}x{vector['height']} pixels, origin top-left, y down. One primitive per line:"]
+    
+    for primitive in vector["primitives"]:
+        kind = primitive["type"]
+        fill = " filled" if primitive.get("filled") else ""
+        if kind == "circle":
+            lines.append(f"circle{fill} c=({primitive['cx']},{primitive['cy']}) r={primitive['r']} {primitive['color']}")
+        elif kind == "rect":
+            lines.append(f"rect{fill} ({primitive['x']},{primitive['y']}) {primitive['w']}x{primitive['h']} {primitive['color']}")
+        else:
+            points = " ".join(f"{x},{y}" for x, y in primitive["points"])
+            lines.append(f"{kind}{fill} {points} {primitive['color']}")
+    
+    return "\n".join(lines)
@@ -1,7 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from app.api.routes import router as api_router
 from app.core.config import settings
+from app.core.trellis import trellis_poller
+from app.core.http_clients import client_registry
+from app.core.metrics import render_metrics, mark_process_dead
+from app.core.tracing import setup_tracing, shutdown_tracing, instrument_app
+from app.core.profiling import profile_requests, start_control_listener
+from app.core.serialization import orjson
 
 # Create FastAPI app with metadata
 app = FastAPI(
@@ -9,7 +16,9 @@ app = FastAPI(
     version="0.1.0",
     description="API for interacting with Claude 3.7 model",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    # Encode JSON responses with orjson when it is installed
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse
 )
 
 # CORS middleware configuration
@@ -24,6 +33,27 @@ app.add_middleware(
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
+# Profile single requests on demand; the middleware is only added for admins to use
+if settings.ADMIN_TOKEN:
+    app.middleware("http")(profile_requests)
+
+# Trace requests through to the workers when tracing is enabled
+if setup_tracing(f"{settings.TRACING_SERVICE_NAME}-api"):
+    instrument_app(app)
+
+@app.on_event("startup")
+async def startup():
+    """Listen for admin profile capture requests."""
+    start_control_listener("api")
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop background pollers and close pooled clients."""
+    await trellis_poller.close()
+    await client_registry.close()
+    shutdown_tracing()
+    mark_process_dead()
+
 @app.get("/")
 async def root():
     """Root endpoint that confirms the API server is running."""
@@ -32,3 +62,11 @@ async def root():
         "version": "0.1.0",
         "docs_url": "/docs"
     }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Expose Prometheus metrics for the API processes."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
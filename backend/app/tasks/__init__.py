@@ -1,3 +0,0 @@
-from app.tasks import claude_tasks
-from app.tasks import gemini_tasks 
-from app.tasks import cerebras_tasks 
\ No newline at end of file
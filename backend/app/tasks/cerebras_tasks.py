@@ -1,27 +1,210 @@
 import asyncio
-from cerebras.cloud.sdk import AsyncCerebras
+from cerebras.cloud.sdk import AsyncCerebras, DefaultAsyncHttpxClient
 from app.core.celery_app import celery_app
 from app.core.config import settings
-from app.tasks.tasks import AsyncAITask, GenericPromptTask, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
-from typing import Dict, Any, Optional, List
+from app.core.redis import redis_service
+from app.core.http_clients import client_registry
+from app.core.repair import validate_and_repair
+from app.core.metrics import time_provider, record_cache
+from app.core.code import extract_code_block, normalize_scene_code, code_fingerprint, CodeBlockStreamer
+from app.tasks.tasks import AsyncAITask, GenericPromptTask, run_in_worker_loop, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple
 
 # Default model configuration for Cerebras
 DEFAULT_MODEL = "llama3.1-8b"
 
-# Create Cerebras client
+# Model used to extract the main object from a scene
+EXTRACTION_MODEL = "llama3.3-70b"
+
+EXTRACTION_PROMPT = """You are provided with a JavaScript snippet containing a Three.js scene. Extract only the main 3D object creation code, including relevant geometries, materials, meshes, and groups. Completely remove all unrelated elements such as the scene, renderer, camera, lighting, ground planes, animation loops, event listeners, orbit controls, and window resize handling.
+
+Present the resulting code directly, ending with a single statement explicitly returning only the main object (THREE.Mesh or THREE.Group) that was created.
+
+Do not wrap the code in a function or module. Do not import anything.
+"""
+
+# Get the Cerebras client, shared by every request and task on this event loop
 async def get_cerebras_client() -> AsyncCerebras:
-    client = AsyncCerebras(api_key=settings.CEREBRAS_API_KEY)
-    return client
+    return client_registry.sdk_client(
+        "cerebras",
+        lambda http_client: AsyncCerebras(
+            api_key=settings.CEREBRAS_API_KEY,
+            base_url=settings.CEREBRAS_BASE_URL,
+            http_client=http_client,
+            # The warm-up opens a throwaway synchronous connection; the pool keeps ours warm
+            warm_tcp_connection=False
+        ),
+        client_class=DefaultAsyncHttpxClient
+    )
+
+def get_extraction_messages(code: str) -> List[Dict[str, str]]:
+    """Build the messages asking the model to extract the main object from scene code."""
+    return [
+        {
+            "role": "system",
+            "content": ""
+        },
+        {
+            "role": "user",
+            "content": EXTRACTION_PROMPT + code
+        }
+    ]
+
+async def repair_extraction(client: AsyncCerebras, content: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Check that extracted code parses, repairing it with a small follow-up call if not."""
+    if not settings.SYNTAX_VALIDATION:
+        return content, None
+    
+    async def complete(prompt: str, max_tokens: int) -> str:
+        with time_provider("cerebras", EXTRACTION_MODEL, "repair"):
+            response = await client.chat.completions.create(
+                model=EXTRACTION_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                temperature=0
+            )
+        return response.choices[0].message.content
+    
+    return await validate_and_repair(content, complete, "cerebras")
+
+async def extract_object(client: AsyncCerebras, code: str) -> Dict[str, Any]:
+    """Extract the main object creation code from a Three.js scene."""
+    # Send the request to Cerebras
+    with time_provider("cerebras", EXTRACTION_MODEL, "extract"):
+        response = await client.chat.completions.create(
+            model=EXTRACTION_MODEL,
+            messages=get_extraction_messages(code),
+            max_tokens=4096,
+            temperature=0.2,
+            top_p=1
+        )
+    
+    # Catch code that won't parse before the browser does
+    content, validation = await repair_extraction(client, extract_code_block(response.choices[0].message.content))
+    
+    result = {
+        "status": "success",
+        "content": content,
+        "model": response.model,
+        "usage": {
+            "input_tokens": getattr(response.usage, "prompt_tokens", 0),
+            "output_tokens": getattr(response.usage, "completion_tokens", 0),
+            "total_tokens": getattr(response.usage, "total_tokens", 0)
+        }
+    }
+    if validation is not None:
+        result["validation"] = validation
+    return result
+
+async def stream_extract_object(client: AsyncCerebras, code: str) -> AsyncIterator[Tuple[str, Any]]:
+    """Extract the main object like extract_object, yielding the code as it is generated.
+    
+    Yields ("delta", text) for each piece of the extracted code block and
+    finally ("complete", result) with the same result extract_object returns.
+    """
+    streamer = CodeBlockStreamer()
+    text = ""
+    model = EXTRACTION_MODEL
+    usage = None
+    
+    with time_provider("cerebras", EXTRACTION_MODEL, "extract_stream") as timer:
+        stream = await client.chat.completions.create(
+            model=EXTRACTION_MODEL,
+            messages=get_extraction_messages(code),
+            max_tokens=4096,
+            temperature=0.2,
+            top_p=1,
+            stream=True
+        )
+        
+        async for chunk in stream:
+            timer.first_output()
+            model = getattr(chunk, "model", None) or model
+            # The final chunk carries the token usage
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            
+            delta = chunk.choices[0].delta.content or ""
+            text += delta
+            code_delta = streamer.feed(delta)
+            if code_delta:
+                yield "delta", code_delta
+    
+    code_delta = streamer.flush()
+    if code_delta:
+        yield "delta", code_delta
+    
+    # The streamed code is checked as a whole; a repaired version replaces it in the complete event
+    content, validation = await repair_extraction(client, extract_code_block(text))
+    
+    result = {
+        "status": "success",
+        "content": content,
+        "model": model,
+        "usage": {
+            "input_tokens": getattr(usage, "prompt_tokens", 0),
+            "output_tokens": getattr(usage, "completion_tokens", 0),
+            "total_tokens": getattr(usage, "total_tokens", 0)
+        }
+    }
+    if validation is not None:
+        result["validation"] = validation
+    yield "complete", result
+
+def get_cached_extraction(fingerprint: str) -> Optional[Dict[str, Any]]:
+    """Get a previously extracted object by code fingerprint."""
+    return redis_service.get_object(f"extraction:{fingerprint}")
+
+def cache_extraction(fingerprint: str, result: Dict[str, Any]):
+    """Cache an extracted object by code fingerprint."""
+    redis_service.store_object(f"extraction:{fingerprint}", result, settings.EXTRACTION_CACHE_TTL)
+
+def is_extraction_pending(fingerprint: str) -> bool:
+    """Check whether a speculative extraction is currently running for this code."""
+    return bool(redis_service.get_value(f"lease:extraction:{fingerprint}"))
+
+async def wait_for_extraction(fingerprint: str) -> Optional[Dict[str, Any]]:
+    """Get a cached extraction, waiting briefly for a speculative one that is still running."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.EXTRACTION_WAIT_TIMEOUT
+    cached = get_cached_extraction(fingerprint)
+    while cached is None and is_extraction_pending(fingerprint) and loop.time() < deadline:
+        await asyncio.sleep(0.2)
+        cached = get_cached_extraction(fingerprint)
+    record_cache("extraction", cached is not None)
+    return cached
+
+async def get_or_extract_object(code: str) -> Dict[str, Any]:
+    """Extract the main object from scene code, reusing cached and in-flight extractions."""
+    fingerprint = code_fingerprint(code)
+    cached = await wait_for_extraction(fingerprint)
+    if cached is not None:
+        return {**cached, "cached": True}
+    
+    # Fall back to a live call with the pooled client
+    client = await get_cerebras_client()
+    result = await extract_object(client, code)
+    cache_extraction(fingerprint, result)
+    return result
+
+def schedule_extraction(content: str):
+    """Queue a speculative extraction for generated scene code unless it is already cached."""
+    if not settings.SPECULATIVE_EXTRACTION or not settings.CEREBRAS_API_KEY:
+        return
+    
+    fingerprint = code_fingerprint(content)
+    if get_cached_extraction(fingerprint) or is_extraction_pending(fingerprint):
+        return
+    
+    CerebrasExtractTask.apply_async(args=[content])
 
 class AsyncCerebrasTask(AsyncAITask):
     """Base class for Cerebras Celery tasks that use async functions."""
-    _client = None
     
     @property
     async def client(self) -> AsyncCerebras:
-        if self._client is None:
-            self._client = await get_cerebras_client()
-        return self._client
+        return await get_cerebras_client()
 
 class CerebrasPromptTask(GenericPromptTask, AsyncCerebrasTask):
     """Task to process a prompt with Cerebras LLaMA."""
@@ -63,7 +246,8 @@ class CerebrasPromptTask(GenericPromptTask, AsyncCerebrasTask):
     async def send_message(self, client: AsyncCerebras, message_params: Dict[str, Any]) -> Any:
         """Send the message to Cerebras."""
         model = message_params.pop("model")
-        return await client.chat.completions.create(model=model, top_p=1, **message_params)
+        with time_provider("cerebras", model, "prompt"):
+            return await client.chat.completions.create(model=model, top_p=1, **message_params)
     
     def extract_content(self, response: Any) -> str:
         """Extract the content from Cerebras response."""
@@ -84,4 +268,42 @@ class CerebrasPromptTask(GenericPromptTask, AsyncCerebrasTask):
         }
 
 # Register the task properly with Celery
-CerebrasPromptTask = celery_app.register_task(CerebrasPromptTask()) 
\ No newline at end of file
+CerebrasPromptTask = celery_app.register_task(CerebrasPromptTask())
+
+class CerebrasExtractTask(AsyncCerebrasTask):
+    """Task to speculatively extract the main object from generated scene code.
+    
+    The result is cached by code fingerprint so /api/cerebras/parse can answer
+    without calling the model.
+    """
+    
+    async def _run_async(self, content: str) -> Dict[str, Any]:
+        """Extract the main object and cache the result."""
+        fingerprint = code_fingerprint(content)
+        lease_name = f"extraction:{fingerprint}"
+        
+        # Another worker is already extracting this code
+        if not redis_service.acquire_lease(lease_name, self.request.id or fingerprint, 120):
+            return {"status": "skipped", "fingerprint": fingerprint}
+        
+        try:
+            if get_cached_extraction(fingerprint):
+                return {"status": "cached", "fingerprint": fingerprint}
+            
+            client = await self.client
+            result = await extract_object(client, normalize_scene_code(content))
+            cache_extraction(fingerprint, result)
+            return {"status": "success", "fingerprint": fingerprint}
+        except Exception as e:
+            print(f"[ERROR] Speculative extraction failed: {str(e)}")
+            return {"status": "error", "error": str(e), "fingerprint": fingerprint}
+        finally:
+            redis_service.release_lease(lease_name, self.request.id or fingerprint)
+    
+    def run(self, content: str) -> Dict[str, Any]:
+        """Run the task with the given parameters."""
+        # Run on the worker's event loop so pooled connections are reused
+        return run_in_worker_loop(self._run_async(content=content))
+
+# Register the task properly with Celery
+CerebrasExtractTask = celery_app.register_task(CerebrasExtractTask())
\ No newline at end of file
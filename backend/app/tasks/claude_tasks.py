@@ -1,28 +1,71 @@
-import asyncio
-from anthropic import AsyncAnthropic
+import time
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
 from app.core.celery_app import celery_app
 from app.core.config import settings
-from app.tasks.tasks import AsyncAITask, GenericPromptTask, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
+from app.tasks.tasks import AsyncAITask, GenericPromptTask, run_in_worker_loop, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
 from app.core.redis import redis_service
-from typing import Dict, Any, Optional, List, Union
+from app.core.http_clients import client_registry
+from app.core.images import strip_data_url, decode_base64_image, get_base64_image_mime_type
+from app.core.vectorize import vectorize_sketch, describe_primitives
+from app.core.code import extract_code_block, parse_search_replace, apply_search_replace, make_unified_diff, PatchError
+from app.core.scenes import scene_store
+from app.core.complexity import guard_scene
+from app.core.repair import validate_and_repair
+from app.core.js import compact_js, elide_boilerplate, restore_boilerplate, carry_over_edit, JSSyntaxError
+from app.core.sketches import sketch_store
+from app.core.metrics import time_provider
+from app.core.timeline import mark_stage
+from app.tasks.cerebras_tasks import schedule_extraction
+from typing import Dict, Any, Optional, List, Union, Tuple
 
 # Default model configuration for Claude
 DEFAULT_MODEL = "claude-3-7-sonnet-20250219"
 
-# Create Anthropic client for Claude 3.7
+# Get the Anthropic client for Claude 3.7, shared by every task on this event loop
 async def get_anthropic_client() -> AsyncAnthropic:
-    client = AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
-    return client
+    return client_registry.sdk_client(
+        "anthropic",
+        lambda http_client: AsyncAnthropic(
+            api_key=settings.ANTHROPIC_API_KEY,
+            base_url=settings.ANTHROPIC_BASE_URL,
+            http_client=http_client
+        ),
+        # The SDK's own client class, since newer SDK versions run on the httpx2 fork
+        client_class=DefaultAsyncHttpxClient
+    )
 
 class AsyncClaudeTask(AsyncAITask):
     """Base class for Claude Celery tasks that use async functions."""
-    _client = None
     
     @property
     async def client(self) -> AsyncAnthropic:
-        if self._client is None:
-            self._client = await get_anthropic_client()
-        return self._client
+        return await get_anthropic_client()
+    
+    async def repair_content(self, client: AsyncAnthropic, content: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Check that the code in a response parses, repairing it with a small follow-up call if not."""
+        if not settings.SYNTAX_VALIDATION:
+            return content, None
+        
+        async def complete(prompt: str, max_tokens: int) -> str:
+            with time_provider("claude", DEFAULT_MODEL, "repair"):
+                response = await client.messages.create(
+                    model=DEFAULT_MODEL,
+                    max_tokens=max_tokens,
+                    temperature=0,
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            return response.content[0].text
+        
+        code = extract_code_block(content)
+        repaired, report = await validate_and_repair(code, complete, "claude")
+        return (content.replace(code, repaired, 1) if repaired != code else content), report
+    
+    def schedule_extraction(self, content: str):
+        """Queue speculative object extraction without failing the task if it can't be queued."""
+        try:
+            schedule_extraction(content)
+        except Exception as e:
+            print(f"[ERROR] Failed to schedule object extraction: {str(e)}")
 
 class ClaudePromptTask(GenericPromptTask, AsyncClaudeTask):
     """Task to generate 3D models from images using Claude 3.7."""
@@ -31,8 +74,17 @@ class ClaudePromptTask(GenericPromptTask, AsyncClaudeTask):
                          system_prompt: Optional[str] = None,
                          max_tokens: int = DEFAULT_MAX_TOKENS, 
                          temperature: float = DEFAULT_TEMPERATURE,
-                         additional_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Process a 3D model generation request with Claude 3.7."""
+                         additional_params: Optional[Dict[str, Any]] = None,
+                         number_of_images: int = 1,
+                         aspect_ratio: Optional[str] = None,
+                         negative_prompt: Optional[str] = None,
+                         shape_id: Optional[str] = None) -> Dict[str, Any]:
+        """Process a 3D model generation request with Claude 3.7.
+        
+        number_of_images variants are generated concurrently from the same prompt.
+        With a shape_id, a sketch that only changed in a small region since the
+        shape's last generation is sent to the edit path instead.
+        """
         try:
             # Publish start event
             redis_service.publish_start_event(task_id)
@@ -40,8 +92,107 @@ class ClaudePromptTask(GenericPromptTask, AsyncClaudeTask):
             # Get the Claude client
             client = await self.client
             
-            # Prepare the system prompt for 3D generation
-            system_prompt = """You are an expert 3D modeler and Three.js developer who specializes in turning 2D drawings and wireframes into 3D models.
+            start_time = time.perf_counter()
+            image_data = strip_data_url(image_base64) if image_base64 else ""
+            route = self.route_sketch(task_id, shape_id, image_data) if shape_id and (number_of_images or 1) == 1 else None
+            
+            if route is not None and route["path"] != "generate":
+                final_response, content = await self.regenerate_region(
+                    client, task_id, route, prompt, max_tokens, temperature
+                )
+                
+                # Report the latency saved against the shape's last full generation
+                latency_ms = round((time.perf_counter() - start_time) * 1000, 2)
+                saved_ms = max(0.0, route["baseline_ms"] - latency_ms)
+                final_response["route"] = {
+                    **{key: value for key, value in route.items() if key != "region_base64"},
+                    "latency_ms": latency_ms,
+                    "saved_ms": round(saved_ms, 2)
+                }
+                self.remember_sketch(shape_id, image_data, final_response["version_id"], route["baseline_ms"], route["path"], latency_ms, saved_ms)
+                
+                # Publish completion event
+                redis_service.publish_complete_event(task_id, final_response)
+                
+                # Store the final response in Redis for retrieval
+                redis_service.store_response(task_id, final_response)
+                
+                # Extract the main object ahead of time for placing it in the 3D world
+                self.schedule_extraction(content)
+                
+                return final_response
+            
+            # Prepare message parameters for Claude
+            message_params = self.prepare_message_params(
+                prompt=prompt,
+                system_prompt=system_prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                additional_params=additional_params,
+                image_base64=image_base64,
+                negative_prompt=negative_prompt
+            )
+            mark_stage("preprocessing_done")
+            
+            # Generate the variants concurrently
+            variants = await self.gather_variants(
+                task_id,
+                number_of_images or 1,
+                lambda index: self.generate_variant(client, message_params)
+            )
+            
+            # Prepare the final response
+            final_response = self.merge_variants(task_id, variants)
+            
+            if route is not None:
+                latency_ms = round((time.perf_counter() - start_time) * 1000, 2)
+                final_response["route"] = {
+                    **route,
+                    "latency_ms": latency_ms,
+                    "saved_ms": 0.0
+                }
+                self.remember_sketch(shape_id, image_data, final_response["version_id"], latency_ms, "generate", latency_ms, 0.0)
+            
+            # Publish completion event
+            redis_service.publish_complete_event(task_id, final_response)
+            
+            # Store the final response in Redis for retrieval
+            redis_service.store_response(task_id, final_response)
+            
+            # Extract the main object ahead of time for placing it in the 3D world
+            for variant in variants:
+                if not isinstance(variant, Exception):
+                    self.schedule_extraction(variant["content"])
+            
+            return final_response
+            
+        except Exception as e:
+            # Prepare error response
+            error_response = {
+                "status": "error",
+                "error": str(e),
+                "error_type": type(e).__name__,
+                "task_id": task_id
+            }
+            
+            try:
+                # Publish error event and store the error response
+                redis_service.publish_error_event(task_id, e)
+                redis_service.store_response(task_id, error_response)
+            except Exception:
+                pass  # Ignore Redis errors at this point
+            
+            return error_response
+
+    def prepare_message_params(self, prompt: str, system_prompt: Optional[str] = None,
+                               max_tokens: int = DEFAULT_MAX_TOKENS, 
+                               temperature: float = DEFAULT_TEMPERATURE,
+                               additional_params: Optional[Dict[str, Any]] = None,
+                               image_base64: Optional[str] = None,
+                               negative_prompt: Optional[str] = None) -> Dict[str, Any]:
+        """Prepare the message parameters for 3D generation with Claude."""
+        # Prepare the system prompt for 3D generation
+        system_prompt = """You are an expert 3D modeler and Three.js developer who specializes in turning 2D drawings and wireframes into 3D models.
 You are a wise and ancient modeler and developer. You are the best at what you do. Your total compensation is $1.2m with annual refreshers. You've just drank three cups of coffee and are laser focused. Welcome to a new day at your job!
 Your task is to analyze the provided image and create a Three.js scene that transforms the 2D drawing into a realistic 3D representation.
 
@@ -66,9 +217,9 @@ Your task is to analyze the provided image and create a Three.js scene that tran
 Your response must contain only valid JavaScript code for the Three.js scene with proper initialization 
 and animation loop. Include code comments explaining your reasoning for major design decisions.
 Wrap your entire code in backticks with the javascript identifier: ```javascript"""
-            
-            # Base text prompt that will always be included
-            base_text = """Transform this 2D drawing/wireframe into an interactive Three.js 3D scene. 
+        
+        # Base text prompt that will always be included
+        base_text = """Transform this 2D drawing/wireframe into an interactive Three.js 3D scene. 
 
 I need code that:
 1. Creates appropriate 3D geometries based on the shapes in the image
@@ -80,103 +231,187 @@ I need code that:
 7. Creates a cohesive scene that represents the spatial relationships in the drawing
 
 Return ONLY the JavaScript code that creates and animates the Three.js scene."""
-            
-            # Ensure we have a valid message with at least one content item
-            message_content = [{"type": "text", "text": base_text}]
-            
-            # Extract base64 data without the prefix if it exists
-            image_data = image_base64.split(",")[-1] if "," in image_base64 else image_base64
-            
-            # Add the image to the message
-            if image_data:
-                message_content.append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": image_data
-                    }
-                })
-            else:
-                raise ValueError("Invalid image data provided")
-            
-            # Add any text prompts provided
-            if prompt and prompt.strip():
-                message_content.append({
-                    "type": "text",
-                    "text": f"Here's a list of text that we found in the design:\n{prompt}"
-                })
-            
-            # Prepare message parameters for Claude
-            message_params = {
-                "model": DEFAULT_MODEL,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "messages": [{
-                    "role": "user",
-                    "content": message_content
-                }],
-                "system": system_prompt
-            }
-            
-            # Add any additional parameters
-            if additional_params:
-                message_params.update(additional_params)
-            
-            # Send the request to Claude
-            response = await client.messages.create(**message_params)
-            
-            # Extract content from the response
-            content = response.content[0].text
-            
-            # Prepare the final response
-            final_response = {
+        
+        # Ensure we have a valid message with at least one content item
+        message_content = [{"type": "text", "text": base_text}]
+        
+        # Extract base64 data without the prefix if it exists
+        image_data = strip_data_url(image_base64) if image_base64 else ""
+        if not image_data:
+            raise ValueError("Invalid image data provided")
+        
+        # The sketch mode is ours, not a Claude API parameter
+        additional_params = dict(additional_params or {})
+        sketch_mode = additional_params.pop("sketch_mode", None) or settings.SKETCH_MODE
+        if sketch_mode not in ("image", "vector", "both"):
+            raise ValueError(f"Unknown sketch mode: {sketch_mode}")
+        
+        # Add the image to the message
+        if sketch_mode in ("image", "both"):
+            message_content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": get_base64_image_mime_type(image_data),
+                    "data": image_data
+                }
+            })
+        
+        # Add the sketch as a compact list of primitives
+        if sketch_mode in ("vector", "both"):
+            vector = vectorize_sketch(decode_base64_image(image_data))
+            message_content.append({
+                "type": "text",
+                "text": "Here is the drawing traced into primitives:\n" + describe_primitives(vector)
+            })
+        
+        # Add any text prompts provided
+        if prompt and prompt.strip():
+            message_content.append({
+                "type": "text",
+                "text": f"Here's a list of text that we found in the design:\n{prompt}"
+            })
+        
+        # Add anything the model should leave out
+        if negative_prompt and negative_prompt.strip():
+            message_content.append({
+                "type": "text",
+                "text": f"Do not include the following in the scene:\n{negative_prompt}"
+            })
+        
+        # Prepare message parameters for Claude
+        message_params = {
+            "model": DEFAULT_MODEL,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [{
+                "role": "user",
+                "content": message_content
+            }],
+            "system": system_prompt
+        }
+        
+        # Add any additional parameters
+        if additional_params:
+            message_params.update(additional_params)
+        
+        return message_params
+
+    def route_sketch(self, task_id: str, shape_id: str, image_data: str) -> Optional[Dict[str, Any]]:
+        """Compare the sketch with the shape's previous one and pick generate, edit or unchanged."""
+        try:
+            route = sketch_store.route(shape_id, image_data)
+        except Exception as e:
+            # Diffing is only an optimization; fall back to a full generation
+            print(f"[ERROR] Failed to diff sketch for shape {shape_id}: {str(e)}")
+            return {"path": "generate", "reason": "diff failed"}
+        
+        # An edit needs the previous scene, which may have expired
+        if route["path"] != "generate" and scene_store.get(route["version_id"]) is None:
+            route = {"path": "generate", "reason": "previous scene expired"}
+        
+        redis_service.publish_event(task_id, "route", {
+            key: value for key, value in route.items() if key != "region_base64"
+        })
+        return route
+
+    async def regenerate_region(self, client: AsyncAnthropic, task_id: str, route: Dict[str, Any],
+                                prompt: str, max_tokens: int, temperature: float):
+        """Update the shape's previous scene for a small sketch change, or reuse it if nothing changed.
+        
+        Returns the response together with the content of the scene.
+        """
+        if route["path"] == "unchanged":
+            content = f"```javascript\n{scene_store.get_code(route['version_id'])}\n```"
+            return {
                 "status": "success",
                 "content": content,
-                "model": response.model,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens,
-                    "total_tokens": response.usage.input_tokens + response.usage.output_tokens
-                },
+                "version_id": route["version_id"],
+                "model": None,
+                "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0},
                 "task_id": task_id
-            }
-            
-            # Publish completion event
-            redis_service.publish_complete_event(task_id, final_response)
-            
-            # Store the final response in Redis for retrieval
-            redis_service.store_response(task_id, final_response)
-            
-            return final_response
-            
+            }, content
+        
+        left, top, right, bottom = route["region_box"]
+        width, height = route["size"]
+        region_prompt = (
+            f"The user changed part of the drawing this scene was generated from. The image shows only the changed "
+            f"region, cropped from x={left}..{right}, y={top}..{bottom} of the {width}x{height} drawing. "
+            f"Update the scene so the 3D model reflects the change in that region, leaving the rest as it is."
+        )
+        if prompt and prompt.strip():
+            region_prompt += f"\nHere's a list of text that we found in the design:\n{prompt}"
+        
+        final_response, _ = await ClaudeEditTask.generate_edit(
+            client, task_id, scene_store.get_code(route["version_id"]), route["region_base64"],
+            region_prompt, max_tokens, temperature, base_version_id=route["version_id"], edit_mode="full"
+        )
+        return final_response, final_response["content"]
+
+    def remember_sketch(self, shape_id: str, image_data: str, version_id: str, baseline_ms: float,
+                        path: str, latency_ms: float, saved_ms: float):
+        """Store the sketch for the next diff and record the routing decision."""
+        try:
+            sketch_store.put(shape_id, image_data, version_id, baseline_ms)
+            sketch_store.record(path, latency_ms, saved_ms)
         except Exception as e:
-            # Prepare error response
-            error_response = {
-                "status": "error",
-                "error": str(e),
-                "error_type": type(e).__name__,
-                "task_id": task_id
+            print(f"[ERROR] Failed to store sketch for shape {shape_id}: {str(e)}")
+
+    async def generate_variant(self, client: AsyncAnthropic, message_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate one variant of the scene."""
+        # Send the request to Claude
+        response = await self.send_message(client, message_params)
+        
+        # Extract content from the response
+        content = self.extract_content(response)
+        
+        # Catch code that won't parse before the browser does
+        content, validation = await self.repair_content(client, content)
+        
+        # Clamp runaway geometry before the scene reaches the browser
+        complexity = None
+        if settings.COMPLEXITY_GUARD:
+            content, complexity = guard_scene(content)
+        
+        result = {
+            "status": "success",
+            "content": content,
+            # Lets the client start a scene session for diff-based edits
+            "version_id": scene_store.put(extract_code_block(content)),
+            "model": response.model,
+            "usage": {
+                "input_tokens": response.usage.input_tokens,
+                "output_tokens": response.usage.output_tokens,
+                "total_tokens": response.usage.input_tokens + response.usage.output_tokens
             }
-            
-            try:
-                # Publish error event and store the error response
-                redis_service.publish_error_event(task_id, e)
-                redis_service.store_response(task_id, error_response)
-            except Exception:
-                pass  # Ignore Redis errors at this point
-            
-            return error_response
+        }
+        if validation is not None:
+            result["validation"] = validation
+        if complexity is not None:
+            result["complexity"] = complexity
+        return result
+
+    async def send_message(self, client: AsyncAnthropic, message_params: Dict[str, Any]) -> Any:
+        """Send the message to Claude."""
+        with time_provider("claude", message_params.get("model"), "generate"):
+            return await client.messages.create(**message_params)
+
+    def extract_content(self, response: Any) -> str:
+        """Extract the content from Claude's response."""
+        return response.content[0].text
 
     def run(self, task_id: str, image_base64: str, prompt: str = "",
             system_prompt: Optional[str] = None,
             max_tokens: int = DEFAULT_MAX_TOKENS, 
             temperature: float = DEFAULT_TEMPERATURE,
-            additional_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+            additional_params: Optional[Dict[str, Any]] = None,
+            number_of_images: int = 1,
+            aspect_ratio: Optional[str] = None,
+            negative_prompt: Optional[str] = None,
+            shape_id: Optional[str] = None) -> Dict[str, Any]:
         """Run the task with the given parameters."""
-        # Create and run the event loop to execute the async function
-        loop = asyncio.get_event_loop()
-        result = loop.run_until_complete(
+        # Run on the worker's event loop so pooled connections are reused
+        result = run_in_worker_loop(
             self._run_async(
                 task_id=task_id,
                 image_base64=image_base64,
@@ -184,7 +419,11 @@ Return ONLY the JavaScript code that creates and animates the Three.js scene."""
                 system_prompt=system_prompt,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                additional_params=additional_params
+                additional_params=additional_params,
+                number_of_images=number_of_images,
+                aspect_ratio=aspect_ratio,
+                negative_prompt=negative_prompt,
+                shape_id=shape_id
             )
         )
         return result
@@ -192,31 +431,8 @@ Return ONLY the JavaScript code that creates and animates the Three.js scene."""
 # Register the task properly with Celery
 ClaudePromptTask = celery_app.register_task(ClaudePromptTask())
 
-class ClaudeEditTask(GenericPromptTask, AsyncClaudeTask):
-    """Task to edit 3D models using Claude 3.7."""
-
-    async def _run_async(self, task_id: str, threejs_code: str, image_base64: str = "", prompt: str = "",
-                         system_prompt: Optional[str] = None,
-                         max_tokens: int = DEFAULT_MAX_TOKENS, 
-                         temperature: float = DEFAULT_TEMPERATURE,
-                         additional_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Process a 3D model editing request with Claude 3.7."""
-        try:
-            # Validate input parameters
-            if not threejs_code:
-                raise ValueError("Three.js code is required")
-            
-            if not image_base64 and not prompt:
-                raise ValueError("At least one of image or text prompt must be provided")
-            
-            # Publish start event
-            redis_service.publish_start_event(task_id)
-            
-            # Get the Claude client
-            client = await self.client
-            
-            # Prepare the system prompt for 3D code editing
-            system_prompt = """You are an expert 3D modeler and Three.js developer who specializes in editing and enhancing Three.js code based on user input.
+# System prompt for 3D code editing, followed by one of the response formats below
+EDIT_SYSTEM_PROMPT = """You are an expert 3D modeler and Three.js developer who specializes in editing and enhancing Three.js code based on user input.
 You are a wise and ancient modeler and developer. You are the best at what you do. Your total compensation is $1.2m with annual refreshers. You've just drank three cups of coffee and are laser focused. Welcome to a new day at your job!
 Your task is to modify the provided Three.js code based on the user's requirements, which may include an image reference and/or text instructions.
 
@@ -237,14 +453,31 @@ Your task is to modify the provided Three.js code based on the user's requiremen
 - Use consistent naming conventions with the original code
 - Maintain the original material types when possible
 - Preserve comments and add new ones to explain significant changes
+"""
 
+EDIT_FULL_FORMAT = """
 ## RESPONSE FORMAT:
 Your response must contain only the complete, valid JavaScript code for the modified Three.js scene.
 The code should be fully functional and ready to run without additional modification.
 Wrap your entire code in backticks with the javascript identifier: ```javascript"""
-            
-            # Base text prompt that will always be included
-            base_text = """Edit the provided Three.js code according to these requirements:
+
+EDIT_PATCH_FORMAT = """
+## RESPONSE FORMAT:
+Respond only with search/replace blocks describing your changes, in this exact format:
+
+<<<<<<< SEARCH
+exact lines copied from the original code
+=======
+the lines that replace them
+>>>>>>> REPLACE
+
+- Each SEARCH block must match the original code exactly, including indentation, and only once
+- Include just enough surrounding lines to make each SEARCH block unique
+- Use as many blocks as needed, in the order they appear in the code
+- Do not repeat unchanged code outside of the blocks"""
+
+# Base text prompts that will always be included
+EDIT_FULL_TEXT = """Edit the provided Three.js code according to these requirements:
 1. Preserve the core functionality and structure
 2. Make only the necessary changes to meet the requirements
 3. Keep the code clean and well-organized
@@ -252,71 +485,57 @@ Wrap your entire code in backticks with the javascript identifier: ```javascript
 5. Maintain consistent naming and style with the original code
 
 Return the COMPLETE JavaScript code for the modified Three.js scene."""
+
+EDIT_PATCH_TEXT = """Edit the provided Three.js code according to these requirements:
+1. Preserve the core functionality and structure
+2. Make only the necessary changes to meet the requirements
+3. Keep the code clean and well-organized
+4. Ensure the scene remains responsive to the container size
+5. Maintain consistent naming and style with the original code
+
+Return ONLY search/replace blocks for the lines that change."""
+
+class ClaudeEditTask(GenericPromptTask, AsyncClaudeTask):
+    """Task to edit 3D models using Claude 3.7.
+    
+    In "full" mode Claude re-emits the whole file. In "diff" mode the base code
+    comes from a server-held scene version, Claude returns search/replace hunks
+    that are applied and validated here, and only the diff is sent back. If the
+    hunks don't apply, the edit falls back to a full rewrite.
+    """
+
+    async def _run_async(self, task_id: str, threejs_code: str = "", image_base64: str = "", prompt: str = "",
+                         system_prompt: Optional[str] = None,
+                         max_tokens: int = DEFAULT_MAX_TOKENS, 
+                         temperature: float = DEFAULT_TEMPERATURE,
+                         additional_params: Optional[Dict[str, Any]] = None,
+                         base_version_id: Optional[str] = None,
+                         session_id: Optional[str] = None,
+                         edit_mode: Optional[str] = None) -> Dict[str, Any]:
+        """Process a 3D model editing request with Claude 3.7."""
+        try:
+            # Resolve the code to edit from the scene store or the request
+            if base_version_id:
+                threejs_code = scene_store.get_code(base_version_id)
             
-            # Ensure we have a valid message with at least one content item
-            message_content = [{"type": "text", "text": base_text}]
-            
-            # Add the Three.js code to edit
-            message_content.append({
-                "type": "text",
-                "text": f"Here is the Three.js code to edit:\n\n```javascript\n{threejs_code}\n```"
-            })
-            
-            # Add the image to the message if provided
-            if image_base64:
-                # Extract base64 data without the prefix if it exists
-                image_data = image_base64.split(",")[-1] if "," in image_base64 else image_base64
-                
-                message_content.append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": image_data
-                    }
-                })
-            
-            # Add any text prompts provided
-            if prompt and prompt.strip():
-                message_content.append({
-                    "type": "text",
-                    "text": f"Here are the specific changes requested:\n{prompt}"
-                })
-            
-            # Prepare message parameters for Claude
-            message_params = {
-                "model": DEFAULT_MODEL,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "messages": [{
-                    "role": "user",
-                    "content": message_content
-                }],
-                "system": system_prompt
-            }
+            # Validate input parameters
+            if not threejs_code:
+                raise ValueError("Three.js code is required")
             
-            # Add any additional parameters
-            if additional_params:
-                message_params.update(additional_params)
+            if not image_base64 and not prompt:
+                raise ValueError("At least one of image or text prompt must be provided")
             
-            # Send the request to Claude
-            response = await client.messages.create(**message_params)
+            # Publish start event
+            redis_service.publish_start_event(task_id)
             
-            # Extract content from the response
-            content = response.content[0].text
+            # Get the Claude client
+            client = await self.client
             
             # Prepare the final response
-            final_response = {
-                "status": "success",
-                "content": content,
-                "model": response.model,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens,
-                    "total_tokens": response.usage.input_tokens + response.usage.output_tokens
-                },
-                "task_id": task_id
-            }
+            final_response, new_code = await self.generate_edit(
+                client, task_id, threejs_code, image_base64, prompt, max_tokens, temperature,
+                additional_params, base_version_id, session_id, edit_mode
+            )
             
             # Publish completion event
             redis_service.publish_complete_event(task_id, final_response)
@@ -324,6 +543,9 @@ Return the COMPLETE JavaScript code for the modified Three.js scene."""
             # Store the final response in Redis for retrieval
             redis_service.store_response(task_id, final_response)
             
+            # Extract the main object ahead of time for placing it in the 3D world
+            self.schedule_extraction(new_code)
+            
             return final_response
             
         except Exception as e:
@@ -344,15 +566,239 @@ Return the COMPLETE JavaScript code for the modified Three.js scene."""
             
             return error_response
 
-    def run(self, task_id: str, threejs_code: str, image_base64: str = "", prompt: str = "",
+    async def generate_edit(self, client: AsyncAnthropic, task_id: str, threejs_code: str,
+                            image_base64: str, prompt: str, max_tokens: int, temperature: float,
+                            additional_params: Optional[Dict[str, Any]] = None,
+                            base_version_id: Optional[str] = None,
+                            session_id: Optional[str] = None,
+                            edit_mode: Optional[str] = None,
+                            elide: Optional[bool] = None,
+                            usages: Optional[List[Any]] = None) -> Tuple[Dict[str, Any], str]:
+        """Edit the code with Claude, store the new version and build the response.
+        
+        Compaction only shapes the prompt: the edit is carried over to the
+        client's own code before it is stored or diffed. usages holds the usage
+        of earlier attempts at the same edit, which count towards the total.
+        Returns the response together with the edited code.
+        """
+        # Patches need a server-held base version, so default to them when the client has one
+        edit_mode = edit_mode or ("diff" if base_version_id else "full")
+        if edit_mode not in ("diff", "full"):
+            raise ValueError(f"Unknown edit mode: {edit_mode}")
+        
+        # Remember the base so later edits can refer to it
+        if not base_version_id:
+            base_version_id = scene_store.put(threejs_code, session_id=session_id)
+        
+        # Send the model a compacted copy of the code
+        elide = settings.EDIT_ELIDE_BOILERPLATE if elide is None else elide
+        prompt_code, elided, compaction = self.compact_code(task_id, threejs_code, elide)
+        mark_stage("preprocessing_done")
+        
+        usages = list(usages or [])
+        mode = "rewrite"
+        content = None
+        
+        if edit_mode == "diff":
+            message_params = self.prepare_message_params(
+                prompt_code, image_base64, prompt, max_tokens, temperature, additional_params,
+                patch=True, elided=bool(elided)
+            )
+            with time_provider("claude", message_params.get("model"), "edit_patch"):
+                response = await client.messages.create(**message_params)
+            usages.append(response.usage)
+            
+            try:
+                new_code = apply_search_replace(prompt_code, parse_search_replace(response.content[0].text))
+                mode = "patch"
+            except PatchError as e:
+                # Fall back to asking for the whole file
+                print(f"[DEBUG] Patch for task {task_id} failed ({str(e)}), falling back to a full rewrite")
+                redis_service.publish_event(task_id, "fallback", {"reason": str(e)})
+        
+        if mode == "rewrite":
+            message_params = self.prepare_message_params(
+                prompt_code, image_base64, prompt, max_tokens, temperature, additional_params,
+                patch=False, elided=bool(elided)
+            )
+            
+            # Send the request to Claude
+            with time_provider("claude", message_params.get("model"), "edit"):
+                response = await client.messages.create(**message_params)
+            usages.append(response.usage)
+            
+            # Extract content from the response
+            content = response.content[0].text
+            new_code = extract_code_block(content)
+        
+        if elided:
+            try:
+                new_code = restore_boilerplate(new_code, elided)
+            except ValueError as e:
+                # The model didn't keep the placeholders; redo the edit with the full setup code
+                print(f"[DEBUG] Edit for task {task_id} lost elided code ({str(e)}), retrying without elision")
+                return await self.generate_edit(
+                    client, task_id, threejs_code, image_base64, prompt, max_tokens, temperature,
+                    additional_params, base_version_id, session_id, edit_mode, elide=False, usages=usages
+                )
+        
+        if compaction is not None:
+            try:
+                new_code = carry_over_edit(threejs_code, new_code)
+            except JSSyntaxError as e:
+                # Keep the compacted edit; the repair below gets a chance to fix it
+                print(f"[DEBUG] Could not carry edit for task {task_id} over to the original code: {str(e)}")
+            if content is not None:
+                content = f"```javascript\n{new_code}\n```"
+        
+        # Catch code that won't parse before the browser does
+        repaired_code, validation = await self.repair_content(client, new_code)
+        if content is not None and repaired_code != new_code:
+            content = content.replace(new_code, repaired_code, 1)
+        new_code = repaired_code
+        
+        # Clamp runaway geometry before the scene reaches the browser
+        complexity = None
+        if settings.COMPLEXITY_GUARD:
+            guarded_code, complexity = guard_scene(new_code)
+            if content is not None and guarded_code != new_code:
+                content = content.replace(new_code, guarded_code, 1)
+            new_code = guarded_code
+        
+        version_id = scene_store.put(new_code, parent_id=base_version_id, session_id=session_id)
+        
+        final_response = {
+            "status": "success",
+            "mode": mode,
+            "version_id": version_id,
+            "base_version_id": base_version_id,
+            "session_id": session_id,
+            "model": response.model,
+            "usage": {
+                "input_tokens": sum(usage.input_tokens for usage in usages),
+                "output_tokens": sum(usage.output_tokens for usage in usages),
+                "total_tokens": sum(usage.input_tokens + usage.output_tokens for usage in usages)
+            },
+            "task_id": task_id
+        }
+        
+        if compaction is not None:
+            final_response["compaction"] = compaction
+        if validation is not None:
+            final_response["validation"] = validation
+        if complexity is not None:
+            final_response["complexity"] = complexity
+        
+        if edit_mode == "diff":
+            # Clients apply the diff to their copy of the base version
+            final_response["diff"] = make_unified_diff(threejs_code, new_code, base_version_id, version_id)
+        else:
+            final_response["content"] = content
+        
+        return final_response, new_code
+
+    def compact_code(self, task_id: str, threejs_code: str, elide: bool) -> Tuple[str, Dict[str, str], Optional[Dict[str, Any]]]:
+        """Strip comments and whitespace from the code to edit, and optionally elide setup boilerplate.
+        
+        Returns the code to send, the elided statements by placeholder and a
+        report of the savings, or the code unchanged if compaction is disabled.
+        """
+        if not settings.EDIT_COMPACTION:
+            return threejs_code, {}, None
+        
+        try:
+            compacted = compact_js(threejs_code)
+            elided = {}
+            if elide:
+                compacted, elided = elide_boilerplate(compacted)
+        except JSSyntaxError as e:
+            # Leave code we can't tokenize alone
+            print(f"[DEBUG] Not compacting code for task {task_id}: {str(e)}")
+            return threejs_code, {}, None
+        
+        report = {
+            "original_chars": len(threejs_code),
+            "compacted_chars": len(compacted),
+            "elided_statements": len(elided),
+            # Roughly four characters per token for code
+            "estimated_tokens_saved": (len(threejs_code) - len(compacted)) // 4
+        }
+        print(f"[DEBUG] Compacted code for task {task_id} from {report['original_chars']} to "
+              f"{report['compacted_chars']} characters (~{report['estimated_tokens_saved']} tokens saved)")
+        return compacted, elided, report
+
+    def prepare_message_params(self, threejs_code: str, image_base64: str, prompt: str,
+                               max_tokens: int, temperature: float,
+                               additional_params: Optional[Dict[str, Any]] = None,
+                               patch: bool = False, elided: bool = False) -> Dict[str, Any]:
+        """Prepare the message parameters for editing with Claude, asking for either patches or the full file."""
+        # Ensure we have a valid message with at least one content item
+        message_content = [{"type": "text", "text": EDIT_PATCH_TEXT if patch else EDIT_FULL_TEXT}]
+        
+        # Add the Three.js code to edit
+        message_content.append({
+            "type": "text",
+            "text": f"Here is the Three.js code to edit:\n\n```javascript\n{threejs_code}\n```"
+        })
+        
+        # Explain the placeholders for elided setup code
+        if elided:
+            message_content.append({
+                "type": "text",
+                "text": "Statements of the form __KEEP_1__; stand for unchanged renderer, camera and resize setup code. "
+                        "Keep each of them exactly once and exactly as written."
+            })
+        
+        # Add the image to the message if provided
+        if image_base64:
+            # Extract base64 data without the prefix if it exists
+            image_data = strip_data_url(image_base64)
+            
+            message_content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": get_base64_image_mime_type(image_data),
+                    "data": image_data
+                }
+            })
+        
+        # Add any text prompts provided
+        if prompt and prompt.strip():
+            message_content.append({
+                "type": "text",
+                "text": f"Here are the specific changes requested:\n{prompt}"
+            })
+        
+        # Prepare message parameters for Claude
+        message_params = {
+            "model": DEFAULT_MODEL,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [{
+                "role": "user",
+                "content": message_content
+            }],
+            "system": EDIT_SYSTEM_PROMPT + (EDIT_PATCH_FORMAT if patch else EDIT_FULL_FORMAT)
+        }
+        
+        # Add any additional parameters
+        if additional_params:
+            message_params.update(additional_params)
+        
+        return message_params
+
+    def run(self, task_id: str, threejs_code: str = "", image_base64: str = "", prompt: str = "",
             system_prompt: Optional[str] = None,
             max_tokens: int = DEFAULT_MAX_TOKENS, 
             temperature: float = DEFAULT_TEMPERATURE,
-            additional_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+            additional_params: Optional[Dict[str, Any]] = None,
+            base_version_id: Optional[str] = None,
+            session_id: Optional[str] = None,
+            edit_mode: Optional[str] = None) -> Dict[str, Any]:
         """Run the task with the given parameters."""
-        # Create and run the event loop to execute the async function
-        loop = asyncio.get_event_loop()
-        result = loop.run_until_complete(
+        # Run on the worker's event loop so pooled connections are reused
+        result = run_in_worker_loop(
             self._run_async(
                 task_id=task_id,
                 threejs_code=threejs_code,
@@ -361,7 +807,10 @@ Return the COMPLETE JavaScript code for the modified Three.js scene."""
                 system_prompt=system_prompt,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                additional_params=additional_params
+                additional_params=additional_params,
+                base_version_id=base_version_id,
+                session_id=session_id,
+                edit_mode=edit_mode
             )
         )
         return result
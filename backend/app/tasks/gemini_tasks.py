@@ -5,8 +5,12 @@ from io import BytesIO
 from google import genai
 from app.core.celery_app import celery_app
 from app.core.config import settings
-from app.tasks.tasks import AsyncAITask, GenericPromptTask, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
+from app.tasks.tasks import AsyncAITask, GenericPromptTask, run_in_worker_loop, without_image_data, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
 from app.core.redis import redis_service
+from app.core.http_clients import client_registry
+from app.core.metrics import time_provider
+from app.core.timeline import mark_stage
+from app.core.images import decode_base64_image, get_image_mime_type, get_image_size, make_thumbnail
 from typing import Dict, Any, Optional, List, Union
 from google.genai import types
 from PIL import Image
@@ -15,24 +19,44 @@ from PIL import Image
 DEFAULT_MODEL = "gemini-2.0-flash-exp"
 DEFAULT_IMAGE_GEN_MODEL = "gemini-2.0-flash-exp-image-generation"
 
-# Create output directory for debug images
-DEBUG_IMAGE_DIR = "debug_images"
-os.makedirs(DEBUG_IMAGE_DIR, exist_ok=True)
+# File extensions for debug images by MIME type
+DEBUG_IMAGE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
 
-# Create Gemini client
-async def get_gemini_client():
-    client = genai.Client(api_key=settings.GOOGLE_API_KEY)
-    return client
+def save_debug_image(image_id: str, image_bytes: bytes, mime_type: str) -> str:
+    """Write a generated image to the debug directory, keeping only the newest files."""
+    os.makedirs(settings.DEBUG_IMAGE_DIR, exist_ok=True)
+    extension = DEBUG_IMAGE_EXTENSIONS.get(mime_type, ".bin")
+    image_path = os.path.join(settings.DEBUG_IMAGE_DIR, f"{image_id}{extension}")
+    
+    with open(image_path, "wb") as f:
+        f.write(image_bytes)
+    
+    # Remove the oldest files beyond the retention limit
+    paths = [os.path.join(settings.DEBUG_IMAGE_DIR, name) for name in os.listdir(settings.DEBUG_IMAGE_DIR)]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for old_path in paths[settings.DEBUG_IMAGE_MAX_FILES:]:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+    
+    return image_path
+
+def build_gemini_client(http_client) -> genai.Client:
+    """Create a Gemini client whose async calls go through the given pooled HTTP client."""
+    http_options = types.HttpOptions(base_url=settings.GOOGLE_BASE_URL, httpx_async_client=http_client)
+    return genai.Client(api_key=settings.GOOGLE_API_KEY, http_options=http_options)
+
+# Get the Gemini client, shared by every task on this event loop
+async def get_gemini_client() -> genai.Client:
+    return client_registry.sdk_client("gemini", build_gemini_client)
 
 class AsyncGeminiTask(AsyncAITask):
     """Base class for Gemini Celery tasks that use async functions."""
-    _client = None
     
     @property
     async def client(self):
-        if self._client is None:
-            self._client = await get_gemini_client()
-        return self._client
+        return await get_gemini_client()
 
 class GeminiPromptTask(GenericPromptTask, AsyncGeminiTask):
     """Task to stream a prompt with Gemini 2.0 Flash."""
@@ -82,7 +106,8 @@ class GeminiPromptTask(GenericPromptTask, AsyncGeminiTask):
     async def send_message(self, client, message_params: Dict[str, Any]) -> Any:
         """Send the message to Gemini."""
         model_name = message_params.pop("model")
-        return await client.aio.models.generate_content(model=model_name, **message_params)
+        with time_provider("gemini", model_name, "prompt"):
+            return await client.aio.models.generate_content(model=model_name, **message_params)
     
     def extract_content(self, response: Any) -> str:
         """Extract the content from Gemini's response."""
@@ -103,14 +128,26 @@ class GeminiPromptTask(GenericPromptTask, AsyncGeminiTask):
         }
 
 class GeminiImageGenerationTask(GenericPromptTask, AsyncGeminiTask):
-    """Task to generate images with Gemini 2.0 Flash with SSE streaming support."""
+    """Task to generate images with Gemini 2.0 Flash with SSE streaming support.
+    
+    The response is streamed, and every image part is published as soon as it
+    arrives: first a small WebP "thumbnail" event, then the full "image" event.
+    The final "complete" event references the images by image_id; the stored
+    response keeps their data for clients that fetch the result.
+    """
     
     async def _run_async(self, task_id: str, image_base64: str, prompt: str = "", 
                         system_prompt: Optional[str] = None,
                         max_tokens: int = DEFAULT_MAX_TOKENS, 
                         temperature: float = DEFAULT_TEMPERATURE,
-                        additional_params: Optional[Dict[str, Any]] = None):
-        """Process a prompt with an image for Gemini image generation."""
+                        additional_params: Optional[Dict[str, Any]] = None,
+                        number_of_images: int = 1,
+                        aspect_ratio: Optional[str] = None,
+                        negative_prompt: Optional[str] = None):
+        """Process a prompt with an image for Gemini image generation.
+        
+        number_of_images variants are generated concurrently from the same prompt.
+        """
         try:
             # Publish start event
             redis_service.publish_start_event(task_id)
@@ -122,20 +159,30 @@ class GeminiImageGenerationTask(GenericPromptTask, AsyncGeminiTask):
                 max_tokens=max_tokens,
                 temperature=temperature,
                 additional_params=additional_params,
-                image_base64=image_base64
+                image_base64=image_base64,
+                aspect_ratio=aspect_ratio,
+                negative_prompt=negative_prompt
             )
+            mark_stage("preprocessing_done")
             
             # Get client
             client = await self.client
             
-            # Send the message to the AI service
-            response = await self.send_message(client, message_params)
+            # Generate the variants concurrently
+            number_of_variants = number_of_images or 1
+            variants = await self.gather_variants(
+                task_id,
+                number_of_variants,
+                lambda index: self.generate_variant(
+                    client, message_params, task_id, index if number_of_variants > 1 else None
+                )
+            )
             
             # Prepare final response with metadata
-            final_response = self.prepare_final_response(task_id, response, '')
+            final_response = self.merge_variants(task_id, variants)
             
-            # Publish completion event
-            redis_service.publish_complete_event(task_id, final_response)
+            # Publish completion event without the images already streamed
+            redis_service.publish_complete_event(task_id, without_image_data(final_response))
             
             # Store the final response in Redis for retrieval
             redis_service.store_response(task_id, final_response)
@@ -160,11 +207,81 @@ class GeminiImageGenerationTask(GenericPromptTask, AsyncGeminiTask):
             
             return error_response
     
+    async def generate_variant(self, client, message_params: Dict[str, Any], task_id: str,
+                               variant: Optional[int] = None) -> Dict[str, Any]:
+        """Stream one variant and publish each image part as it arrives."""
+        image_results = []
+        text_parts = []
+        last_chunk = None
+        
+        # send_message pops the model, so give each variant its own copy
+        with time_provider("gemini", message_params.get("model"), "image") as timer:
+            async for chunk in await self.send_message(client, dict(message_params)):
+                timer.first_output()
+                last_chunk = chunk
+                if not chunk.candidates or not chunk.candidates[0].content:
+                    continue
+                
+                for part in chunk.candidates[0].content.parts or []:
+                    if part.text:
+                        text_parts.append(part.text)
+                    elif part.inline_data is not None:
+                        image_result = await self.publish_image(task_id, len(image_results), part.inline_data, variant)
+                        image_results.append(image_result)
+        
+        return self.prepare_final_response(task_id, last_chunk, "".join(text_parts), image_results)
+    
+    async def publish_image(self, task_id: str, idx: int, inline_data: Any,
+                            variant: Optional[int] = None) -> Dict[str, Any]:
+        """Publish a thumbnail and then the full image for one generated image part."""
+        image_bytes = inline_data.data
+        mime_type = inline_data.mime_type or get_image_mime_type(image_bytes)
+        image_id = f"{task_id}_{idx}" if variant is None else f"{task_id}_{variant}_{idx}"
+        variant_fields = {} if variant is None else {"variant": variant}
+        
+        # Read the dimensions from the header instead of decoding the image
+        width, height = get_image_size(image_bytes) or (500, 500)  # Default dimensions if unknown
+        
+        # Publish a small thumbnail first so clients can show a preview immediately
+        try:
+            thumbnail = await asyncio.to_thread(make_thumbnail, image_bytes, settings.GEMINI_THUMBNAIL_SIZE)
+            redis_service.publish_event(task_id, "thumbnail", {
+                "image_id": image_id,
+                "index": idx,
+                **variant_fields,
+                "image_base64": base64.b64encode(thumbnail).decode('utf-8'),
+                "mime_type": "image/webp",
+                "width": width,
+                "height": height
+            })
+        except Exception as e:
+            print(f"[ERROR] Failed to create thumbnail: {str(e)}")
+        
+        image_result = {
+            "image_id": image_id,
+            "image_base64": base64.b64encode(image_bytes).decode('utf-8'),
+            "mime_type": mime_type,
+            "width": width,
+            "height": height
+        }
+        redis_service.publish_event(task_id, "image", {**image_result, "index": idx, **variant_fields})
+        
+        # Save image to disk for debugging, off the event loop
+        if settings.GEMINI_DEBUG_IMAGES:
+            try:
+                image_result["saved_path"] = await asyncio.to_thread(save_debug_image, image_id, image_bytes, mime_type)
+            except Exception as e:
+                print(f"[ERROR] Failed to save image: {str(e)}")
+        
+        return image_result
+    
     def prepare_message_params(self, prompt: str, system_prompt: Optional[str] = None,
                               max_tokens: int = DEFAULT_MAX_TOKENS, 
                               temperature: float = DEFAULT_TEMPERATURE,
                               additional_params: Optional[Dict[str, Any]] = None,
-                              image_base64: Optional[str] = None) -> Dict[str, Any]:
+                              image_base64: Optional[str] = None,
+                              aspect_ratio: Optional[str] = None,
+                              negative_prompt: Optional[str] = None) -> Dict[str, Any]:
         """Prepare the message parameters for Gemini image generation."""
         if not image_base64:
             raise ValueError("Image base64 is required for image generation")
@@ -179,12 +296,19 @@ class GeminiImageGenerationTask(GenericPromptTask, AsyncGeminiTask):
             system_prompt = "Convert this rough sketch into an image of a low-poly 3D model. Include only the object in the image, with nothing else."
         
         try:
-            # Convert the image base64 to PIL Image
-            image = Image.open(BytesIO(base64.b64decode(image_base64)))
+            # Pass the encoded image straight through instead of decoding it with PIL
+            image_bytes = decode_base64_image(image_base64)
+            image = types.Part.from_bytes(data=image_bytes, mime_type=get_image_mime_type(image_bytes))
             
             # Create contents with system prompt, optional user prompt, and image
             contents = [system_prompt, image] if not prompt else [system_prompt, prompt, image]
             
+            # The model has no dedicated parameters for these, so they go in as instructions
+            if aspect_ratio and aspect_ratio != "1:1":
+                contents.insert(-1, f"Generate the image with a {aspect_ratio} aspect ratio.")
+            if negative_prompt:
+                contents.insert(-1, f"Do not include the following in the image: {negative_prompt}")
+            
         except Exception as e:
             # Log the error and raise
             print(f"[ERROR] Error processing input image: {str(e)}")
@@ -206,11 +330,13 @@ class GeminiImageGenerationTask(GenericPromptTask, AsyncGeminiTask):
             system_prompt: Optional[str] = None,
             max_tokens: int = DEFAULT_MAX_TOKENS, 
             temperature: float = DEFAULT_TEMPERATURE,
-            additional_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+            additional_params: Optional[Dict[str, Any]] = None,
+            number_of_images: int = 1,
+            aspect_ratio: Optional[str] = None,
+            negative_prompt: Optional[str] = None) -> Dict[str, Any]:
         """Run the task with the given parameters."""
-        # Create and run the event loop to execute the async function
-        loop = asyncio.get_event_loop()
-        result = loop.run_until_complete(
+        # Run on the worker's event loop so pooled connections are reused
+        result = run_in_worker_loop(
             self._run_async(
                 task_id=task_id,
                 image_base64=image_base64,
@@ -218,61 +344,39 @@ class GeminiImageGenerationTask(GenericPromptTask, AsyncGeminiTask):
                 system_prompt=system_prompt,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                additional_params=additional_params
+                additional_params=additional_params,
+                number_of_images=number_of_images,
+                aspect_ratio=aspect_ratio,
+                negative_prompt=negative_prompt
             )
         )
         return result
         
     async def send_message(self, client, message_params: Dict[str, Any]) -> Any:
-        """Send the message to Gemini for image generation."""
+        """Start a streaming image generation request to Gemini."""
         model_name = message_params.pop("model")
-        return await client.aio.models.generate_content(model=model_name, **message_params)
+        return await client.aio.models.generate_content_stream(model=model_name, **message_params)
     
-    def prepare_final_response(self, task_id: str, response: Any, content: str) -> Dict[str, Any]:
+    def prepare_final_response(self, task_id: str, response: Any, content: str,
+                               image_results: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         """Prepare the final response with Gemini-specific metadata and generated images."""
-        image_results = []
-        
-        # Process each part of the response to extract images
-        for idx, part in enumerate(response.candidates[0].content.parts):
-            if part.inline_data is not None:
-                # Save image to disk for debugging
-                image_bytes = part.inline_data.data
-                image_path = os.path.join(DEBUG_IMAGE_DIR, f"{task_id}_{idx}.jpg")
-                
-                # Save the image using PIL
-                try:
-                    img = Image.open(BytesIO(image_bytes))
-                    img.save(image_path)
-                    print(f"[DEBUG] Saved image to {image_path}")
-                    
-                    # Get image dimensions
-                    width, height = img.size
-                except Exception as e:
-                    print(f"[ERROR] Failed to save image: {str(e)}")
-                    width, height = 500, 500  # Default dimensions on error
-                
-                # Convert image to base64 for return
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                image_results.append({
-                    "image_id": f"{task_id}_{idx}",
-                    "image_base64": image_base64,
-                    "saved_path": image_path,
-                    "width": width,
-                    "height": height
-                })
+        image_results = image_results or []
         
         # Log result summary
         print(f"[DEBUG] Generated {len(image_results)} images and content length {len(content)}")
         
+        # Usage metadata is reported on the last streamed chunk
+        usage_metadata = getattr(response, "usage_metadata", None)
+        
         return {
             "status": "success",
             "content": content,
             "model": DEFAULT_IMAGE_GEN_MODEL,
             "images": image_results,
             "usage": {
-                "input_tokens": getattr(response.usage_metadata, "prompt_token_count", 0),
-                "output_tokens": getattr(response.usage_metadata, "candidates_token_count", 0),
-                "total_tokens": getattr(response.usage_metadata, "total_token_count", 0)
+                "input_tokens": getattr(usage_metadata, "prompt_token_count", 0) or 0,
+                "output_tokens": getattr(usage_metadata, "candidates_token_count", 0) or 0,
+                "total_tokens": getattr(usage_metadata, "total_token_count", 0) or 0
             },
             "task_id": task_id
         }
@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import json
+from celery import Task
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.redis import redis_service
+from app.core.artifacts import artifact_store
+from app.core.metrics import record_cache
+from app.core.timeline import mark_stage
+from app.core.pipelines import validate_pipeline, DEFAULT_PIPELINE
+from app.core.images import strip_data_url, get_base64_image_mime_type
+from app.core.trellis import trellis_poller, submit_trellis_job, is_final_status
+from app.api.models import TrellisRequest, TrellisInput
+from app.tasks.tasks import run_in_worker_loop, DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE
+from app.tasks.claude_tasks import ClaudePromptTask
+from app.tasks.gemini_tasks import GeminiImageGenerationTask
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+
+async def run_image_stage(task_id: str, input_ref: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Clean up the sketch with Gemini and store the result as an image artifact."""
+    client = await GeminiImageGenerationTask.client
+    message_params = GeminiImageGenerationTask.prepare_message_params(
+        prompt=prompt,
+        image_base64=artifact_store.get_data(input_ref)
+    )
+
+    # Thumbnail and image events are published on the pipeline's own channel
+    result = await GeminiImageGenerationTask.generate_variant(client, message_params, task_id)
+    if not result["images"]:
+        raise ValueError("Gemini did not return an image")
+
+    image = result["images"][0]
+    return {
+        "kind": "image",
+        "artifact": artifact_store.put(image["image_base64"], "image", image["mime_type"]),
+        "mime_type": image["mime_type"],
+        "width": image["width"],
+        "height": image["height"],
+        "model": result["model"],
+        "usage": result["usage"]
+    }
+
+async def run_3d_stage(task_id: str, input_ref: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate a Three.js scene from the image with Claude."""
+    client = await ClaudePromptTask.client
+    message_params = ClaudePromptTask.prepare_message_params(
+        prompt=prompt,
+        max_tokens=params["max_tokens"],
+        temperature=params["temperature"],
+        image_base64=artifact_store.get_data(input_ref)
+    )
+
+    result = await ClaudePromptTask.generate_variant(client, message_params)
+    return {
+        "kind": "code",
+        "artifact": artifact_store.put(result["content"], "code", "text/javascript"),
+        "content": result["content"],
+        "model": result["model"],
+        "usage": result["usage"]
+    }
+
+async def run_trellis_stage(task_id: str, input_ref: str, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn the image into a GLB with Trellis and wait for the job to finish."""
+    if not settings.TRELLIS_API_KEY:
+        raise ValueError("Trellis API key not configured")
+
+    request_dict = TrellisRequest(input=TrellisInput(image=artifact_store.get_data(input_ref))).dict(exclude_none=True)
+    response_data = await submit_trellis_job(trellis_poller.client, request_dict)
+    trellis_task_id = response_data["data"]["task_id"]
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.PIPELINE_TRELLIS_TIMEOUT
+    interval = settings.TRELLIS_POLL_INTERVAL
+    last_message = None
+
+    try:
+        while True:
+            message = await trellis_poller.poll_once(trellis_task_id)
+
+            # Forward Trellis progress to the pipeline subscription
+            if message is not None and message.get("message") != (last_message or {}).get("message"):
+                redis_service.publish_event(task_id, "stage", {
+                    "stage": "trellis",
+                    "status": "running",
+                    "trellis_task_id": trellis_task_id,
+                    "message": message["message"]
+                })
+            last_message = message
+
+            if message is not None and is_final_status(message):
+                break
+            if loop.time() > deadline:
+                raise TimeoutError(f"Trellis task {trellis_task_id} did not finish in time")
+
+            await asyncio.sleep(interval)
+            interval = min(interval * settings.TRELLIS_POLL_BACKOFF, settings.TRELLIS_POLL_MAX_INTERVAL)
+    finally:
+        trellis_poller.release(trellis_task_id)
+
+    if message["status"] == "failed":
+        raise RuntimeError(message["message"])
+
+    return {
+        "kind": "model",
+        "trellis_task_id": trellis_task_id,
+        "model_url": message["data"],
+        "model_digest": message.get("model_digest"),
+        "lods_url": message.get("lods_url")
+    }
+
+# Runners of the stages in PIPELINE_STAGE_NAMES
+PIPELINE_STAGES: Dict[str, Callable[[str, str, str, Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {
+    "image": run_image_stage,
+    "3d": run_3d_stage,
+    "trellis": run_trellis_stage
+}
+
+def get_stage_cache_key(stage: str, input_ref: str, prompt: str, params: Dict[str, Any]) -> str:
+    """Get the cache key of a stage run from its name, input and parameters."""
+    key_data = json.dumps({"stage": stage, "input": input_ref, "prompt": prompt, "params": params}, sort_keys=True)
+    return f"pipeline_stage:{hashlib.sha256(key_data.encode('utf-8')).hexdigest()}"
+
+def get_cached_stage(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Get the output of a completed stage, if its artifact still exists."""
+    output = redis_service.get_object(cache_key)
+    if not output:
+        return None
+
+    if "artifact" in output and artifact_store.get(output["artifact"]) is None:
+        return None
+    return output
+
+class PipelineTask(Task):
+    """Task to run a multi-stage pipeline (e.g. sketch → Gemini cleanup → Claude) in one go.
+
+    Every stage streams to the pipeline's task ID, so one subscription follows
+    the whole run. Stages pass artifacts by reference and completed stages are
+    cached, so re-running the same input skips them.
+    """
+
+    async def _run_async(self, task_id: str, image_base64: str, prompt: str = "",
+                         stages: Optional[List[str]] = None,
+                         max_tokens: int = DEFAULT_MAX_TOKENS,
+                         temperature: float = DEFAULT_TEMPERATURE) -> Dict[str, Any]:
+        """Run each stage of the pipeline in order."""
+        try:
+            # Publish start event
+            redis_service.publish_start_event(task_id)
+
+            stages = stages or DEFAULT_PIPELINE
+            validate_pipeline(stages)
+
+            # Store the input sketch once; stages only exchange references
+            image_data = strip_data_url(image_base64)
+            current_ref = artifact_store.put(image_data, "image", get_base64_image_mime_type(image_data))
+            mark_stage("preprocessing_done")
+            params = {"max_tokens": max_tokens, "temperature": temperature}
+            stage_results = []
+
+            for index, stage in enumerate(stages):
+                cache_key = get_stage_cache_key(stage, current_ref, prompt, params)
+                output = get_cached_stage(cache_key)
+                record_cache("pipeline_stage", output is not None)
+
+                if output is not None:
+                    status = "cached"
+                else:
+                    redis_service.publish_event(task_id, "stage", {"stage": stage, "index": index, "status": "started"})
+                    output = await PIPELINE_STAGES[stage](task_id, current_ref, prompt, params)
+                    redis_service.store_object(cache_key, output, settings.PIPELINE_STAGE_CACHE_TTL)
+                    status = "completed"
+
+                stage_result = {"stage": stage, "index": index, "status": status, **output}
+                if "artifact" in output:
+                    stage_result["artifact_url"] = f"{settings.PUBLIC_API_URL}/api/artifact/{output['artifact']}"
+                redis_service.publish_event(task_id, "stage", stage_result)
+                stage_results.append(stage_result)
+
+                # The next stage works on the image this stage produced
+                if output["kind"] == "image":
+                    current_ref = output["artifact"]
+
+            # Surface the last stage's result where single-task clients expect it
+            final_stage = stage_results[-1]
+            final_response = {
+                "status": "success",
+                "content": final_stage.get("content", ""),
+                "model": final_stage.get("model"),
+                "stages": stage_results,
+                "usage": {
+                    key: sum(result.get("usage", {}).get(key, 0) for result in stage_results if result["status"] != "cached")
+                    for key in ["input_tokens", "output_tokens", "total_tokens"]
+                },
+                "task_id": task_id
+            }
+            if final_stage["kind"] == "model":
+                final_response["model_url"] = final_stage["model_url"]
+
+            # Publish completion event
+            redis_service.publish_complete_event(task_id, final_response)
+
+            # Store the final response in Redis for retrieval
+            redis_service.store_response(task_id, final_response)
+
+            return final_response
+
+        except Exception as e:
+            # Prepare error response
+            error_response = {
+                "status": "error",
+                "error": str(e),
+                "error_type": type(e).__name__,
+                "task_id": task_id
+            }
+
+            try:
+                # Publish error event and store the error response
+                redis_service.publish_error_event(task_id, e)
+                redis_service.store_response(task_id, error_response)
+            except Exception:
+                pass  # Ignore Redis errors at this point
+
+            return error_response
+
+    def run(self, task_id: str, image_base64: str, prompt: str = "",
+            stages: Optional[List[str]] = None,
+            max_tokens: int = DEFAULT_MAX_TOKENS,
+            temperature: float = DEFAULT_TEMPERATURE) -> Dict[str, Any]:
+        """Run the task with the given parameters."""
+        # Run on the worker's event loop so pooled connections are reused
+        result = run_in_worker_loop(
+            self._run_async(
+                task_id=task_id,
+                image_base64=image_base64,
+                prompt=prompt,
+                stages=stages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+        )
+        return result
+
+# Register the task properly with Celery
+PipelineTask = celery_app.register_task(PipelineTask())
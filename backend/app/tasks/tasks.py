@@ -1,13 +1,86 @@
 import asyncio
+import threading
 from celery import Task
+from celery.signals import task_prerun, task_postrun, worker_process_init, worker_process_shutdown
 from app.core.celery_app import celery_app
+from app.core.config import settings
 from app.core.redis import redis_service
-from typing import Dict, Any, Optional, Protocol
+from app.core.http_clients import client_registry
+from app.core.timeline import start_timeline, finish_timeline, mark_stage
+from typing import Dict, Any, Optional, Protocol, List, Callable, Awaitable, Union
 
 # Default model configuration - can be overridden by specific implementations
 DEFAULT_MAX_TOKENS = 4096
 DEFAULT_TEMPERATURE = 0.7
 
+# Event loop of each worker thread. It is kept between tasks so pooled provider
+# connections stay open; asyncio.run would close them after every task.
+_worker_loops = threading.local()
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    """Get the event loop tasks run on in this thread, creating it on first use."""
+    loop = getattr(_worker_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _worker_loops.loop = asyncio.new_event_loop()
+    return loop
+
+def run_in_worker_loop(coro: Awaitable[Any]) -> Any:
+    """Run a task's coroutine to completion on this thread's worker loop."""
+    return get_worker_loop().run_until_complete(coro)
+
+@worker_process_init.connect
+def reset_worker_clients(**kwargs):
+    """Drop the event loop and clients a prefork child inherited from its parent."""
+    _worker_loops.loop = None
+    client_registry.reset()
+
+@worker_process_shutdown.connect
+def close_worker_clients(**kwargs):
+    """Close this process's pooled provider clients and its event loop."""
+    loop = getattr(_worker_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        return
+    try:
+        loop.run_until_complete(client_registry.close())
+    finally:
+        loop.close()
+
+@task_prerun.connect
+def start_task_timeline(task_id: str = None, **kwargs):
+    """Start recording a task's timeline as the worker picks it up."""
+    start_timeline(task_id).mark("dequeued")
+
+@task_postrun.connect
+def store_task_timeline(task_id: str = None, **kwargs):
+    """Save the stages the worker recorded for a task in one write."""
+    recorder = finish_timeline()
+    if recorder is None:
+        return
+    try:
+        redis_service.store_timeline(recorder.task_id, recorder.stages)
+    except Exception as e:
+        print(f"[ERROR] Failed to store timeline for task {task_id}: {str(e)}")
+
+def without_image_data(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a result with its images reduced to their image_id and metadata.
+    
+    Every image is published in its own "image" event as soon as it is
+    generated, so later events only reference it; the full data is kept in the
+    stored response.
+    """
+    if "images" not in result and "variants" not in result:
+        return result
+    
+    stripped = dict(result)
+    if "images" in result:
+        stripped["images"] = [
+            {key: value for key, value in image.items() if key != "image_base64"}
+            for image in result["images"]
+        ]
+    if "variants" in result:
+        stripped["variants"] = [without_image_data(variant) for variant in result["variants"]]
+    return stripped
+
 class AsyncClient(Protocol):
     """Protocol defining the interface that AI client implementations must satisfy."""
     async def send_message(self, message_params: Dict[str, Any]) -> Any:
@@ -16,7 +89,6 @@ class AsyncClient(Protocol):
 
 class AsyncAITask(Task):
     """Base class for AI Celery tasks that use async functions."""
-    _client = None
     
     @property
     async def client(self) -> AsyncClient:
@@ -24,8 +96,8 @@ class AsyncAITask(Task):
         raise NotImplementedError
     
     def run(self, *args, **kwargs):
-        """Run the coroutine in an event loop."""
-        return asyncio.run(self._run_async(*args, **kwargs))
+        """Run the coroutine on the worker's event loop."""
+        return run_in_worker_loop(self._run_async(*args, **kwargs))
     
     async def _run_async(self, *args, **kwargs):
         """This should be implemented by subclasses."""
@@ -50,6 +122,7 @@ class GenericPromptTask(AsyncAITask):
                 temperature=temperature,
                 additional_params=additional_params
             )
+            mark_stage("preprocessing_done")
             
             # Get client
             client = await self.client
@@ -89,6 +162,69 @@ class GenericPromptTask(AsyncAITask):
             
             return error_response
     
+    async def gather_variants(self, task_id: str, number_of_variants: int,
+                              generate: Callable[[int], Awaitable[Dict[str, Any]]]) -> List[Union[Dict[str, Any], Exception]]:
+        """Generate several variants concurrently with bounded concurrency.
+        
+        When more than one variant is requested, each one is published as a
+        "variant" event the moment it finishes, so the first usable result
+        arrives at single-call latency. Failed variants are returned as the
+        exception that caused them.
+        """
+        semaphore = asyncio.Semaphore(settings.MAX_VARIANT_CONCURRENCY)
+        
+        async def run_variant(index: int) -> Union[Dict[str, Any], Exception]:
+            async with semaphore:
+                try:
+                    result = await generate(index)
+                    payload = result
+                except Exception as e:
+                    result = e
+                    payload = {
+                        "status": "error",
+                        "error": str(e),
+                        "error_type": type(e).__name__
+                    }
+            
+            if number_of_variants > 1:
+                # Images were already streamed while the variant was generated
+                redis_service.publish_event(task_id, "variant", {**without_image_data(payload), "variant": index, "task_id": task_id})
+            return result
+        
+        return await asyncio.gather(*(run_variant(index) for index in range(number_of_variants)))
+    
+    def merge_variants(self, task_id: str, variants: List[Union[Dict[str, Any], Exception]]) -> Dict[str, Any]:
+        """Combine variant results into the final response.
+        
+        The first successful variant fills the top-level fields so single-result
+        clients keep working; all variants are listed under "variants" and
+        usage is summed across them. The first variant's images are only kept
+        at the top level, so its entry under "variants" references them.
+        """
+        successful = [variant for variant in variants if not isinstance(variant, Exception)]
+        if not successful:
+            raise variants[0]
+        
+        final_response = {**successful[0], "task_id": task_id}
+        
+        if len(variants) > 1:
+            final_response["variants"] = [
+                {**(without_image_data(variant) if variant is successful[0] else variant), "variant": index}
+                if not isinstance(variant, Exception) else {
+                    "status": "error",
+                    "error": str(variant),
+                    "error_type": type(variant).__name__,
+                    "variant": index
+                }
+                for index, variant in enumerate(variants)
+            ]
+            final_response["usage"] = {
+                key: sum(variant.get("usage", {}).get(key, 0) for variant in successful)
+                for key in ["input_tokens", "output_tokens", "total_tokens"]
+            }
+        
+        return final_response
+    
     def prepare_message_params(self, prompt: str, system_prompt: Optional[str] = None,
                              max_tokens: int = DEFAULT_MAX_TOKENS, temperature: float = DEFAULT_TEMPERATURE,
                              additional_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
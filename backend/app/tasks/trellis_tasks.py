@@ -0,0 +1,254 @@
+import copy
+import gzip
+import io
+import json
+import time
+import numpy as np
+import trimesh
+import fast_simplification
+from celery import Task
+from PIL import Image
+from app.core.celery_app import celery_app
+from app.core.config import settings
+from app.core.redis import redis_service
+from app.core.glb_cache import glb_cache, get_lod_ratios, get_lod_texture_sizes
+from typing import Dict, Any, Optional, List, Tuple
+
+# Texture attributes on trimesh PBR and simple materials
+TEXTURE_ATTRIBUTES = [
+    "baseColorTexture", "metallicRoughnessTexture", "normalTexture",
+    "emissiveTexture", "occlusionTexture", "image"
+]
+
+def quantize(values: np.ndarray, bits: int, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Snap values to a grid of 2**bits steps between low and high.
+
+    trimesh always exports float32 attributes, so quantization shows up as
+    smaller compressed files and more vertices merged by welding rather than
+    as a smaller raw GLB.
+    """
+    scale = np.where(high - low > 0, high - low, 1.0)
+    steps = (1 << bits) - 1
+    return np.round((values - low) / scale * steps) / steps * scale + low
+
+def quantize_mesh(mesh: trimesh.Trimesh):
+    """Quantize positions, normals and UVs of a mesh in place."""
+    normals = mesh.vertex_normals.copy()
+
+    # Use the mesh's own bounds since scene bounds include node transforms
+    bounds = mesh.bounds
+    mesh.vertices = quantize(mesh.vertices, settings.GLB_POSITION_BITS, bounds[0], bounds[1])
+
+    normals = quantize(normals, settings.GLB_NORMAL_BITS, -1.0, 1.0)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    mesh.vertex_normals = normals / np.where(lengths > 0, lengths, 1.0)
+
+    if mesh.visual.kind == "texture" and mesh.visual.uv is not None:
+        uv = mesh.visual.uv
+        mesh.visual.uv = quantize(uv, settings.GLB_UV_BITS, uv.min(axis=0), uv.max(axis=0))
+
+def decimate_mesh(mesh: trimesh.Trimesh, ratio: float) -> trimesh.Trimesh:
+    """Run quadric decimation down to ratio of the original faces.
+
+    Per-vertex UVs and colors are carried over by averaging the attributes of
+    the original vertices collapsed into each new vertex.
+    """
+    if ratio >= 1.0 or len(mesh.faces) < 64:
+        return mesh.copy()
+
+    _, _, collapses = fast_simplification.simplify(
+        mesh.vertices, mesh.faces, target_reduction=1.0 - ratio, return_collapses=True
+    )
+    points, faces, mapping = fast_simplification.replay_simplification(
+        mesh.vertices, mesh.faces, collapses
+    )
+
+    # Average the attributes of every original vertex that maps to a new one
+    counts = np.bincount(mapping, minlength=len(points)).astype(np.float64)
+    counts = np.where(counts > 0, counts, 1.0)[:, None]
+
+    def average(attribute: np.ndarray) -> np.ndarray:
+        merged = np.zeros((len(points), attribute.shape[1]), dtype=np.float64)
+        np.add.at(merged, mapping, attribute)
+        return merged / counts
+
+    visual = None
+    if mesh.visual.kind == "texture" and mesh.visual.uv is not None:
+        visual = trimesh.visual.TextureVisuals(uv=average(mesh.visual.uv), material=mesh.visual.material)
+    elif mesh.visual.kind == "vertex":
+        colors = average(mesh.visual.vertex_colors.astype(np.float64))
+        visual = trimesh.visual.ColorVisuals(vertex_colors=np.round(colors).astype(np.uint8))
+
+    return trimesh.Trimesh(vertices=points, faces=faces, visual=visual, process=False)
+
+def downscale_textures(mesh: trimesh.Trimesh, max_size: int):
+    """Downscale every texture of a mesh's material to at most max_size pixels."""
+    if mesh.visual.kind != "texture" or mesh.visual.material is None:
+        return
+
+    material = copy.copy(mesh.visual.material)
+    for attribute in TEXTURE_ATTRIBUTES:
+        image = getattr(material, attribute, None)
+        if isinstance(image, Image.Image) and max(image.size) > max_size:
+            image = image.copy()
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+            setattr(material, attribute, image)
+    mesh.visual.material = material
+
+def get_normalization(bounds: np.ndarray) -> Tuple[List[float], List[List[float]]]:
+    """Get the center and a transform that fits the model in a unit cube at the origin."""
+    center = (bounds[0] + bounds[1]) / 2.0
+    extent = float(np.max(bounds[1] - bounds[0]))
+    scale = 1.0 / extent if extent > 0 else 1.0
+
+    transform = np.eye(4)
+    transform[:3, :3] *= scale
+    transform[:3, 3] = -center * scale
+    return center.tolist(), transform.tolist()
+
+def count_scene(scene: trimesh.Scene) -> Tuple[int, int]:
+    """Count the vertices and faces of all meshes in a scene."""
+    meshes = [g for g in scene.geometry.values() if isinstance(g, trimesh.Trimesh)]
+    return sum(len(m.vertices) for m in meshes), sum(len(m.faces) for m in meshes)
+
+def optimize_glb(digest: str) -> Dict[str, Any]:
+    """Build LOD levels for a cached GLB and write its manifest.
+
+    Stages: load, weld, bounds, then per LOD decimate, quantize, downscale
+    textures and export. Each stage is timed and each LOD reports its size
+    reduction against the original.
+    """
+    timings: Dict[str, float] = {}
+
+    def timed(stage: str, start: float):
+        timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+    path = glb_cache.path_for(digest)
+    with open(path, "rb") as f:
+        original_bytes = f.read()
+    original_size = len(original_bytes)
+    original_gzip_size = len(gzip.compress(original_bytes, compresslevel=6))
+
+    start = time.perf_counter()
+    scene = trimesh.load(io.BytesIO(original_bytes), file_type="glb", force="scene")
+    timed("load", start)
+
+    start = time.perf_counter()
+    for mesh in scene.geometry.values():
+        if isinstance(mesh, trimesh.Trimesh):
+            # Keep UV and normal seams so textures stay intact
+            mesh.merge_vertices(merge_tex=False, merge_norm=False)
+    timed("weld", start)
+
+    start = time.perf_counter()
+    bounds = np.array(scene.bounds)
+    center, normalization = get_normalization(bounds)
+    timed("bounds", start)
+
+    vertices, faces = count_scene(scene)
+    texture_sizes = get_lod_texture_sizes()
+    lods = []
+
+    for index, ratio in enumerate(get_lod_ratios()):
+        lod = index + 1
+        lod_scene = scene.copy()
+        max_texture_size = texture_sizes[min(index, len(texture_sizes) - 1)] if texture_sizes else None
+
+        start = time.perf_counter()
+        for name, mesh in list(lod_scene.geometry.items()):
+            if isinstance(mesh, trimesh.Trimesh):
+                lod_scene.geometry[name] = decimate_mesh(mesh, ratio)
+        timed(f"lod{lod}_decimate", start)
+
+        start = time.perf_counter()
+        for mesh in lod_scene.geometry.values():
+            if isinstance(mesh, trimesh.Trimesh):
+                quantize_mesh(mesh)
+                mesh.merge_vertices(merge_tex=False, merge_norm=False)
+        timed(f"lod{lod}_quantize", start)
+
+        if max_texture_size:
+            start = time.perf_counter()
+            for mesh in lod_scene.geometry.values():
+                if isinstance(mesh, trimesh.Trimesh):
+                    downscale_textures(mesh, max_texture_size)
+            timed(f"lod{lod}_textures", start)
+
+        start = time.perf_counter()
+        lod_bytes = lod_scene.export(file_type="glb", include_normals=True)
+        with open(glb_cache.path_for(digest, lod=lod), "wb") as f:
+            f.write(lod_bytes)
+        compressed_sizes = glb_cache.compress(digest, lod)
+        timed(f"lod{lod}_export", start)
+
+        lod_vertices, lod_faces = count_scene(lod_scene)
+        lods.append({
+            "level": lod,
+            "ratio": ratio,
+            "url": glb_cache.url_for(digest, lod),
+            "vertices": lod_vertices,
+            "faces": lod_faces,
+            "max_texture_size": max_texture_size,
+            "size": len(lod_bytes),
+            "gzip_size": compressed_sizes.get("gzip", len(lod_bytes)),
+            "size_reduction": round(1.0 - len(lod_bytes) / original_size, 4),
+            "gzip_size_reduction": round(1.0 - compressed_sizes.get("gzip", len(lod_bytes)) / original_gzip_size, 4)
+        })
+
+    manifest = {
+        "status": "completed",
+        "digest": digest,
+        "original": {
+            "level": 0,
+            "url": glb_cache.url_for(digest),
+            "vertices": vertices,
+            "faces": faces,
+            "size": original_size,
+            "gzip_size": original_gzip_size
+        },
+        "lods": lods,
+        "bounds": bounds.tolist(),
+        "center": center,
+        "normalization": normalization,
+        "timings_ms": timings
+    }
+
+    with open(glb_cache.manifest_path_for(digest), "w") as f:
+        json.dump(manifest, f)
+
+    return manifest
+
+class TrellisOptimizeTask(Task):
+    """Task to build decimated and quantized LOD levels of a Trellis GLB."""
+
+    def run(self, digest: str, trellis_task_id: Optional[str] = None) -> Dict[str, Any]:
+        """Run the optimization pipeline for a cached GLB."""
+        try:
+            manifest = optimize_glb(digest)
+            print(f"[DEBUG] Optimized {digest}.glb: "
+                  + ", ".join(f"LOD{lod['level']} {lod['faces']} faces {lod['size_reduction']:.0%} smaller" for lod in manifest["lods"])
+                  + f" in {sum(manifest['timings_ms'].values()):.0f} ms")
+        except Exception as e:
+            print(f"[ERROR] Failed to optimize {digest}.glb: {str(e)}")
+            manifest = {
+                "status": "error",
+                "digest": digest,
+                "error": str(e),
+                "error_type": type(e).__name__
+            }
+
+            # Record the failure so the manifest endpoint stops reporting it as pending
+            with open(glb_cache.manifest_path_for(digest), "w") as f:
+                json.dump(manifest, f)
+
+        # Let anyone following the Trellis job know the LODs are ready
+        if trellis_task_id:
+            try:
+                redis_service.publish_event(trellis_task_id, "optimized", manifest)
+            except Exception:
+                pass  # Ignore Redis errors at this point
+
+        return manifest
+
+# Register the task properly with Celery
+TrellisOptimizeTask = celery_app.register_task(TrellisOptimizeTask())
@@ -0,0 +1,100 @@
+# Check the API's import time and memory against a budget
+#
+# Imports app.main in fresh interpreters and reports the median import time,
+# the peak RSS after import and any provider SDKs or worker-only libraries that
+# got loaded. The API queues tasks by name, so it also checks that every task
+# name it sends is registered by the workers. Exits with status 1 when a budget
+# is exceeded or a check fails, so it can run in CI.
+#
+#   python -m benchmarks.api_startup [--max-import-ms 2000] [--max-rss-mb 120] [--output startup.json]
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, Any, List
+
+# Modules only the workers need; the API must not load them at import time
+WORKER_ONLY_MODULES = ["anthropic", "google.genai", "cerebras", "PIL", "numpy", "trimesh", "fast_simplification", "esprima"]
+
+# Run in a fresh interpreter so nothing is cached from this process
+MEASURE_IMPORT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "import_ms": round(elapsed * 1000, 1),
+    "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    "modules": len(sys.modules),
+    "loaded": [name for name in %r if name in sys.modules]
+}))
+"""
+
+# Load the task modules like a worker does and look up every name the API sends
+CHECK_TASK_NAMES = """
+import json
+from app.api import routes
+from app.core import trellis
+from app.core.celery_app import celery_app
+celery_app.loader.import_default_modules()
+names = [value for module in (routes, trellis) for key, value in vars(module).items() if key.endswith("TASK_NAME")]
+print(json.dumps({"names": names, "missing": [name for name in names if name not in celery_app.tasks]}))
+"""
+
+def run_python(code: str) -> Dict[str, Any]:
+    """Run code in a new interpreter and parse the JSON it prints last."""
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "interpreter failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def check_startup(repeat: int, max_import_ms: float, max_rss_mb: float) -> Dict[str, Any]:
+    """Measure the API's imports and compare them with the budgets."""
+    runs: List[Dict[str, Any]] = [run_python(MEASURE_IMPORT % WORKER_ONLY_MODULES) for _ in range(repeat)]
+    tasks = run_python(CHECK_TASK_NAMES)
+
+    import_ms = statistics.median(run["import_ms"] for run in runs)
+    rss_mb = max(run["rss_mb"] for run in runs)
+    loaded = sorted({name for run in runs for name in run["loaded"]})
+
+    failures = []
+    if import_ms > max_import_ms:
+        failures.append(f"import took {import_ms} ms (budget {max_import_ms} ms)")
+    if rss_mb > max_rss_mb:
+        failures.append(f"RSS after import is {rss_mb} MB (budget {max_rss_mb} MB)")
+    if loaded:
+        failures.append(f"worker-only modules loaded: {', '.join(loaded)}")
+    if tasks["missing"]:
+        failures.append(f"queued task names not registered: {', '.join(tasks['missing'])}")
+
+    return {
+        "import_ms": import_ms,
+        "import_ms_runs": [run["import_ms"] for run in runs],
+        "rss_mb": rss_mb,
+        "modules": runs[-1]["modules"],
+        "worker_only_loaded": loaded,
+        "task_names": tasks["names"],
+        "budget": {"import_ms": max_import_ms, "rss_mb": max_rss_mb},
+        "failures": failures
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the API's import time and memory against a budget")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to measure")
+    parser.add_argument("--max-import-ms", type=float, default=2000, help="Budget for the median import time of app.main")
+    parser.add_argument("--max-rss-mb", type=float, default=120, help="Budget for the peak RSS after importing app.main")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+    report = check_startup(args.repeat, args.max_import_ms, args.max_rss_mb)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for failure in report["failures"]:
+        print(f"[ERROR] {failure}")
+    if report["failures"]:
+        raise SystemExit(1)
@@ -0,0 +1,323 @@
+# End-to-end load test of the API and workers against the provider stubs
+#
+# Sends /api/queue requests at a target rate, follows each task over SSE (or
+# the Trellis WebSocket), and reports throughput, end-to-end and
+# time-to-first-event percentiles, Redis load and API/worker CPU time as JSON.
+# With --baseline the report is compared against an earlier one.
+#
+#   python -m stubs.providers --port 8200                 # then start the API and a worker
+#   python -m benchmarks.loadtest --rate 2 --duration 60 --mix 3d=3,image=1 \
+#       --output report.json [--baseline baseline.json --fail-on-regression]
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import uuid
+import httpx
+from redis import Redis
+from typing import Dict, Any, List, Optional
+from app.core.config import settings
+from benchmarks.sketch_modes import CORPUS, render_sketch
+
+try:
+    import websockets
+except ImportError:  # Only needed for the trellis request type
+    websockets = None
+
+try:
+    import psutil
+except ImportError:  # CPU usage is reported as null without psutil
+    psutil = None
+
+REQUEST_TYPES = ["3d", "image", "edit", "3d_magic", "trellis"]
+
+# Scene sent with edit requests
+EDIT_CODE = """const scene = new THREE.Scene();
+const cube = new THREE.Mesh(new THREE.BoxGeometry(1, 1, 1), new THREE.MeshStandardMaterial({ color: 0x00ff00 }));
+scene.add(cube);
+"""
+
+# Report keys compared against a baseline, and whether higher values are better
+COMPARED_METRICS = {
+    ("throughput_rps",): True,
+    ("error_rate",): False,
+    ("latency_ms", "p50"): False,
+    ("latency_ms", "p95"): False,
+    ("latency_ms", "p99"): False,
+    ("ttfe_ms", "p50"): False,
+    ("ttfe_ms", "p95"): False
+}
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parse a request mix such as "3d=3,image=1" into weights."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in REQUEST_TYPES:
+            raise ValueError(f"Unknown request type: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    """Summarize values with nearest-rank percentiles."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "p50": round(rank(50), 2),
+        "p95": round(rank(95), 2),
+        "p99": round(rank(99), 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2)
+    }
+
+def build_request(request_type: str, image_base64: str, task_id: str) -> Dict[str, Any]:
+    """Build the queue request body for a request type."""
+    body = {"prompt": "Turn this sketch into a 3D scene", "task_id": task_id, "image_base64": image_base64}
+    if request_type == "edit":
+        body.update(prompt="Make the cube red", threejs_code=EDIT_CODE, image_base64=None)
+    return body
+
+async def run_sse_request(client: httpx.AsyncClient, request_type: str, image_base64: str,
+                          timeout: float, settle: float) -> Dict[str, Any]:
+    """Subscribe to a new task's events, queue it, and time its first and final events."""
+    task_id = str(uuid.uuid4())
+    result = {"type": request_type, "task_id": task_id, "status": "timeout"}
+
+    # Subscribe before queueing so no event is missed; the task ID is chosen here
+    async with client.stream("GET", f"/api/subscribe/{task_id}", timeout=timeout) as stream:
+        await asyncio.sleep(settle)
+
+        start = time.perf_counter()
+        response = await client.post(f"/api/queue/{request_type}", json=build_request(request_type, image_base64, task_id))
+        if response.status_code != 200:
+            return {**result, "status": "rejected", "http_status": response.status_code}
+
+        event_type = None
+        async for line in stream.aiter_lines():
+            if line.startswith("event:"):
+                event_type = line[6:].strip()
+            elif line.startswith("data:") and event_type:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                result.setdefault("ttfe_ms", elapsed_ms)
+                if event_type in ("complete", "error"):
+                    data = json.loads(line[5:].strip())
+                    failed = event_type == "error" or data.get("status") == "error"
+                    result.update(status="error" if failed else "success", latency_ms=elapsed_ms)
+                    if failed:
+                        result["error"] = data.get("error_type") or data.get("error")
+                    break
+            elif not line:
+                event_type = None
+            if time.perf_counter() - start > timeout:
+                break
+
+    return result
+
+async def run_websocket_request(client: httpx.AsyncClient, image_base64: str, timeout: float) -> Dict[str, Any]:
+    """Create a Trellis task and follow it over the WebSocket until it finishes."""
+    result = {"type": "trellis", "status": "timeout"}
+    if websockets is None:
+        return {**result, "status": "error", "error": "websockets is not installed"}
+
+    start = time.perf_counter()
+    # Vary the seed so the API's input cache doesn't answer every request
+    response = await client.post("/api/trellis/task", json={"input": {"image": image_base64, "seed": random.randint(1, 2 ** 31)}})
+    if response.status_code != 200:
+        return {**result, "status": "rejected", "http_status": response.status_code}
+    task_id = response.json()["data"]["task_id"]
+    result["task_id"] = task_id
+
+    ws_url = str(client.base_url).replace("http", "ws", 1).rstrip("/") + f"/api/trellis/task/ws/{task_id}"
+    try:
+        async with websockets.connect(ws_url, max_size=None) as socket:
+            while time.perf_counter() - start < timeout:
+                message = json.loads(await asyncio.wait_for(socket.recv(), timeout))
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                result.setdefault("ttfe_ms", elapsed_ms)
+                if message.get("status") in ("completed", "failed", "error"):
+                    failed = message["status"] != "completed"
+                    result.update(status="error" if failed else "success", latency_ms=elapsed_ms)
+                    if failed:
+                        result["error"] = message.get("message")
+                    break
+    except (asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+        result["error"] = type(e).__name__
+    return result
+
+def read_redis_stats(redis_client: Redis) -> Dict[str, Any]:
+    """Read the Redis counters the report is built from."""
+    info = redis_client.info()
+    return {
+        "total_commands_processed": info.get("total_commands_processed", 0),
+        "used_memory": info.get("used_memory", 0),
+        "used_memory_peak": info.get("used_memory_peak", 0),
+        "connected_clients": info.get("connected_clients", 0),
+        "used_cpu_sys": info.get("used_cpu_sys", 0.0),
+        "used_cpu_user": info.get("used_cpu_user", 0.0)
+    }
+
+def read_cpu_times() -> Optional[Dict[str, float]]:
+    """Sum the CPU seconds of local API (uvicorn) and worker (celery) processes."""
+    if psutil is None:
+        return None
+    totals = {"api": 0.0, "worker": 0.0}
+    for process in psutil.process_iter(["cmdline"]):
+        try:
+            cmdline = " ".join(process.info["cmdline"] or [])
+            role = "worker" if "celery" in cmdline else "api" if ("uvicorn" in cmdline or "run.py" in cmdline) else None
+            if role is not None:
+                cpu = process.cpu_times()
+                totals[role] += cpu.user + cpu.system
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return totals
+
+def summarize(results: List[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    """Aggregate per-request results into throughput and latency figures."""
+    succeeded = [result for result in results if result["status"] == "success"]
+    statuses: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+        if result.get("error"):
+            errors[str(result["error"])] = errors.get(str(result["error"]), 0) + 1
+
+    return {
+        "requests": len(results),
+        "statuses": statuses,
+        "errors": errors,
+        "error_rate": round(1 - len(succeeded) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(succeeded) / duration, 3) if duration else 0.0,
+        "latency_ms": percentiles([result["latency_ms"] for result in succeeded]),
+        "ttfe_ms": percentiles([result["ttfe_ms"] for result in results if "ttfe_ms" in result])
+    }
+
+def compare_reports(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """Compare key metrics with a baseline report; changes worse than tolerance are regressions."""
+    changes = {}
+    regressions = []
+    for path, higher_is_better in COMPARED_METRICS.items():
+        current, previous = report, baseline
+        for key in path:
+            current = (current or {}).get(key)
+            previous = (previous or {}).get(key)
+        if current is None or previous is None:
+            continue
+
+        name = ".".join(path)
+        change = (current - previous) / previous if previous else (0.0 if current == previous else float("inf"))
+        worse = -change if higher_is_better else change
+        changes[name] = {"baseline": previous, "current": current, "change": round(change, 4)}
+        # Error rates start at zero, so they are compared in absolute terms
+        if (worse > tolerance and name != "error_rate") or (name == "error_rate" and current - previous > tolerance / 10):
+            regressions.append(name)
+    return {"tolerance": tolerance, "changes": changes, "regressions": regressions}
+
+async def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    """Send requests at the target rate for the given duration and build the report."""
+    weights = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    sketches = [base64.b64encode(render_sketch(name)).decode("utf-8") for name in CORPUS]
+
+    redis_client = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, decode_responses=True)
+    redis_before = read_redis_stats(redis_client)
+    cpu_before = read_cpu_times()
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.api, timeout=args.timeout, limits=limits) as client:
+        pending = []
+        start = time.perf_counter()
+        next_send = start
+        while next_send - start < args.duration:
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+            request_type = rng.choices(list(weights), weights=list(weights.values()))[0]
+            image_base64 = rng.choice(sketches)
+            if request_type == "trellis":
+                coroutine = run_websocket_request(client, image_base64, args.timeout)
+            else:
+                coroutine = run_sse_request(client, request_type, image_base64, args.timeout, args.settle)
+            pending.append(asyncio.create_task(coroutine))
+
+            # Poisson arrivals by default, evenly spaced with --constant
+            next_send += 1 / args.rate if args.constant else rng.expovariate(args.rate)
+
+        results = []
+        for outcome in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(outcome, Exception):
+                results.append({"type": "unknown", "status": "error", "error": type(outcome).__name__})
+            else:
+                results.append(outcome)
+        elapsed = time.perf_counter() - start
+
+    redis_after = read_redis_stats(redis_client)
+    cpu_after = read_cpu_times()
+
+    report = {
+        "config": {
+            "api": args.api,
+            "rate": args.rate,
+            "duration": args.duration,
+            "mix": weights,
+            "arrivals": "constant" if args.constant else "poisson",
+            "seed": args.seed
+        },
+        "started_at": time.time() - elapsed,
+        "elapsed_s": round(elapsed, 2),
+        **summarize(results, elapsed),
+        "by_type": {
+            request_type: summarize([result for result in results if result["type"] == request_type], elapsed)
+            for request_type in weights
+        },
+        "redis": {
+            "commands": redis_after["total_commands_processed"] - redis_before["total_commands_processed"],
+            "commands_per_second": round((redis_after["total_commands_processed"] - redis_before["total_commands_processed"]) / elapsed, 1),
+            "cpu_seconds": round(redis_after["used_cpu_sys"] + redis_after["used_cpu_user"] - redis_before["used_cpu_sys"] - redis_before["used_cpu_user"], 3),
+            "used_memory_delta": redis_after["used_memory"] - redis_before["used_memory"],
+            "used_memory_peak": redis_after["used_memory_peak"],
+            "connected_clients": redis_after["connected_clients"]
+        },
+        "cpu_seconds": {
+            role: round(cpu_after[role] - cpu_before[role], 3) for role in cpu_after
+        } if cpu_before is not None else None
+    }
+    if args.include_requests:
+        report["results"] = results
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the API and workers end to end")
+    parser.add_argument("--api", type=str, default=f"http://localhost:{settings.API_PORT}", help="Base URL of the API")
+    parser.add_argument("--rate", type=float, default=1.0, help="Requests per second to send")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep sending requests")
+    parser.add_argument("--mix", type=str, default="3d=1", help=f"Weighted request types, e.g. 3d=3,image=1 (types: {', '.join(REQUEST_TYPES)})")
+    parser.add_argument("--constant", action="store_true", help="Space requests evenly instead of Poisson arrivals")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for a task to finish")
+    parser.add_argument("--settle", type=float, default=0.1, help="Seconds to wait after subscribing before queueing")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for arrivals and request choice")
+    parser.add_argument("--include-requests", action="store_true", help="Include every request's result in the report")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report to this file")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare against an earlier JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any metric regressed")
+
+    args = parser.parse_args()
+    report = asyncio.run(run_load_test(args))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare_reports(report, json.load(f), args.tolerance)
+
+    print(json.dumps({key: value for key, value in report.items() if key != "results"}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.fail_on_regression and report.get("comparison", {}).get("regressions"):
+        raise SystemExit(1)
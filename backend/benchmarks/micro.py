@@ -0,0 +1,325 @@
+# Microbenchmarks of the backend's hot paths
+#
+# Times Redis publishing and response storage with small and multi-MB payloads,
+# SSE dispatch through event_generator with many concurrent subscribers, request
+# validation with large images, the base64/PIL handling of the Gemini and Claude
+# tasks and code-fence extraction. The Redis and SSE groups need a local Redis
+# (REDIS_HOST/REDIS_PORT) and are skipped without one.
+#
+# With --record the results are appended to benchmarks/results/micro.jsonl,
+# which is committed so changes in timings show up in review; every run is
+# compared with the last recorded run from the same machine.
+#
+#   python -m benchmarks.micro [--group redis,code] [--quick] [--record] [--fail-on-regression]
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from io import BytesIO
+from PIL import Image, ImageDraw
+from typing import Dict, Any, List, Optional, Callable
+from app.core.config import settings
+
+GROUPS = ["redis", "sse", "models", "images", "code"]
+
+# Where recorded runs are kept, one JSON object per line
+RESULTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "micro.jsonl")
+
+# Payload sizes in bytes; 2 MB is a typical generated image event, 8 MB a large upload
+SMALL = 200
+LARGE = 2 * 1024 * 1024
+HUGE = 8 * 1024 * 1024
+
+def measure(func: Callable[[], Any], repeat: int, number: int = 1) -> Dict[str, float]:
+    """Time func over repeat rounds of number calls and return per-call statistics in microseconds."""
+    func()  # Warm up caches and lazy imports
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number * 1e6)
+    timings.sort()
+    return {
+        "median_us": round(statistics.median(timings), 2),
+        "p95_us": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        "min_us": round(timings[0], 2),
+        "ops_per_s": round(1e6 / statistics.median(timings), 1),
+        "rounds": repeat * number
+    }
+
+def random_base64(size: int, seed: int = 0) -> str:
+    """Base64 text of about size characters, incompressible like real image data."""
+    return base64.b64encode(random.Random(seed).randbytes(size * 3 // 4)).decode("ascii")
+
+def render_image(size: int, image_format: str = "PNG") -> bytes:
+    """A noisy test image, so encoders can't shortcut flat areas."""
+    rng = random.Random(size)
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = rng.randrange(size), rng.randrange(size)
+        draw.ellipse((x, y, x + size // 8, y + size // 8), outline=(0, 0, 0), width=4)
+    output = BytesIO()
+    image.save(output, format=image_format)
+    return output.getvalue()
+
+def model_response(code_lines: int) -> str:
+    """A model response with prose around a fenced block of scene code."""
+    code = "\n".join(
+        f"const mesh{i} = new THREE.Mesh(new THREE.BoxGeometry({i % 5 + 1}, 1, 1), material); scene.add(mesh{i});"
+        for i in range(code_lines)
+    )
+    return f"Here is the scene you asked for.\n\n```javascript\n{code}\n```\n\nThe boxes are laid out in a row."
+
+def redis_available() -> bool:
+    from app.core.redis import redis_service
+    try:
+        return bool(redis_service.client.ping())
+    except Exception:
+        return False
+
+def bench_redis(repeat: int) -> Dict[str, Dict[str, float]]:
+    """publish_event and store_response with a token-sized and multi-MB payloads."""
+    from app.core.redis import redis_service
+
+    task_id = f"bench-{uuid.uuid4()}"
+    results = {}
+    for label, size, rounds in (("small", SMALL, repeat * 20), ("2mb", LARGE, repeat), ("8mb", HUGE, max(3, repeat // 4))):
+        data = {"image_base64": random_base64(size), "mime_type": "image/png"}
+        results[f"redis.publish_event.{label}"] = measure(lambda: redis_service.publish_event(task_id, "image", data), rounds)
+        results[f"redis.store_response.{label}"] = measure(lambda: redis_service.store_response(task_id, data, 60), rounds)
+    redis_service.delete_value(f"task_response:{task_id}")
+    return results
+
+class ConnectedRequest:
+    """Stands in for the Starlette request event_generator polls; the client never leaves."""
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+async def dispatch_events(subscribers: int, events: int, payload_size: int) -> Dict[str, float]:
+    """Run event_generator for several tasks at once and time delivery of a burst of events to each."""
+    from app.api.routes import event_generator
+    from app.core.redis import redis_service
+
+    task_ids = [f"bench-{uuid.uuid4()}" for _ in range(subscribers)]
+    received: Dict[str, List[float]] = {task_id: [] for task_id in task_ids}
+
+    async def consume(task_id: str):
+        async for _ in event_generator(task_id, ConnectedRequest()):
+            received[task_id].append(time.perf_counter())
+
+    consumers = [asyncio.create_task(consume(task_id)) for task_id in task_ids]
+
+    # Wait until every generator has subscribed, or early events would be lost
+    channels = [f"task_stream:{task_id}" for task_id in task_ids]
+    while sum(count for _, count in redis_service.client.pubsub_numsub(*channels)) < subscribers:
+        await asyncio.sleep(0.01)
+
+    data = {"content": "x" * payload_size}
+
+    def publish():
+        # Published from a thread like a worker would, interleaving the tasks
+        for _ in range(events - 1):
+            for task_id in task_ids:
+                redis_service.publish_event(task_id, "chunk", data)
+        for task_id in task_ids:
+            redis_service.publish_event(task_id, "complete", {"status": "success"})
+
+    start = time.perf_counter()
+    threading.Thread(target=publish).start()
+    await asyncio.gather(*consumers)
+    elapsed = time.perf_counter() - start
+
+    delivered = sum(len(times) for times in received.values())
+    last_event = sorted(times[-1] - start for times in received.values())
+    return {
+        "subscribers": subscribers,
+        "events": delivered,
+        "seconds": round(elapsed, 4),
+        "events_per_s": round(delivered / elapsed, 1),
+        "p50_drain_ms": round(statistics.median(last_event) * 1000, 2),
+        "max_drain_ms": round(last_event[-1] * 1000, 2)
+    }
+
+def bench_sse(repeat: int) -> Dict[str, Dict[str, float]]:
+    """event_generator dispatch with 1, 10 and 50 concurrent subscribers."""
+    events = max(10, repeat * 2)
+    return {
+        f"sse.event_generator.{subscribers}_subscribers": asyncio.run(dispatch_events(subscribers, events, SMALL))
+        for subscribers in (1, 10, 50)
+    }
+
+def bench_models(repeat: int) -> Dict[str, Dict[str, float]]:
+    """StreamRequest parsing and validation with large image_base64 fields."""
+    from app.api.models import StreamRequest
+
+    results = {}
+    for label, size in (("small", SMALL), ("2mb", LARGE), ("8mb", HUGE)):
+        body = json.dumps({"prompt": "A low-poly house", "image_base64": random_base64(size)})
+        # FastAPI decodes the JSON body first and validates the resulting dict
+        results[f"models.stream_request.json_then_validate.{label}"] = measure(
+            lambda: StreamRequest.model_validate(json.loads(body)), repeat)
+        results[f"models.stream_request.validate_json.{label}"] = measure(
+            lambda: StreamRequest.model_validate_json(body), repeat)
+    return results
+
+def bench_images(repeat: int) -> Dict[str, Dict[str, float]]:
+    """Image handling of the Gemini and Claude tasks on a sketch upload and a generated image."""
+    from app.core.images import decode_base64_image, get_base64_image_mime_type, get_image_size, make_thumbnail
+    from app.tasks.claude_tasks import ClaudePromptTask
+    from app.tasks.gemini_tasks import GeminiPromptTask, GeminiImageGenerationTask
+
+    sketch_base64 = "data:image/png;base64," + base64.b64encode(render_image(768)).decode("ascii")
+    generated = render_image(1024)
+    results = {
+        "images.decode_base64": measure(lambda: decode_base64_image(sketch_base64), repeat, 10),
+        "images.mime_type": measure(lambda: get_base64_image_mime_type(sketch_base64), repeat, 100),
+        "images.size_from_header": measure(lambda: get_image_size(generated), repeat, 100),
+        "images.thumbnail": measure(lambda: make_thumbnail(generated, settings.GEMINI_THUMBNAIL_SIZE), repeat),
+        "images.encode_generated": measure(lambda: base64.b64encode(generated).decode("utf-8"), repeat, 10),
+        "gemini.prompt_params": measure(lambda: GeminiPromptTask.prepare_message_params(
+            "A low-poly house", image_base64=sketch_base64.split(",")[-1]), repeat),
+        "gemini.image_params": measure(lambda: GeminiImageGenerationTask.prepare_message_params(
+            "", image_base64=sketch_base64), repeat),
+        "claude.prompt_params": measure(lambda: ClaudePromptTask.prepare_message_params(
+            prompt="", image_base64=sketch_base64, additional_params={"sketch_mode": "image"}), repeat)
+    }
+    return results
+
+def bench_code(repeat: int) -> Dict[str, Dict[str, float]]:
+    """Code-fence extraction from whole and streamed model responses."""
+    from app.core.code import extract_code_block, code_fingerprint, CodeBlockStreamer
+
+    results = {}
+    for label, lines in (("small", 20), ("large", 2000)):
+        response = model_response(lines)
+        # Chunk sizes similar to what the providers stream
+        chunks = [response[i:i + 40] for i in range(0, len(response), 40)]
+
+        def stream():
+            streamer = CodeBlockStreamer()
+            for chunk in chunks:
+                streamer.feed(chunk)
+            streamer.flush()
+
+        results[f"code.extract_code_block.{label}"] = measure(lambda: extract_code_block(response), repeat, 10)
+        results[f"code.fingerprint.{label}"] = measure(lambda: code_fingerprint(response), repeat, 10)
+        results[f"code.stream_extract.{label}"] = measure(stream, repeat)
+    return results
+
+BENCHMARKS = {
+    "redis": bench_redis,
+    "sse": bench_sse,
+    "models": bench_models,
+    "images": bench_images,
+    "code": bench_code
+}
+
+def get_machine() -> str:
+    """Identify the machine, since timings are only comparable on the same hardware."""
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}cpu/py{platform.python_version()}"
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_previous(machine: str) -> Optional[Dict[str, Any]]:
+    """Get the last recorded run from this machine."""
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record.get("machine") == machine:
+                    previous = record
+    return previous
+
+def compare_runs(results: Dict[str, Dict[str, float]], previous: Dict[str, Dict[str, float]], tolerance: float) -> Dict[str, Any]:
+    """Compare median times (or drain times for dispatch) with a previous run."""
+    changes = {}
+    regressions = []
+    for name, stats in results.items():
+        metric = "median_us" if "median_us" in stats else "p50_drain_ms"
+        before = previous.get(name, {}).get(metric)
+        if not before or metric not in stats:
+            continue
+        change = (stats[metric] - before) / before
+        changes[name] = {"metric": metric, "previous": before, "current": stats[metric], "change": round(change, 4)}
+        if change > tolerance:
+            regressions.append(name)
+    return {"tolerance": tolerance, "changes": changes, "regressions": regressions}
+
+def run_benchmarks(groups: List[str], repeat: int) -> Dict[str, Any]:
+    """Run the selected groups, skipping those that need an unavailable Redis."""
+    results = {}
+    skipped = []
+    has_redis = redis_available() if {"redis", "sse"} & set(groups) else False
+    for group in groups:
+        if group in ("redis", "sse") and not has_redis:
+            print(f"[DEBUG] Skipping {group}: Redis is not reachable at {settings.REDIS_HOST}:{settings.REDIS_PORT}")
+            skipped.append(group)
+            continue
+        group_results = BENCHMARKS[group](repeat)
+        for name, stats in group_results.items():
+            print(f"[DEBUG] {name:55s} " + " ".join(f"{k}={v}" for k, v in stats.items()))
+        results.update(group_results)
+
+    return {
+        "recorded_at": time.time(),
+        "commit": get_commit(),
+        "machine": get_machine(),
+        "repeat": repeat,
+        "skipped": skipped,
+        "results": results
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark the backend's hot paths")
+    parser.add_argument("--group", type=str, default=",".join(GROUPS), help=f"Comma-separated groups to run ({', '.join(GROUPS)})")
+    parser.add_argument("--repeat", type=int, default=30, help="Timed rounds per benchmark")
+    parser.add_argument("--quick", action="store_true", help="Fewer rounds, for a fast sanity check")
+    parser.add_argument("--record", action="store_true", help=f"Append the run to {os.path.relpath(RESULTS_FILE)}")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative slowdown counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if any benchmark regressed")
+    parser.add_argument("--output", type=str, default=None, help="Also write the JSON report to this file")
+
+    args = parser.parse_args()
+    groups = [group.strip() for group in args.group.split(",") if group.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"Unknown groups: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(groups, 5 if args.quick else args.repeat)
+
+    previous = load_previous(report["machine"])
+    if previous is not None:
+        report["comparison"] = compare_runs(report["results"], previous["results"], args.tolerance)
+        report["comparison"]["previous_commit"] = previous.get("commit")
+        for name in report["comparison"]["regressions"]:
+            change = report["comparison"]["changes"][name]
+            print(f"[DEBUG] Regression: {name} {change['previous']} -> {change['current']} ({change['change']:+.0%})")
+
+    if args.record:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps({key: value for key, value in report.items() if key != "comparison"}) + "\n")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.fail_on_regression and report.get("comparison", {}).get("regressions"):
+        raise SystemExit(1)
@@ -0,0 +1,186 @@
+# Compare prompt size and latency of the image, vector and both sketch modes
+#
+# Runs over a fixed corpus of synthetic line-art sketches. Token counts come from
+# Anthropic's token counting endpoint when ANTHROPIC_API_KEY is set and are
+# estimated otherwise; --live also runs the generations and times them.
+#
+#   python -m benchmarks.sketch_modes --output sketch_modes.json [--live]
+import argparse
+import asyncio
+import base64
+import json
+import random
+import statistics
+import time
+from io import BytesIO
+from PIL import Image, ImageDraw
+from typing import Dict, Any, List, Callable
+from app.core.config import settings
+from app.core.vectorize import vectorize_sketch, describe_primitives
+
+MODES = ["image", "vector", "both"]
+
+# Canvas size of the corpus sketches, close to what the frontend renders
+SIZE = (768, 512)
+
+def jitter(rng: random.Random, points: List[tuple], amount: float = 2.0) -> List[tuple]:
+    """Offset points slightly so shapes look hand drawn."""
+    return [(x + rng.uniform(-amount, amount), y + rng.uniform(-amount, amount)) for x, y in points]
+
+def draw_house(draw: ImageDraw.ImageDraw, rng: random.Random):
+    draw.rectangle((240, 220, 520, 440), outline="black", width=4)
+    draw.line(jitter(rng, [(220, 230), (380, 90), (540, 230)]), fill="black", width=4)
+    draw.rectangle((350, 330, 410, 440), outline="#8b4513", width=4)
+    draw.rectangle((270, 260, 330, 310), outline="#1e90ff", width=3)
+
+def draw_car(draw: ImageDraw.ImageDraw, rng: random.Random):
+    draw.line(jitter(rng, [(150, 330), (200, 250), (520, 250), (600, 330), (150, 330)]), fill="red", width=4)
+    draw.ellipse((210, 310, 290, 390), outline="black", width=4)
+    draw.ellipse((470, 310, 550, 390), outline="black", width=4)
+
+def draw_snowman(draw: ImageDraw.ImageDraw, rng: random.Random):
+    draw.ellipse((300, 300, 460, 460), outline="black", width=3)
+    draw.ellipse((325, 190, 435, 300), outline="black", width=3)
+    draw.ellipse((345, 110, 415, 180), outline="black", width=3)
+    draw.polygon([(380, 145), (420, 150), (380, 155)], fill="orange")
+
+def draw_tree(draw: ImageDraw.ImageDraw, rng: random.Random):
+    draw.rectangle((360, 330, 400, 460), fill="#8b4513")
+    draw.ellipse((270, 120, 490, 340), fill="#228b22")
+
+def draw_table(draw: ImageDraw.ImageDraw, rng: random.Random):
+    draw.line(jitter(rng, [(180, 220), (580, 220), (640, 280), (240, 280), (180, 220)]), fill="black", width=4)
+    for x in (250, 560):
+        draw.line(jitter(rng, [(x, 280), (x, 450)]), fill="black", width=4)
+    for x in (200, 610):
+        draw.line(jitter(rng, [(x, 240), (x, 400)]), fill="black", width=4)
+
+def draw_rocket(draw: ImageDraw.ImageDraw, rng: random.Random):
+    draw.line(jitter(rng, [(384, 60), (440, 160), (440, 380), (328, 380), (328, 160), (384, 60)]), fill="black", width=4)
+    draw.ellipse((354, 180, 414, 240), outline="#1e90ff", width=4)
+    draw.polygon([(328, 300), (270, 420), (328, 380)], outline="red")
+    draw.polygon([(440, 300), (498, 420), (440, 380)], outline="red")
+    draw.line(jitter(rng, [(360, 390), (384, 470), (408, 390)]), fill="orange", width=4)
+
+def draw_scribbles(draw: ImageDraw.ImageDraw, rng: random.Random):
+    # A busy sketch with many small strokes, the worst case for vectorization
+    for _ in range(60):
+        x, y = rng.uniform(60, 700), rng.uniform(60, 450)
+        points = [(x, y)]
+        for _ in range(rng.randint(2, 6)):
+            x, y = x + rng.uniform(-40, 40), y + rng.uniform(-40, 40)
+            points.append((x, y))
+        draw.line(points, fill="black", width=3)
+
+CORPUS: Dict[str, Callable[[ImageDraw.ImageDraw, random.Random], None]] = {
+    "house": draw_house,
+    "car": draw_car,
+    "snowman": draw_snowman,
+    "tree": draw_tree,
+    "table": draw_table,
+    "rocket": draw_rocket,
+    "scribbles": draw_scribbles
+}
+
+def render_sketch(name: str, seed: int = 0) -> bytes:
+    """Render a corpus sketch as a PNG with a transparent background, like the frontend's export."""
+    image = Image.new("RGBA", SIZE, (255, 255, 255, 0))
+    CORPUS[name](ImageDraw.Draw(image), random.Random(f"{name}:{seed}"))
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+def estimate_tokens(message_params: Dict[str, Any]) -> int:
+    """Estimate input tokens offline: about 4 characters per text token and
+    width * height / 750 per image, after Claude's downscale to 1568 pixels."""
+    tokens = len(message_params["system"]) / 4
+    for block in message_params["messages"][0]["content"]:
+        if block["type"] == "text":
+            tokens += len(block["text"]) / 4
+        else:
+            image = Image.open(BytesIO(base64.b64decode(block["source"]["data"])))
+            scale = min(1.0, 1568 / max(image.size))
+            tokens += image.width * scale * image.height * scale / 750
+    return int(tokens)
+
+async def run_benchmark(live: bool, repeat: int) -> Dict[str, Any]:
+    """Measure every corpus sketch in every mode."""
+    # Imported here so vectorization can be benchmarked without the task stack configured
+    from app.tasks.claude_tasks import ClaudePromptTask
+
+    client = await ClaudePromptTask.client if settings.ANTHROPIC_API_KEY else None
+    results = []
+
+    for name in CORPUS:
+        image_base64 = base64.b64encode(render_sketch(name)).decode("utf-8")
+
+        # Vectorization cost on its own
+        timings = []
+        for _ in range(repeat):
+            vector = vectorize_sketch(base64.b64decode(image_base64))
+            timings.append(vector["elapsed_ms"])
+
+        for mode in MODES:
+            message_params = ClaudePromptTask.prepare_message_params(
+                prompt="", image_base64=image_base64, additional_params={"sketch_mode": mode}
+            )
+            result = {
+                "sketch": name,
+                "mode": mode,
+                "primitives": len(vector["primitives"]),
+                "vector_chars": len(describe_primitives(vector)),
+                "vectorize_ms": statistics.median(timings) if mode != "image" else 0.0,
+                "estimated_input_tokens": estimate_tokens(message_params)
+            }
+
+            if client is not None:
+                count = await client.messages.count_tokens(
+                    model=message_params["model"],
+                    system=message_params["system"],
+                    messages=message_params["messages"]
+                )
+                result["input_tokens"] = count.input_tokens
+
+            if live and client is not None:
+                start = time.perf_counter()
+                response = await client.messages.create(**message_params)
+                result["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                result["output_tokens"] = response.usage.output_tokens
+
+            print(f"[DEBUG] {name:10s} {mode:6s} " + " ".join(f"{k}={v}" for k, v in result.items() if k not in ("sketch", "mode")))
+            results.append(result)
+
+    # Per-mode medians for a quick comparison
+    summary = {}
+    for mode in MODES:
+        rows = [result for result in results if result["mode"] == mode]
+        summary[mode] = {
+            key: statistics.median(row[key] for row in rows)
+            for key in ("estimated_input_tokens", "input_tokens", "latency_ms", "vectorize_ms")
+            if all(key in row for row in rows)
+        }
+
+    return {
+        "corpus": list(CORPUS),
+        "settings": {
+            "max_size": settings.SKETCH_VECTOR_MAX_SIZE,
+            "tolerance": settings.SKETCH_VECTOR_TOLERANCE,
+            "max_primitives": settings.SKETCH_VECTOR_MAX_PRIMITIVES
+        },
+        "results": results,
+        "summary": summary
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sketch modes for 3D generation prompts")
+    parser.add_argument("--live", action="store_true", help="Also run the generations and measure latency")
+    parser.add_argument("--repeat", type=int, default=5, help="Vectorization runs per sketch")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON report to this file")
+
+    args = parser.parse_args()
+    report = asyncio.run(run_benchmark(args.live, args.repeat))
+
+    print(json.dumps(report["summary"], indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
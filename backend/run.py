@@ -1,14 +1,26 @@
+import os
+import tempfile
 import uvicorn
 from app.core.config import settings
 
+try:
+    import uvloop
+except ImportError:  # uvicorn falls back to the asyncio event loop
+    uvloop = None
+
+try:
+    import httptools
+except ImportError:  # uvicorn falls back to the pure-Python h11 parser
+    httptools = None
+
 def start_api_server(host=None, port=None, reload=True):
     """Start the FastAPI server with the given configuration."""
     host = host or settings.API_HOST
     port = port or settings.API_PORT
-    
+
     print(f"Starting API server at http://{host}:{port}")
     print("API Documentation available at http://localhost:8000/docs")
-    
+
     uvicorn.run(
         "app.main:app",
         host=host,
@@ -16,18 +28,64 @@ def start_api_server(host=None, port=None, reload=True):
         reload=reload  # For development
     )
 
+def start_production_server(host=None, port=None, workers=None):
+    """Start the API with several worker processes and production settings.
+
+    On SIGTERM uvicorn stops accepting connections and waits up to
+    API_GRACEFUL_SHUTDOWN_TIMEOUT for open ones; SSE streams drain for
+    SSE_DRAIN_SECONDS and then tell their clients to reconnect.
+    """
+    host = host or settings.API_HOST
+    port = port or settings.API_PORT
+    workers = workers or settings.API_WORKERS
+
+    if workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Without a shared directory /metrics would only show the process that serves it
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(tempfile.gettempdir(), f"prometheus-api-{port}")
+
+    # Imported after the environment is set, since the metrics module reads it at import
+    from app.core.metrics import clear_multiprocess_dir
+    clear_multiprocess_dir()
+
+    print(f"Starting API server at http://{host}:{port} with {workers} workers "
+          f"({'uvloop' if uvloop else 'asyncio'}, {'httptools' if httptools else 'h11'})")
+
+    uvicorn.run(
+        "app.main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop="uvloop" if uvloop else "asyncio",
+        http="httptools" if httptools else "h11",
+        backlog=settings.API_BACKLOG,
+        timeout_keep_alive=settings.API_KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=settings.API_GRACEFUL_SHUTDOWN_TIMEOUT,
+        limit_concurrency=settings.API_LIMIT_CONCURRENCY or None,
+        proxy_headers=True,
+        access_log=False
+    )
+
 if __name__ == "__main__":
     import argparse
-    
+
     parser = argparse.ArgumentParser(description="Run the Claude 3.7 API server")
     parser.add_argument("--host", type=str, help="Host to bind the server to")
     parser.add_argument("--port", type=int, help="Port to bind the server to")
     parser.add_argument("--no-reload", action="store_true", help="Disable auto-reload")
-    
+    parser.add_argument("--production", action="store_true", help="Run several worker processes without auto-reload")
+    parser.add_argument("--workers", type=int, help="Worker processes in production mode (default: API_WORKERS)")
+
     args = parser.parse_args()
-    
-    start_api_server(
-        host=args.host,
-        port=args.port,
-        reload=not args.no_reload
-    )
+
+    if args.production:
+        start_production_server(
+            host=args.host,
+            port=args.port,
+            workers=args.workers
+        )
+    else:
+        start_api_server(
+            host=args.host,
+            port=args.port,
+            reload=not args.no_reload
+        )
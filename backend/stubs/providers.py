@@ -0,0 +1,297 @@
+# Local stand-ins for the Anthropic, Gemini and Cerebras APIs, plus the Trellis stub
+#
+# Every provider answers with canned output after a latency drawn from a
+# log-normal distribution, streams when asked to, and can inject 429s and
+# server errors at configurable rates. Point the API and workers at it with
+# the environment printed on startup:
+#
+#   python -m stubs.providers --port 8200 [--config stub_behavior.json]
+import asyncio
+import base64
+import json
+import math
+import random
+import time
+import uuid
+import uvicorn
+from io import BytesIO
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from PIL import Image, ImageDraw
+from typing import Dict, Any, List, Optional, AsyncIterator
+from stubs import trellis
+
+app = FastAPI(title="Provider API stubs")
+
+# The Trellis stub keeps its own routes under /trellis
+app.mount("/trellis", trellis.app)
+
+# Behavior of each provider. latency_median/latency_sigma shape the log-normal
+# total latency in seconds, ttft_fraction is the share of it spent before the
+# first streamed chunk, and rate_limit_rate/error_rate are per-request odds.
+BEHAVIOR: Dict[str, Dict[str, float]] = {
+    "anthropic": {"latency_median": 8.0, "latency_sigma": 0.4, "ttft_fraction": 0.1, "chunks": 40, "rate_limit_rate": 0.0, "error_rate": 0.0},
+    "gemini": {"latency_median": 4.0, "latency_sigma": 0.3, "ttft_fraction": 0.5, "chunks": 4, "rate_limit_rate": 0.0, "error_rate": 0.0},
+    "cerebras": {"latency_median": 0.5, "latency_sigma": 0.3, "ttft_fraction": 0.2, "chunks": 20, "rate_limit_rate": 0.0, "error_rate": 0.0}
+}
+
+# Scene returned by the Anthropic stub; valid code so the syntax and complexity checks pass
+SCENE_CODE = """const scene = new THREE.Scene();
+const camera = new THREE.PerspectiveCamera(75, window.innerWidth / window.innerHeight, 0.1, 1000);
+const renderer = new THREE.WebGLRenderer({ antialias: true });
+renderer.setSize(window.innerWidth, window.innerHeight);
+document.body.appendChild(renderer.domElement);
+
+const group = new THREE.Group();
+const body = new THREE.Mesh(new THREE.BoxGeometry(2, 1, 1), new THREE.MeshStandardMaterial({ color: 0xff4444 }));
+group.add(body);
+const wheel = new THREE.Mesh(new THREE.CylinderGeometry(0.3, 0.3, 0.2, 32), new THREE.MeshStandardMaterial({ color: 0x222222 }));
+wheel.rotation.x = Math.PI / 2;
+wheel.position.set(-0.6, -0.5, 0.5);
+group.add(wheel);
+scene.add(group);
+
+scene.add(new THREE.AmbientLight(0xffffff, 0.6));
+const light = new THREE.DirectionalLight(0xffffff, 0.8);
+light.position.set(5, 5, 5);
+scene.add(light);
+camera.position.z = 5;
+
+const controls = new OrbitControls(camera, renderer.domElement);
+
+function animate() {
+  requestAnimationFrame(animate);
+  controls.update();
+  renderer.render(scene, camera);
+}
+animate();
+"""
+
+# Object returned by the Cerebras stub's extraction
+OBJECT_CODE = """const group = new THREE.Group();
+const body = new THREE.Mesh(new THREE.BoxGeometry(2, 1, 1), new THREE.MeshStandardMaterial({ color: 0xff4444 }));
+group.add(body);
+return group;
+"""
+
+def make_image() -> str:
+    """Draw the image the Gemini stub returns, as base64 PNG."""
+    image = Image.new("RGB", (512, 512), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((120, 200, 392, 340), fill="#ff4444")
+    draw.ellipse((150, 310, 230, 390), fill="#222222")
+    draw.ellipse((282, 310, 362, 390), fill="#222222")
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return base64.b64encode(output.getvalue()).decode("ascii")
+
+IMAGE_BASE64 = make_image()
+
+def sample_latency(provider: str) -> float:
+    """Draw a total latency in seconds for one request."""
+    behavior = BEHAVIOR[provider]
+    return behavior["latency_median"] * math.exp(behavior["latency_sigma"] * random.gauss(0, 1))
+
+def split_text(text: str, chunks: int) -> List[str]:
+    """Split text into roughly equal streamed pieces."""
+    chunks = max(1, int(chunks))
+    size = max(1, math.ceil(len(text) / chunks))
+    return [text[index:index + size] for index in range(0, len(text), size)]
+
+def injected_failure(provider: str) -> Optional[JSONResponse]:
+    """Return a rate limit or server error response if one is injected for this request."""
+    behavior = BEHAVIOR[provider]
+    roll = random.random()
+    if roll < behavior["rate_limit_rate"]:
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": "1"},
+            content={"type": "error", "error": {"type": "rate_limit_error", "message": "Stub rate limit"}}
+        )
+    if roll < behavior["rate_limit_rate"] + behavior["error_rate"]:
+        # Anthropic reports overload as 529, the others as 503
+        status_code = 529 if provider == "anthropic" else 503
+        return JSONResponse(
+            status_code=status_code,
+            content={"type": "error", "error": {"type": "overloaded_error", "message": "Stub server error"}}
+        )
+    return None
+
+async def paced_chunks(provider: str, pieces: List[Any]) -> AsyncIterator[Any]:
+    """Yield pieces spread over a sampled latency, the first after the time to first token."""
+    latency = sample_latency(provider)
+    ttft = latency * BEHAVIOR[provider]["ttft_fraction"]
+    interval = (latency - ttft) / max(1, len(pieces))
+
+    await asyncio.sleep(ttft)
+    for piece in pieces:
+        yield piece
+        await asyncio.sleep(interval)
+
+def sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format one server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    """Anthropic Messages API: returns a fenced scene, streamed as SSE when requested."""
+    failure = injected_failure("anthropic")
+    if failure is not None:
+        return failure
+
+    body = await request.json()
+    model = body.get("model", "claude-stub")
+    text = f"```javascript\n{SCENE_CODE}```"
+    input_tokens = len(json.dumps(body.get("messages", []))) // 4
+    output_tokens = len(text) // 4
+    message_id = f"msg_{uuid.uuid4().hex}"
+
+    if not body.get("stream"):
+        await asyncio.sleep(sample_latency("anthropic"))
+        return {
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}
+        }
+
+    async def generate():
+        yield sse({"type": "message_start", "message": {
+            "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": input_tokens, "output_tokens": 1}
+        }}, "message_start")
+        yield sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}, "content_block_start")
+        async for piece in paced_chunks("anthropic", split_text(text, BEHAVIOR["anthropic"]["chunks"])):
+            yield sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}}, "content_block_delta")
+        yield sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        yield sse({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                   "usage": {"output_tokens": output_tokens}}, "message_delta")
+        yield sse({"type": "message_stop"}, "message_stop")
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+@app.post("/v1/messages/count_tokens")
+async def anthropic_count_tokens(request: Request):
+    """Anthropic token counting: a rough estimate from the request size."""
+    body = await request.json()
+    return {"input_tokens": len(json.dumps(body.get("messages", []))) // 4}
+
+def gemini_chunk(parts: List[Dict[str, Any]], final: bool) -> Dict[str, Any]:
+    """Build one generateContent response (or streamed chunk)."""
+    chunk = {"candidates": [{"content": {"role": "model", "parts": parts}, "index": 0}]}
+    if final:
+        chunk["candidates"][0]["finishReason"] = "STOP"
+        chunk["usageMetadata"] = {"promptTokenCount": 300, "candidatesTokenCount": 1290, "totalTokenCount": 1590}
+    return chunk
+
+@app.post("/{api_version}/models/{model_action}")
+async def gemini_generate(api_version: str, model_action: str, request: Request):
+    """Gemini generateContent and streamGenerateContent: returns a cleaned-up sketch image."""
+    failure = injected_failure("gemini")
+    if failure is not None:
+        return failure
+
+    _, _, action = model_action.partition(":")
+    parts = [
+        {"text": "Here is the cleaned up sketch."},
+        {"inlineData": {"mimeType": "image/png", "data": IMAGE_BASE64}}
+    ]
+
+    if action != "streamGenerateContent":
+        await asyncio.sleep(sample_latency("gemini"))
+        return gemini_chunk(parts, final=True)
+
+    async def generate():
+        async for index, part in paced_chunks("gemini", list(enumerate(parts))):
+            yield sse(gemini_chunk([part], final=index == len(parts) - 1))
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+@app.get("/v1/tcp_warming")
+@app.get("/v1/models")
+async def cerebras_warmup():
+    """Endpoints the Cerebras SDK calls to warm up its connection."""
+    return {"object": "list", "data": []}
+
+@app.post("/v1/chat/completions")
+async def cerebras_chat_completions(request: Request):
+    """Cerebras (OpenAI-style) chat completions: returns an extracted object."""
+    failure = injected_failure("cerebras")
+    if failure is not None:
+        return failure
+
+    body = await request.json()
+    model = body.get("model", "llama-stub")
+    text = f"```javascript\n{OBJECT_CODE}```"
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    usage = {"prompt_tokens": len(json.dumps(body.get("messages", []))) // 4, "completion_tokens": len(text) // 4}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+    if not body.get("stream"):
+        await asyncio.sleep(sample_latency("cerebras"))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "system_fingerprint": "fp_stub",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    async def generate():
+        async for piece in paced_chunks("cerebras", split_text(text, BEHAVIOR["cerebras"]["chunks"])):
+            yield sse({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "system_fingerprint": "fp_stub", "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+            })
+        yield sse({
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "system_fingerprint": "fp_stub", "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": "stop"}], "usage": usage
+        })
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run local provider API stubs")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind the stubs to")
+    parser.add_argument("--port", type=int, default=8200, help="Port to bind the stubs to")
+    parser.add_argument("--config", type=str, help="JSON file with per-provider behavior overrides, e.g. {\"anthropic\": {\"rate_limit_rate\": 0.05}}")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiply every provider's median latency")
+    parser.add_argument("--rate-limit-rate", type=float, help="Share of requests answered with 429, for every provider")
+    parser.add_argument("--error-rate", type=float, help="Share of requests answered with a server error, for every provider")
+    parser.add_argument("--trellis-stage-delay", type=float, default=trellis.STAGE_DELAY, help="Seconds between Trellis status changes")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible latencies and failures")
+
+    args = parser.parse_args()
+    if args.config:
+        with open(args.config) as f:
+            for provider, overrides in json.load(f).items():
+                BEHAVIOR[provider].update(overrides)
+    for behavior in BEHAVIOR.values():
+        behavior["latency_median"] *= args.latency_scale
+        if args.rate_limit_rate is not None:
+            behavior["rate_limit_rate"] = args.rate_limit_rate
+        if args.error_rate is not None:
+            behavior["error_rate"] = args.error_rate
+    trellis.STAGE_DELAY = args.trellis_stage_delay
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    base_url = f"http://{args.host}:{args.port}"
+    print(f"Starting provider stubs at {base_url} with behavior {json.dumps(BEHAVIOR)}")
+    print("Point the API and workers at them with:")
+    print(f"  ANTHROPIC_BASE_URL={base_url} GOOGLE_BASE_URL={base_url} CEREBRAS_BASE_URL={base_url}")
+    print(f"  TRELLIS_API_URL={base_url}/trellis/api/v1/task")
+    print("  ANTHROPIC_API_KEY=stub GOOGLE_API_KEY=stub CEREBRAS_API_KEY=stub TRELLIS_API_KEY=stub")
+
+    uvicorn.run(app, host=args.host, port=args.port)
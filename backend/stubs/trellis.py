@@ -0,0 +1,129 @@
+# Local stand-in for the PiAPI Trellis API that posts status webhooks
+import asyncio
+import json
+import struct
+import time
+import uuid
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+from typing import Dict, Any
+
+app = FastAPI(title="Trellis API stub")
+
+# Jobs created on this stub, keyed by task ID
+tasks: Dict[str, Dict[str, Any]] = {}
+
+# Seconds spent in each state before moving to the next one
+STAGE_DELAY = 2.0
+
+def build_model_glb() -> bytes:
+    """Build a tetrahedron GLB to serve as the model of completed jobs."""
+    positions = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)]
+    indices = [0, 2, 1, 0, 1, 3, 0, 3, 2, 1, 2, 3]
+    binary = struct.pack("<12f", *[c for p in positions for c in p]) + struct.pack("<12H", *indices)
+
+    gltf = {
+        "asset": {"version": "2.0"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, "indices": 1}]}],
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": 48, "target": 34962},
+            {"buffer": 0, "byteOffset": 48, "byteLength": 24, "target": 34963}
+        ],
+        "accessors": [
+            {"bufferView": 0, "componentType": 5126, "count": 4, "type": "VEC3", "min": [0, 0, 0], "max": [1, 1, 1]},
+            {"bufferView": 1, "componentType": 5123, "count": 12, "type": "SCALAR"}
+        ]
+    }
+    content = json.dumps(gltf, separators=(",", ":")).encode()
+    content += b" " * (-len(content) % 4)
+
+    chunks = struct.pack("<II", len(content), 0x4E4F534A) + content + struct.pack("<II", len(binary), 0x004E4942) + binary
+    return struct.pack("<4sII", b"glTF", 2, 12 + len(chunks)) + chunks
+
+# Model file of completed jobs, served by the stub itself
+MODEL_GLB = build_model_glb()
+
+def task_payload(task_id: str) -> Dict[str, Any]:
+    """Build a task payload in PiAPI's unified format."""
+    return {
+        "task_id": task_id,
+        "model": "Qubico/trellis",
+        "task_type": "image-to-3d",
+        **tasks[task_id]
+    }
+
+async def post_webhook(task_id: str, webhook_config: Dict[str, Any]):
+    """Post the current state of a task to its webhook endpoint."""
+    headers = {}
+    if webhook_config.get("secret"):
+        headers["x-webhook-secret"] = webhook_config["secret"]
+
+    async with httpx.AsyncClient() as client:
+        try:
+            await client.post(
+                webhook_config["endpoint"],
+                headers=headers,
+                json={"timestamp": int(time.time()), "data": task_payload(task_id)},
+                timeout=10.0
+            )
+        except httpx.RequestError as e:
+            print(f"[STUB] Failed to post webhook for {task_id}: {str(e)}")
+
+async def run_task(task_id: str, webhook_config: Dict[str, Any], fail: bool, model_url: str):
+    """Walk a task through pending, processing and a final state."""
+    final_state = {"status": "failed", "error": {"message": "Stub failure"}} if fail else {
+        "status": "completed", "output": {"model_file": model_url}
+    }
+
+    for state in [{"status": "processing"}, final_state]:
+        await asyncio.sleep(STAGE_DELAY)
+        tasks[task_id].update(state)
+        if webhook_config:
+            await post_webhook(task_id, webhook_config)
+
+@app.post("/api/v1/task")
+async def create_task(request_data: Dict[str, Any], request: Request):
+    """Create a fake job. Pass input.seed = -1 to make it fail."""
+    task_id = str(uuid.uuid4())
+    tasks[task_id] = {"status": "pending", "input": request_data.get("input", {}), "output": {}}
+
+    webhook_config = (request_data.get("config") or {}).get("webhook_config") or {}
+    fail = request_data.get("input", {}).get("seed") == -1
+    # Resolved against the request so the URL also works under the /trellis mount
+    model_url = str(request.url_for("get_model_file"))
+    asyncio.create_task(run_task(task_id, webhook_config, fail, model_url))
+
+    return {"code": 200, "data": task_payload(task_id), "message": "success"}
+
+@app.get("/api/v1/task/{task_id}")
+async def get_task(task_id: str):
+    """Get the state of a fake job."""
+    if task_id not in tasks:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return {"code": 200, "data": task_payload(task_id), "message": "success"}
+
+@app.get("/models/stub.glb")
+async def get_model_file():
+    """Serve the model file of completed jobs."""
+    return Response(content=MODEL_GLB, media_type="model/gltf-binary")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local Trellis API stub")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind the stub to")
+    parser.add_argument("--port", type=int, default=8100, help="Port to bind the stub to")
+    parser.add_argument("--stage-delay", type=float, default=STAGE_DELAY, help="Seconds between status changes")
+
+    args = parser.parse_args()
+    STAGE_DELAY = args.stage_delay
+
+    print(f"Starting Trellis stub at http://{args.host}:{args.port}")
+    print(f"Point the API at it with TRELLIS_API_URL=http://{args.host}:{args.port}/api/v1/task")
+
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,20 @@
+import fakeredis
+import pytest
+from app.core.complexity import guard_scene
+from app.core.config import settings
+from app.core.redis import redis_service
+
+DENSE_SPHERE = "```javascript\nconst geometry = new THREE.SphereGeometry(1, 512, 512);\n```"
+
+@pytest.mark.parametrize("value_format", ["json", "msgpack"])
+def test_clamped_report_survives_a_stored_response(monkeypatch, value_format):
+    monkeypatch.setattr(settings, "REDIS_VALUE_FORMAT", value_format)
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_service, "_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(redis_service, "_raw_client", fakeredis.FakeRedis(server=server))
+    _, report = guard_scene(DENSE_SPHERE)
+
+    redis_service.store_response("task", {"status": "success", "complexity": report})
+
+    assert redis_service.get_response("task")["complexity"] == report
+    assert [entry["arg"] for entry in report["geometries"][0]["clamped"]] == [1, 2]
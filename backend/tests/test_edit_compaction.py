@@ -0,0 +1,127 @@
+import asyncio
+from types import SimpleNamespace
+from app.core.config import settings
+from app.core.code import apply_search_replace, make_unified_diff
+from app.core.js import compact_js, elide_boilerplate, restore_boilerplate, carry_over_edit
+from app.tasks import claude_tasks
+
+SCENE = """// Scene setup
+const scene = new THREE.Scene();
+const camera = new THREE.PerspectiveCamera(75, window.innerWidth / window.innerHeight, 0.1, 1000);
+const renderer = new THREE.WebGLRenderer({ antialias: true });
+renderer.setSize(window.innerWidth, window.innerHeight);
+document.body.appendChild(renderer.domElement);
+
+/* The main cube */
+const geometry = new THREE.BoxGeometry(1, 1, 1);
+const material = new THREE.MeshStandardMaterial({ color: 0x00ff00 });  // green
+const cube = new THREE.Mesh(geometry, material);
+scene.add(cube);
+
+// Lighting
+const light = new THREE.DirectionalLight(0xffffff, 1);
+light.position.set(5, 5, 5);
+scene.add(light);
+
+function animate() {
+    requestAnimationFrame(animate);
+    // Spin the cube
+    cube.rotation.x += 0.01;
+    cube.rotation.y += 0.01;
+    renderer.render(scene, camera);
+}
+
+camera.position.z = 5;
+animate();
+"""
+
+def changed_lines(diff: str):
+    """Get the removed and added lines of a unified diff."""
+    return [line for line in diff.splitlines() if line[:1] in "+-" and line[:3] not in ("---", "+++")]
+
+def test_patch_on_compacted_code_only_changes_edited_line():
+    compacted = compact_js(SCENE)
+    patched = apply_search_replace(compacted, [("color:0x00ff00", "color:0xff0000")])
+
+    edited = carry_over_edit(SCENE, patched)
+
+    assert edited == SCENE.replace("0x00ff00", "0xff0000")
+    assert changed_lines(make_unified_diff(SCENE, edited)) == [
+        "-const material = new THREE.MeshStandardMaterial({ color: 0x00ff00 });  // green",
+        "+const material = new THREE.MeshStandardMaterial({ color: 0xff0000 });  // green"
+    ]
+
+def test_inserted_statement_is_indented_like_its_neighbours():
+    compacted, elided = elide_boilerplate(compact_js(SCENE))
+    patched = apply_search_replace(compacted, [("cube.rotation.y+=0.01;", "cube.rotation.y+=0.01;\ncube.rotation.z+=0.02;")])
+
+    edited = carry_over_edit(SCENE, restore_boilerplate(patched, elided))
+
+    assert changed_lines(make_unified_diff(SCENE, edited)) == ["+    cube.rotation.z+=0.02;"]
+    assert "// Spin the cube" in edited and "/* The main cube */" in edited
+
+def test_full_rewrite_keeps_comments_of_unchanged_code():
+    rewritten = compact_js(SCENE).replace("light.position.set(5,5,5);", "light.position.set(1,2,3);")
+
+    edited = carry_over_edit(SCENE, rewritten)
+
+    assert edited == SCENE.replace("light.position.set(5, 5, 5);", "light.position.set(1, 2, 3);")
+
+class FakeMessages:
+    """Answers edit requests with canned responses, in order."""
+
+    def __init__(self, texts):
+        self.texts = list(texts)
+        self.requests = []
+
+    async def create(self, **params):
+        self.requests.append(params)
+        return SimpleNamespace(
+            content=[SimpleNamespace(text=self.texts.pop(0))],
+            usage=SimpleNamespace(input_tokens=100, output_tokens=10),
+            model="claude-test"
+        )
+
+def run_edit(monkeypatch, texts, edit_mode, elide=False):
+    """Run ClaudeEditTask.generate_edit with compaction on and a fake client."""
+    monkeypatch.setattr(settings, "EDIT_COMPACTION", True)
+    monkeypatch.setattr(settings, "SYNTAX_VALIDATION", False)
+    monkeypatch.setattr(settings, "COMPLEXITY_GUARD", False)
+    stored = []
+    monkeypatch.setattr(claude_tasks.scene_store, "put", lambda code, **kwargs: stored.append(code) or f"v{len(stored)}")
+    monkeypatch.setattr(claude_tasks.redis_service, "publish_event", lambda *args, **kwargs: None)
+
+    client = SimpleNamespace(messages=FakeMessages(texts))
+    response, new_code = asyncio.run(claude_tasks.ClaudeEditTask.generate_edit(
+        client, "task", SCENE, "", "make it red", 1024, 0.0,
+        base_version_id="base", edit_mode=edit_mode, elide=elide
+    ))
+    return response, new_code, stored, client.messages.requests
+
+def test_diff_mode_with_compaction_stores_and_diffs_the_original_code(monkeypatch):
+    patch = "<<<<<<< SEARCH\ncolor:0x00ff00\n=======\ncolor:0xff0000\n>>>>>>> REPLACE"
+
+    response, new_code, stored, _ = run_edit(monkeypatch, [patch], "diff")
+
+    assert response["mode"] == "patch"
+    assert stored == [new_code] and new_code == SCENE.replace("0x00ff00", "0xff0000")
+    assert len(changed_lines(response["diff"])) == 2
+
+def test_rewrite_mode_with_compaction_returns_the_original_formatting(monkeypatch):
+    rewrite = "```javascript\n" + compact_js(SCENE).replace("0x00ff00", "0xff0000") + "\n```"
+
+    response, new_code, _, _ = run_edit(monkeypatch, [rewrite], "full")
+
+    assert new_code == SCENE.replace("0x00ff00", "0xff0000")
+    assert response["content"] == f"```javascript\n{new_code}\n```"
+
+def test_elision_retry_counts_the_usage_of_both_calls(monkeypatch):
+    # The first answer drops the elided placeholders, so the edit is redone without elision
+    lost_placeholders = "```javascript\nconst scene = new THREE.Scene();\n```"
+    rewrite = "```javascript\n" + compact_js(SCENE).replace("0x00ff00", "0xff0000") + "\n```"
+
+    response, new_code, _, requests = run_edit(monkeypatch, [lost_placeholders, rewrite], "full", elide=True)
+
+    assert len(requests) == 2
+    assert new_code == SCENE.replace("0x00ff00", "0xff0000")
+    assert response["usage"] == {"input_tokens": 200, "output_tokens": 20, "total_tokens": 220}
@@ -0,0 +1,72 @@
+import asyncio
+import fakeredis
+from app.api.routes import event_generator
+from app.core.config import settings
+from app.core.redis import redis_service
+from app.core.serialization import loads
+
+class ConnectedRequest:
+    """A request whose client never disconnects."""
+
+    async def is_disconnected(self):
+        return False
+
+def collect_events(task_id, publish=None):
+    """Run the event stream of a task until it ends, calling publish once it has subscribed."""
+    async def run():
+        events = []
+        async for event in event_generator(task_id, ConnectedRequest()):
+            events.append(event)
+        return events
+
+    async def run_with_publisher():
+        stream = asyncio.ensure_future(run())
+        await asyncio.sleep(0.05)
+        if publish:
+            publish()
+        return await asyncio.wait_for(stream, timeout=5)
+
+    return asyncio.run(run_with_publisher())
+
+def use_fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_service, "_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(redis_service, "_raw_client", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(redis_service, "_async_client", fakeredis.FakeAsyncRedis(server=server))
+
+def test_task_finished_before_subscribing_sends_stored_response(monkeypatch):
+    use_fake_redis(monkeypatch)
+    redis_service.store_response("task", {"status": "success", "content": "done", "task_id": "task"})
+
+    events = collect_events("task")
+
+    assert [event["event"] for event in events] == ["complete"]
+    assert loads(events[0]["data"])["content"] == "done"
+
+def test_stored_error_is_sent_as_error_event(monkeypatch):
+    use_fake_redis(monkeypatch)
+    redis_service.store_response("task", {"status": "error", "error": "boom", "task_id": "task"})
+
+    events = collect_events("task")
+
+    assert [event["event"] for event in events] == ["error"]
+
+def test_published_events_are_forwarded_until_complete(monkeypatch):
+    use_fake_redis(monkeypatch)
+
+    def publish():
+        redis_service.publish_event("task", "chunk", {"text": "a"})
+        redis_service.publish_event("task", "complete", {"status": "success"})
+
+    events = collect_events("task", publish=publish)
+
+    assert [event["event"] for event in events] == ["chunk", "complete"]
+
+def test_response_stored_after_subscribing_is_picked_up(monkeypatch):
+    # The final event was published just before the client subscribed
+    use_fake_redis(monkeypatch)
+    monkeypatch.setattr(settings, "SSE_RESPONSE_CHECK_SECONDS", 0.1)
+
+    events = collect_events("task", publish=lambda: redis_service.store_response("task", {"status": "success", "task_id": "task"}))
+
+    assert [event["event"] for event in events] == ["complete"]
@@ -0,0 +1,31 @@
+import pytest
+from app.core.js import check_syntax, JSSyntaxError
+
+# Valid code using syntax newer than esprima's ES2017 parser
+MODERN_CODE = [
+    "class A { speed = 1 }",
+    "class A { static count = 0; static make() {} }",
+    "class A { static { init(); } }",
+    "try { f() } catch { g() }",
+    "const a = 1_000_000;",
+    "const b = 10n;",
+    "async function* gen() { yield 1 }",
+    "for await (const x of xs) {}",
+    "const url = import.meta.url;",
+    "const module = await import('./module.js');",
+    "const v = a?.b ?? c;",
+]
+
+@pytest.mark.parametrize("code", MODERN_CODE)
+def test_modern_syntax_is_not_reported(code):
+    check_syntax(code)
+
+def test_class_methods_still_get_a_full_parse():
+    with pytest.raises(JSSyntaxError) as error:
+        check_syntax("class C { m() { return 1 } get v() { return 2 } }\nconst y = ;")
+    assert (error.value.line, error.value.column) == (2, 11)
+
+def test_error_message_has_no_wrapper_line_number():
+    with pytest.raises(JSSyntaxError) as error:
+        check_syntax("const x = 1;\nconst y = ;")
+    assert str(error.value) == "Unexpected token ; (line 2, column 11)"
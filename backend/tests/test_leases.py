@@ -0,0 +1,23 @@
+import fakeredis
+from app.core.redis import redis_service
+
+def test_lease_is_renewed_only_by_its_owner(monkeypatch):
+    monkeypatch.setattr(redis_service, "_client", fakeredis.FakeRedis(decode_responses=True))
+
+    assert redis_service.acquire_lease("poll", "a", 10)
+    assert redis_service.acquire_lease("poll", "a", 30)
+    assert redis_service.client.ttl("lease:poll") == 30
+
+    assert not redis_service.acquire_lease("poll", "b", 60)
+    assert redis_service.client.ttl("lease:poll") == 30
+
+def test_expired_lease_passes_to_another_owner(monkeypatch):
+    monkeypatch.setattr(redis_service, "_client", fakeredis.FakeRedis(decode_responses=True))
+    redis_service.acquire_lease("poll", "a", 10)
+
+    # The lease expires and another instance takes it before a can renew
+    redis_service.client.delete("lease:poll")
+    assert redis_service.acquire_lease("poll", "b", 10)
+
+    assert not redis_service.acquire_lease("poll", "a", 10)
+    assert redis_service.client.get("lease:poll") == "b"
@@ -0,0 +1,37 @@
+import fakeredis
+import pytest
+from app.core.artifacts import artifact_store
+from app.core.config import settings
+from app.core.profiling import save_profile, get_profile
+from app.core.redis import redis_service
+from app.core.scenes import scene_store
+
+@pytest.fixture(params=["json", "msgpack"])
+def value_format(request, monkeypatch):
+    monkeypatch.setattr(settings, "REDIS_VALUE_FORMAT", request.param)
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_service, "_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(redis_service, "_raw_client", fakeredis.FakeRedis(server=server))
+    return request.param
+
+def test_artifacts_are_stored_in_the_value_format(value_format):
+    ref = artifact_store.put("aGVsbG8=", "image", "image/png")
+
+    assert artifact_store.get(ref) == {"kind": "image", "mime_type": "image/png", "data": "aGVsbG8="}
+    assert redis_service.raw_client.get(f"artifact:{ref}").startswith(b"{") == (value_format == "json")
+
+def test_scene_versions_round_trip(value_format):
+    version_id = scene_store.put("const a = 1;", parent_id="parent")
+
+    version = scene_store.get(version_id)
+    assert (version["version_id"], version["code"], version["parent_id"]) == (version_id, "const a = 1;", "parent")
+
+def test_profiles_keep_their_binary_payload(value_format):
+    profile_id = save_profile(b"\x00\xffprofile", "pstats", "sample", "api@host:1")
+
+    assert get_profile(profile_id)["data"] == b"\x00\xffprofile"
+
+def test_values_stored_as_json_still_load_as_msgpack(value_format):
+    redis_service.set_value("artifact:old", '{"kind": "text", "mime_type": null, "data": "x"}')
+
+    assert artifact_store.get("old")["data"] == "x"
@@ -0,0 +1,30 @@
+import asyncio
+from app.core import repair
+from app.core.repair import validate_and_repair
+
+BROKEN = "const scene = new THREE.Scene();\nconst x = ;\n"
+
+def test_provider_error_returns_the_unrepaired_code(monkeypatch):
+    outcomes = []
+    monkeypatch.setattr(repair, "record_repair", lambda provider, outcome, latency_ms=0.0: outcomes.append(outcome))
+
+    async def complete(prompt: str, max_tokens: int) -> str:
+        raise RuntimeError("429 Too Many Requests")
+
+    code, report = asyncio.run(validate_and_repair(BROKEN, complete, "claude"))
+
+    assert code == BROKEN
+    assert report["repaired"] is False and report["attempts"] == 1
+    assert report["provider_error"] == "RuntimeError: 429 Too Many Requests"
+    assert outcomes == ["failed"]
+
+def test_repair_patch_is_applied(monkeypatch):
+    monkeypatch.setattr(repair, "record_repair", lambda *args, **kwargs: None)
+
+    async def complete(prompt: str, max_tokens: int) -> str:
+        return "<<<<<<< SEARCH\nconst x = ;\n=======\nconst x = 1;\n>>>>>>> REPLACE"
+
+    code, report = asyncio.run(validate_and_repair(BROKEN, complete, "claude"))
+
+    assert code == BROKEN.replace("const x = ;", "const x = 1;")
+    assert report["repaired"] is True
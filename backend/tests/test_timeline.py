@@ -0,0 +1,14 @@
+import time
+import fakeredis
+from app.core.redis import redis_service
+
+def test_worker_storing_before_api_stages_is_reindexed(monkeypatch):
+    monkeypatch.setattr(redis_service, "_client", fakeredis.FakeRedis(decode_responses=True))
+    now = time.time()
+
+    # A fast worker stores its response before the API records when it queued the task
+    redis_service.store_timeline("task", {"started": now + 0.5, "stored": now + 3.0})
+    redis_service.store_timeline("task", {"accepted": now, "enqueued": now + 0.25})
+
+    assert redis_service.get_timeline("task")["total_seconds"] == 3.0
+    assert redis_service.client.zscore("task_timeline_durations", "task") == 3.0
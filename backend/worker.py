@@ -1,20 +1,58 @@
 # Run Celery worker for processing Claude requests
 from app.core.celery_app import celery_app
-import os
+from app.core.config import settings
 
-def run_worker():
-    """Start the Celery worker process."""
-    celery_command = "celery -A worker worker --loglevel=info"
-    print(f"Starting Celery worker with command: {celery_command}")
-    os.system(celery_command)
+def run_worker(concurrency=None, pool=None, queues=None, prefetch_multiplier=None,
+               max_tasks_per_child=None, loglevel="info", hostname=None):
+    """Start a Celery worker in this process.
+
+    Defaults come from the WORKER_* settings. Use the solo or threads pool to
+    debug tasks in a single process; the prefork pool isolates tasks from each
+    other and is what production runs.
+    """
+    argv = [
+        "worker",
+        f"--loglevel={loglevel}",
+        f"--concurrency={concurrency or settings.WORKER_CONCURRENCY}",
+        f"--pool={pool or settings.WORKER_POOL}",
+        f"--queues={queues or settings.WORKER_QUEUES}",
+        f"--prefetch-multiplier={prefetch_multiplier or settings.WORKER_PREFETCH_MULTIPLIER}"
+    ]
+    if max_tasks_per_child:
+        argv.append(f"--max-tasks-per-child={max_tasks_per_child}")
+    if hostname:
+        argv.append(f"--hostname={hostname}")
+
+    print(f"Starting Celery worker: {' '.join(argv)}")
+    celery_app.worker_main(argv)
 
 if __name__ == "__main__":
-    # This file is a module that imports celery_app
-    # To run the worker, use the command: celery -A worker worker --loglevel=info
-    print("Usage: celery -A worker worker --loglevel=info")
-    print("Or run with: python -m worker run")
-    
-    # Check if run command is given
-    import sys
-    if len(sys.argv) > 1 and sys.argv[1] == "run":
-        run_worker()
+    # This file is a module that exposes celery_app, so the Celery CLI works too:
+    # celery -A worker worker --loglevel=info
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a Celery worker for the API's tasks")
+    parser.add_argument("command", nargs="?", choices=["run"], help="Start the worker")
+    parser.add_argument("--concurrency", type=int, help="Child processes or threads (default: WORKER_CONCURRENCY)")
+    parser.add_argument("--pool", type=str, choices=["prefork", "threads", "solo", "gevent", "eventlet"], help="Execution pool (default: WORKER_POOL)")
+    parser.add_argument("--queues", type=str, help="Comma-separated queues to consume (default: WORKER_QUEUES)")
+    parser.add_argument("--prefetch-multiplier", type=int, help="Tasks each process reserves ahead (default: WORKER_PREFETCH_MULTIPLIER)")
+    parser.add_argument("--max-tasks-per-child", type=int, help="Replace a prefork child after this many tasks")
+    parser.add_argument("--loglevel", type=str, default="info", help="Log level")
+    parser.add_argument("--hostname", type=str, help="Worker node name, e.g. worker1@%%h")
+
+    args = parser.parse_args()
+
+    if args.command != "run":
+        print("Usage: celery -A worker worker --loglevel=info")
+        print("Or run with: python -m worker run [--concurrency N] [--pool prefork] [--queues celery]")
+    else:
+        run_worker(
+            concurrency=args.concurrency,
+            pool=args.pool,
+            queues=args.queues,
+            prefetch_multiplier=args.prefetch_multiplier,
+            max_tasks_per_child=args.max_tasks_per_child,
+            loglevel=args.loglevel,
+            hostname=args.hostname
+        )
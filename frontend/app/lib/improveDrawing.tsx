@@ -125,6 +125,17 @@ export async function improveDrawing(editor: Editor) {
   }
 }
 
+// Get the first image from the stored task result, for subscribers that missed its image event
+async function fetchStoredImage(taskId: string): Promise<string> {
+  const response = await fetch(`http://localhost:8000/api/task/${taskId}`)
+  const data = await response.json()
+  const image = data.result?.images?.[0]?.image_base64
+  if (!image) {
+    throw Error('Generated image is no longer available')
+  }
+  return image
+}
+
 // Function to wait for the image generation to complete via SSE
 async function waitForImageGeneration(taskId: string): Promise<{ image: string, width: number, height: number } | null> {
   return new Promise((resolve, reject) => {
@@ -148,11 +159,19 @@ async function waitForImageGeneration(taskId: string): Promise<{ image: string,
         eventSource.close()
       }
       
+      // Full images arrive in their own events; "complete" only references them by image_id
+      const streamedImages = new Map<string, string>()
+      
       eventSource.addEventListener('start', (event) => {
         console.log('Image generation started')
       })
       
-      eventSource.addEventListener('complete', (event) => {
+      eventSource.addEventListener('image', (event) => {
+        const data = JSON.parse((event as MessageEvent).data)
+        streamedImages.set(data.image_id, data.image_base64)
+      })
+      
+      eventSource.addEventListener('complete', async (event) => {
         try {
           const data = JSON.parse((event as MessageEvent).data)
           console.log('Complete event received:', data)
@@ -161,7 +180,7 @@ async function waitForImageGeneration(taskId: string): Promise<{ image: string,
             // Return the first generated image with its dimensions
             const imageData = data.images[0]
             resolve({
-              image: imageData.image_base64,
+              image: imageData.image_base64 || streamedImages.get(imageData.image_id) || await fetchStoredImage(taskId),
               width: imageData.width || 500, // Default width if not provided
               height: imageData.height || 500 // Default height if not provided
             })